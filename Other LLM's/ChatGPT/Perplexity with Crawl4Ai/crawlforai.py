@@ -46,25 +46,35 @@ from playwright_stealth import stealth_async
 from crawl4ai import AsyncWebCrawler
 import re
 import random
+from llm_backend import LLMReplayMissError, create_backend, get_backend_mode
 
-# Setup Gemini API
+# Setup Gemini API (not needed when LLM_BACKEND_MODE=replay serves recorded responses)
+LLM_BACKEND_MODE = get_backend_mode()
 GEMINI_API_KEY = os.environ.get('GEMINI_API_KEY')
-if not GEMINI_API_KEY:
+if not GEMINI_API_KEY and LLM_BACKEND_MODE != "replay":
     raise ValueError("GEMINI_API_KEY environment variable is required. Please set it before running the script.")
-genai.configure(api_key=GEMINI_API_KEY)
+if GEMINI_API_KEY:
+    genai.configure(api_key=GEMINI_API_KEY)
 
-# Use the correct model name based on Google AI Studio
-try:
-    model = genai.GenerativeModel('gemini-2.0-flash')
-except:
-    try:
-        model = genai.GenerativeModel('gemini-1.5-flash')
-    except:
+# Use the correct model name based on Google AI Studio, most preferred first
+GEMINI_MODEL_NAMES = ['gemini-2.0-flash', 'gemini-1.5-flash', 'gemini-pro', 'gemini-1.0-pro']
+
+def create_gemini_model():
+    """(name, model) of the first Gemini model the SDK accepts"""
+    for model_name in GEMINI_MODEL_NAMES[:-1]:
         try:
-            model = genai.GenerativeModel('gemini-pro')
-        except:
-            # Fallback to the most common model name
-            model = genai.GenerativeModel('gemini-1.0-pro')
+            return model_name, genai.GenerativeModel(model_name)
+        except Exception:
+            continue
+    # Fallback to the most common model name
+    return GEMINI_MODEL_NAMES[-1], genai.GenerativeModel(GEMINI_MODEL_NAMES[-1])
+
+if LLM_BACKEND_MODE == "replay":
+    # Replay never builds a model, recordings are labelled with the preferred one
+    model = create_backend(GEMINI_MODEL_NAMES[0], create_gemini_model, LLM_BACKEND_MODE)
+else:
+    gemini_model_name, gemini_model = create_gemini_model()
+    model = create_backend(gemini_model_name, lambda: gemini_model, LLM_BACKEND_MODE)
 
 def preprocess_raw_response(raw_text: str) -> str:
     """Enhanced preprocessing to make table structure more apparent"""
@@ -435,7 +445,7 @@ OUTPUT (JSON only):
 """
     
     try:
-        response = model.generate_content(prompt)
+        response = model.generate(prompt)
         result_text = response.text.strip()
         
         # Clean the response text
@@ -467,6 +477,9 @@ OUTPUT (JSON only):
         
         return result
         
+    except LLMReplayMissError:
+        # A replay run without a recording for this prompt is a broken fixture, not a Gemini failure
+        raise
     except Exception as e:
         print(f"Error formatting with Gemini: {e}")
         
@@ -0,0 +1,243 @@
+"""Pluggable LLM backend with live, record and replay modes
+
+LLM_BACKEND_MODE selects how prompts are answered:
+
+- live: call the Gemini model directly (default)
+- record: call the model and store each response under LLM_RECORDINGS_DIR,
+  keyed by the SHA-256 of the prompt
+- replay: answer from the recordings without network access or an API key.
+  LLM_REPLAY_LATENCY_MS replaces the recorded latency with a fixed one,
+  LLM_REPLAY_LATENCY_JITTER spreads it by +/- that fraction (derived from the
+  prompt hash, so runs are repeatable) and LLM_REPLAY_TOKENS=estimate reports
+  four characters per token instead of the recorded token counts.
+
+The same file is shipped with the web scraper, the query generator and the
+Perplexity/ChatGPT formatter, since each is built from its own directory. Edit
+Web Scrapper/RDS/llm_backend.py and run ``python check_llm_backend_copies.py --sync``
+from the repository root; without --sync it fails when a copy has diverged.
+"""
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from abc import ABC, abstractmethod
+from dataclasses import dataclass
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Callable, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+MODES = ("live", "record", "replay")
+
+
+class LLMReplayMissError(KeyError):
+    """Raised in replay mode when no recording exists for a prompt"""
+
+
+@dataclass
+class LLMResponse:
+    text: str
+    input_tokens: int = 0
+    output_tokens: int = 0
+    latency_ms: float = 0.0
+    source: str = "live"
+
+
+def prompt_hash(prompt: str) -> str:
+    return hashlib.sha256(prompt.encode("utf-8")).hexdigest()
+
+
+def get_backend_mode() -> str:
+    mode = os.getenv("LLM_BACKEND_MODE", "live").lower()
+    if mode not in MODES:
+        logger.warning(f"⚠️ Unknown LLM_BACKEND_MODE {mode!r}, using live")
+        return "live"
+    return mode
+
+
+class RecordingStore:
+    """One JSON file per prompt hash; writes are atomic so concurrent workers can share a directory"""
+
+    def __init__(self, directory: str):
+        self.directory = Path(directory)
+
+    def _path(self, key: str) -> Path:
+        return self.directory / f"{key}.json"
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        try:
+            with open(self._path(key), encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            logger.warning(f"⚠️ Unreadable LLM recording {key}: {e}")
+            return None
+
+    def put(self, key: str, entry: Dict[str, Any]):
+        self.directory.mkdir(parents=True, exist_ok=True)
+        path = self._path(key)
+        tmp_path = path.with_suffix(f".{os.getpid()}.{threading.get_ident()}.tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(entry, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+
+
+class LLMBackend(ABC):
+    """Common interface: generate() for synchronous callers, generate_async() for asyncio ones"""
+
+    mode = "live"
+
+    def __init__(self, model_name: str):
+        self.model_name = model_name
+        self.stats = {"mode": self.mode, "calls": 0, "recorded": 0, "replayed": 0, "misses": 0}
+        self._lock = threading.Lock()
+
+    def _count(self, key: str):
+        with self._lock:
+            self.stats[key] += 1
+
+    @abstractmethod
+    def generate(self, prompt: str) -> LLMResponse:
+        """Answer a prompt, blocking the calling thread"""
+
+    @abstractmethod
+    async def generate_async(self, prompt: str) -> LLMResponse:
+        """Answer a prompt without blocking the event loop"""
+
+
+class LiveBackend(LLMBackend):
+    """Calls a google.generativeai GenerativeModel (or anything with the same generate methods)"""
+
+    def __init__(self, model: Any, model_name: str):
+        super().__init__(model_name)
+        self.model = model
+
+    @staticmethod
+    def _to_response(response: Any, latency_ms: float) -> LLMResponse:
+        usage = getattr(response, "usage_metadata", None)
+        return LLMResponse(
+            text=response.text or "",
+            input_tokens=getattr(usage, "prompt_token_count", 0) or 0,
+            output_tokens=getattr(usage, "candidates_token_count", 0) or 0,
+            latency_ms=round(latency_ms, 1),
+            source="live"
+        )
+
+    def generate(self, prompt: str) -> LLMResponse:
+        self._count("calls")
+        start = time.perf_counter()
+        response = self.model.generate_content(prompt)
+        return self._to_response(response, (time.perf_counter() - start) * 1000)
+
+    async def generate_async(self, prompt: str) -> LLMResponse:
+        self._count("calls")
+        start = time.perf_counter()
+        response = await self.model.generate_content_async(prompt)
+        return self._to_response(response, (time.perf_counter() - start) * 1000)
+
+
+class RecordingBackend(LiveBackend):
+    """Live calls whose responses are also written to a RecordingStore"""
+
+    mode = "record"
+
+    def __init__(self, model: Any, model_name: str, store: RecordingStore):
+        super().__init__(model, model_name)
+        self.store = store
+
+    def _record(self, prompt: str, response: LLMResponse):
+        try:
+            self.store.put(prompt_hash(prompt), {
+                "model_name": self.model_name,
+                "text": response.text,
+                "input_tokens": response.input_tokens,
+                "output_tokens": response.output_tokens,
+                "latency_ms": response.latency_ms,
+                "prompt_chars": len(prompt),
+                "recorded_at": datetime.now().isoformat()
+            })
+            self._count("recorded")
+        except OSError as e:
+            logger.warning(f"⚠️ Could not record LLM response: {e}")
+
+    def generate(self, prompt: str) -> LLMResponse:
+        response = super().generate(prompt)
+        self._record(prompt, response)
+        return response
+
+    async def generate_async(self, prompt: str) -> LLMResponse:
+        response = await super().generate_async(prompt)
+        await asyncio.to_thread(self._record, prompt, response)
+        return response
+
+
+class ReplayBackend(LLMBackend):
+    """Serves recorded responses with recorded or synthetic latency and token counts"""
+
+    mode = "replay"
+
+    def __init__(self, model_name: str, store: RecordingStore, latency_ms: Optional[float] = None,
+                 jitter: float = 0.0, tokens: str = "recorded"):
+        super().__init__(model_name)
+        self.store = store
+        self.latency_ms = latency_ms
+        self.jitter = max(0.0, min(jitter, 1.0))
+        self.tokens = tokens
+
+    def _lookup(self, prompt: str) -> tuple:
+        """(response, seconds to wait) for a prompt"""
+        self._count("calls")
+        key = prompt_hash(prompt)
+        entry = self.store.get(key)
+        if entry is None:
+            self._count("misses")
+            raise LLMReplayMissError(f"No recorded response for prompt {key[:12]} in {self.store.directory}")
+        self._count("replayed")
+        latency_ms = entry.get("latency_ms", 0.0) if self.latency_ms is None else self.latency_ms
+        if self.jitter:
+            spread = int(key[:8], 16) / 0xFFFFFFFF * 2 - 1
+            latency_ms *= 1 + self.jitter * spread
+        text = entry.get("text", "")
+        if self.tokens == "estimate":
+            input_tokens, output_tokens = len(prompt) // 4, len(text) // 4
+        else:
+            input_tokens, output_tokens = entry.get("input_tokens", 0), entry.get("output_tokens", 0)
+        response = LLMResponse(text=text, input_tokens=input_tokens, output_tokens=output_tokens,
+                               latency_ms=round(latency_ms, 1), source="replay")
+        return response, latency_ms / 1000
+
+    def generate(self, prompt: str) -> LLMResponse:
+        response, delay = self._lookup(prompt)
+        time.sleep(delay)
+        return response
+
+    async def generate_async(self, prompt: str) -> LLMResponse:
+        response, delay = self._lookup(prompt)
+        await asyncio.sleep(delay)
+        return response
+
+
+def create_backend(model_name: str, model_factory: Callable[[], Any], mode: Optional[str] = None) -> LLMBackend:
+    """Backend for LLM_BACKEND_MODE; model_factory is only called in live and record modes"""
+    mode = mode or get_backend_mode()
+    if mode == "live":
+        return LiveBackend(model_factory(), model_name)
+    store = RecordingStore(os.getenv("LLM_RECORDINGS_DIR", "/tmp/llm_recordings"))
+    if mode == "record":
+        logger.info(f"⏺️ Recording LLM responses to {store.directory}")
+        return RecordingBackend(model_factory(), model_name, store)
+    latency = os.getenv("LLM_REPLAY_LATENCY_MS", "")
+    backend = ReplayBackend(
+        model_name,
+        store,
+        latency_ms=float(latency) if latency else None,
+        jitter=float(os.getenv("LLM_REPLAY_LATENCY_JITTER", "0")),
+        tokens=os.getenv("LLM_REPLAY_TOKENS", "recorded").lower()
+    )
+    logger.info(f"⏯️ Replaying LLM responses from {store.directory}")
+    return backend
@@ -12,6 +12,8 @@ print(f"[INIT] Starting Lambda initialization at {datetime.utcnow().isoformat()}
 import boto3
 print(f"[INIT] boto3 imported at {datetime.utcnow().isoformat()}")
 
+from llm_backend import create_backend, get_backend_mode
+
 # ────────────────────────────────────────────────────────────────────────────────
 # Environment variables with defaults and validation
 # ────────────────────────────────────────────────────────────────────────────────
@@ -323,17 +325,20 @@ def generate_questions(product_info: dict, num_questions: int = 25) -> Dict[str,
     """Generate product-specific and market-specific questions via Gemini."""
     print(f"[AI] Generating {num_questions} questions for product: {product_info.get('name', 'unknown')}")
     
-    lazy_import_genai()
+    llm_mode = get_backend_mode()
     
     try:
-        # Get Gemini API key from Secrets Manager
         start_time = time.time()
-        gem_cfg = get_secret(SECRET_NAME_GEMINI)
-        api_key = gem_cfg["GEMINI_API_KEY"]
-        
-        print(f"[AI] Configuring Gemini API")
-        genai.configure(api_key=api_key)
-        model = genai.GenerativeModel("gemini-1.5-flash")
+        if llm_mode != "replay":
+            lazy_import_genai()
+            # Get Gemini API key from Secrets Manager
+            gem_cfg = get_secret(SECRET_NAME_GEMINI)
+            api_key = gem_cfg["GEMINI_API_KEY"]
+            
+            print(f"[AI] Configuring Gemini API")
+            genai.configure(api_key=api_key)
+        print(f"[AI] LLM backend mode: {llm_mode}")
+        model = create_backend("gemini-1.5-flash", lambda: genai.GenerativeModel("gemini-1.5-flash"), llm_mode)
 
         summary = "\n".join(f"{k}: {v}" for k, v in product_info.items())
         print(f"[AI] Product summary length: {len(summary)} characters")
@@ -366,13 +371,13 @@ def generate_questions(product_info: dict, num_questions: int = 25) -> Dict[str,
 
         print(f"[AI] Generating product-specific questions...")
         prod_start = time.time()
-        prod_resp = model.generate_content(prod_prompt)
+        prod_resp = model.generate(prod_prompt)
         prod_elapsed = time.time() - prod_start
         print(f"[AI] Product questions generated in {prod_elapsed:.2f}s")
         
         print(f"[AI] Generating market-specific questions...")
         market_start = time.time()
-        market_resp = model.generate_content(market_prompt)
+        market_resp = model.generate(market_prompt)
         market_elapsed = time.time() - market_start
         print(f"[AI] Market questions generated in {market_elapsed:.2f}s")
         
@@ -3,34 +3,62 @@ import json
 import os
 import time
 import re
+import math
 import sys
 import argparse
-from typing import List, Dict, Any, Set, Optional
+import socket
+import contextvars
+from typing import List, Dict, Any, Set, Optional, Callable, Tuple, AsyncIterator
 from pydantic import BaseModel
 from dotenv import load_dotenv
 import google.generativeai as genai
-from crawl4ai import AsyncWebCrawler, CrawlerRunConfig, CacheMode, AsyncUrlSeeder, SeedingConfig
+from crawl4ai import AsyncWebCrawler, BrowserConfig, CrawlerRunConfig, CacheMode, AsyncUrlSeeder, SeedingConfig
+from crawl4ai import CrawlResult, DefaultMarkdownGenerator, LXMLWebScrapingStrategy
 
 import logging
-from urllib.parse import urlparse, urljoin
-from base64 import b64decode
+from urllib.parse import urlparse, urljoin, urlunparse, parse_qsl, urlencode
+from urllib.robotparser import RobotFileParser
+import urllib.request
 import csv
 from pathlib import Path
 import hashlib
-from datetime import datetime
+import fnmatch
+import gzip
+import zlib
+import heapq
+import xml.etree.ElementTree as ET
+from datetime import datetime, timedelta, timezone
 import boto3
 from botocore.exceptions import ClientError, NoCredentialsError
 import io
 import uuid
 import psycopg2
 from psycopg2.pool import ThreadedConnectionPool
-from psycopg2.extras import RealDictCursor
+from psycopg2.extras import RealDictCursor, Json, execute_values
+import lxml.html
+import httpx
 import threading
 from contextlib import contextmanager
+from collections import Counter
+from array import array
+from llm_backend import create_backend, get_backend_mode
+
+try:
+    from PIL import Image  # optional, only needed for SCREENSHOT_FORMAT=webp
+except ImportError:
+    Image = None
 
 # Set up logging
 logging.basicConfig(level=os.getenv("LOG_LEVEL", "INFO"), format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
+# EMF records are bare JSON lines on stderr: CloudWatch Logs extracts them as metrics, and stdout stays free for
+# the API response JSON that main() prints in event mode
+emf_logger = logging.getLogger(f"{__name__}.emf")
+emf_handler = logging.StreamHandler(sys.stderr)
+emf_handler.setFormatter(logging.Formatter('%(message)s'))
+emf_logger.addHandler(emf_handler)
+emf_logger.setLevel(logging.INFO)
+emf_logger.propagate = False
 
 # Load environment variables
 load_dotenv()
@@ -57,7 +85,7 @@ def get_secret(secret_name="Gemini-API-ChatGPT", region_name="us-east-1"):
         except json.JSONDecodeError:
             logger.info("Secret is not in JSON format, returning as plain text")
             return secret_string
-    except ClientError as e:
+    except (ClientError, NoCredentialsError) as e:
         logger.error(f"Failed to retrieve secret: {e}")
         return None
 
@@ -117,6 +145,9 @@ class TokenUsage(BaseModel):
     model_name: str
     timestamp: str
     pricing_tier: str
+    cache_hits: int = 0
+    cache_misses: int = 0
+    cost_saved: float = 0.0
 
 class CrawlMetrics(BaseModel):
     url: str
@@ -127,10 +158,27 @@ class CrawlMetrics(BaseModel):
     success: bool
     error_message: Optional[str] = None
     token_usage: Optional[TokenUsage] = None
+    page_setup_ms: Optional[float] = None
+    status_code: Optional[int] = None
+    rate_limit: Optional[Dict[str, Any]] = None
+    fetch_status: Optional[str] = None
+    fetch_tier: Optional[str] = None
+    escalation_reason: Optional[str] = None
+    extraction_source: Optional[str] = None
+    screenshot_ms: Optional[float] = None
+    screenshot_bytes: Optional[int] = None
+    blocked_requests: Optional[int] = None
+    near_duplicate_of: Optional[str] = None
+    stage_ms: Optional[Dict[str, float]] = None
+    markdown_chars: Optional[int] = None
+    reduced_markdown_chars: Optional[int] = None
+    markdown_reduction_ratio: Optional[float] = None
 
 class DatabaseManager:
     """PostgreSQL RDS database manager with connection pooling"""
 
+    REQUIRED_TABLES = ['scrapejobs', 'products', 'jobselectedproducts', 'pagefetchledger', 'urlsitemapstate', 'domaincrawlstate', 'templateyield', 'domainfetchtier', 'crawlcheckpoints', 'crawlfrontier', 'extractioncache']
+
     def __init__(self):
         logger.info("🗄️ Initializing PostgreSQL Database Manager")
         self.pool = None
@@ -142,7 +190,20 @@ class DatabaseManager:
         logger.info("✅ Database Manager initialized successfully")
 
     def _get_rds_credentials(self):
-        """Get RDS credentials from AWS Secrets Manager"""
+        """Get RDS credentials from AWS Secrets Manager, or from DB_* variables when DB_CREDENTIALS_SOURCE=env"""
+        if os.getenv("DB_CREDENTIALS_SOURCE", "secretsmanager").lower() == "env":
+            logger.info("🔑 Using database credentials from DB_* environment variables")
+            self.rds_credentials = {
+                'DB_HOST': os.getenv("DB_HOST", "localhost"),
+                'DB_NAME': os.getenv("DB_NAME"),
+                'DB_USER': os.getenv("DB_USER"),
+                'DB_PASSWORD': os.getenv("DB_PASSWORD", ""),
+                'DB_PORT': os.getenv("DB_PORT", "5432")
+            }
+            missing_keys = [key for key in ('DB_NAME', 'DB_USER') if not self.rds_credentials[key]]
+            if missing_keys:
+                raise EnvironmentError(f"Missing database environment variables: {missing_keys}")
+            return
         logger.info("🔑 Retrieving RDS credentials from AWS Secrets Manager")
         try:
             self.rds_credentials = get_rds_secret()
@@ -211,41 +272,23 @@ class DatabaseManager:
         try:
             with self.get_connection() as conn:
                 with conn.cursor() as cur:
-                    # Check if scrapejobs table exists
-                    cur.execute("""
-                        SELECT EXISTS (
-                            SELECT FROM information_schema.tables
-                            WHERE table_schema = 'public'
-                              AND table_name = 'scrapejobs'
-                        );
-                    """)
-                    scrapejobs_exists = cur.fetchone()[0]
-
-                    # Check if products table exists
-                    cur.execute("""
-                        SELECT EXISTS (
-                            SELECT FROM information_schema.tables
-                            WHERE table_schema = 'public'
-                              AND table_name = 'products'
-                        );
-                    """)
-                    products_exists = cur.fetchone()[0]
-
-                    # Check if jobselectedproducts table exists
-                    cur.execute("""
-                        SELECT EXISTS (
-                            SELECT FROM information_schema.tables
-                            WHERE table_schema = 'public'
-                              AND table_name = 'jobselectedproducts'
-                        );
-                    """)
-                    jobselectedproducts_exists = cur.fetchone()[0]
-
-                    if scrapejobs_exists and products_exists and jobselectedproducts_exists:
+                    missing_tables = []
+                    for table_name in self.REQUIRED_TABLES:
+                        cur.execute("""
+                            SELECT EXISTS (
+                                SELECT FROM information_schema.tables
+                                WHERE table_schema = 'public'
+                                  AND table_name = %s
+                            );
+                        """, (table_name,))
+                        if not cur.fetchone()[0]:
+                            missing_tables.append(table_name)
+
+                    if not missing_tables:
                         logger.info("✅ All required tables already exist, skipping table creation")
                         return
                     else:
-                        logger.info("📋 Some tables are missing, creating them...")
+                        logger.info(f"📋 Missing tables {missing_tables}, creating them...")
                         self._create_tables()
         except Exception as e:
             logger.error(f"❌ Error checking table existence: {e}")
@@ -294,6 +337,95 @@ class DatabaseManager:
             created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
             PRIMARY KEY (job_id, product_id)
         );
+        -- Create pagefetchledger table (per-URL validators and last extraction for conditional re-crawls)
+        CREATE TABLE IF NOT EXISTS pagefetchledger (
+            url TEXT PRIMARY KEY,
+            domain VARCHAR(255) NOT NULL,
+            etag TEXT,
+            last_modified TEXT,
+            content_sha256 VARCHAR(64),
+            products JSONB DEFAULT '[]'::jsonb,
+            s3_markdown_url TEXT,
+            last_status_code INTEGER,
+            last_job_id UUID,
+            last_fetched_at TIMESTAMP WITH TIME ZONE,
+            created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+        );
+        -- Create urlsitemapstate table (sitemap lastmod per URL and the lastmod seen when it was last crawled)
+        CREATE TABLE IF NOT EXISTS urlsitemapstate (
+            url TEXT PRIMARY KEY,
+            domain VARCHAR(255) NOT NULL,
+            lastmod TEXT,
+            changefreq VARCHAR(32),
+            crawled_lastmod TEXT,
+            last_crawled_at TIMESTAMP WITH TIME ZONE,
+            last_crawled_job_id UUID,
+            first_seen_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+            last_seen_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+        );
+        -- Create domaincrawlstate table (last successful job per domain)
+        CREATE TABLE IF NOT EXISTS domaincrawlstate (
+            domain VARCHAR(255) PRIMARY KEY,
+            last_success_job_id UUID,
+            last_success_at TIMESTAMP WITH TIME ZONE
+        );
+        -- Create templateyield table (historical products per page for each URL path template)
+        CREATE TABLE IF NOT EXISTS templateyield (
+            domain VARCHAR(255) NOT NULL,
+            template TEXT NOT NULL,
+            pages_crawled INTEGER DEFAULT 0,
+            products_found INTEGER DEFAULT 0,
+            updated_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (domain, template)
+        );
+        -- Create domainfetchtier table (decayed HTTP-tier attempts and browser escalations per domain)
+        CREATE TABLE IF NOT EXISTS domainfetchtier (
+            domain VARCHAR(255) PRIMARY KEY,
+            http_attempts REAL DEFAULT 0,
+            escalations REAL DEFAULT 0,
+            updated_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+        );
+        -- Create crawlcheckpoints table (per-URL progress of a job, used to resume a retried job)
+        CREATE TABLE IF NOT EXISTS crawlcheckpoints (
+            job_id UUID NOT NULL,
+            url TEXT NOT NULL,
+            url_index INTEGER,
+            status VARCHAR(20) NOT NULL,
+            crawl_result JSONB DEFAULT '{}'::jsonb,
+            products JSONB DEFAULT '[]'::jsonb,
+            s3_markdown_url TEXT,
+            s3_screenshot_url TEXT,
+            updated_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (job_id, url)
+        );
+        -- Create extractioncache table (Gemini extractions keyed by content hash, prompt version and model)
+        CREATE TABLE IF NOT EXISTS extractioncache (
+            cache_key VARCHAR(64) PRIMARY KEY,
+            content_sha256 VARCHAR(64) NOT NULL,
+            prompt_version VARCHAR(32) NOT NULL,
+            model_name VARCHAR(100) NOT NULL,
+            products JSONB DEFAULT '[]'::jsonb,
+            input_tokens INTEGER DEFAULT 0,
+            output_tokens INTEGER DEFAULT 0,
+            cost_usd DOUBLE PRECISION DEFAULT 0,
+            hit_count INTEGER DEFAULT 0,
+            created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+            last_used_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+        );
+        -- Create crawlfrontier table (URLs of a job leased to cooperating workers)
+        CREATE TABLE IF NOT EXISTS crawlfrontier (
+            job_id UUID NOT NULL,
+            url TEXT NOT NULL,
+            url_index INTEGER NOT NULL,
+            url_info JSONB DEFAULT '{}'::jsonb,
+            status VARCHAR(20) NOT NULL DEFAULT 'pending',
+            lease_owner VARCHAR(255),
+            lease_expires_at TIMESTAMP WITH TIME ZONE,
+            attempts INTEGER DEFAULT 0,
+            updated_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (job_id, url)
+        );
         -- Create indexes for better performance
         CREATE INDEX IF NOT EXISTS idx_scrapejobs_status ON scrapejobs(status);
         CREATE INDEX IF NOT EXISTS idx_scrapejobs_brand_name ON scrapejobs(brand_name);
@@ -302,6 +434,10 @@ class DatabaseManager:
         CREATE INDEX IF NOT EXISTS idx_products_product_hash ON products(product_hash);
         CREATE INDEX IF NOT EXISTS idx_jobselectedproducts_job_id ON jobselectedproducts(job_id);
         CREATE INDEX IF NOT EXISTS idx_jobselectedproducts_product_id ON jobselectedproducts(product_id);
+        CREATE INDEX IF NOT EXISTS idx_pagefetchledger_domain ON pagefetchledger(domain);
+        CREATE INDEX IF NOT EXISTS idx_urlsitemapstate_domain ON urlsitemapstate(domain);
+        CREATE INDEX IF NOT EXISTS idx_crawlfrontier_job_status ON crawlfrontier(job_id, status, url_index);
+        CREATE INDEX IF NOT EXISTS idx_extractioncache_last_used_at ON extractioncache(last_used_at);
         """
 
 
@@ -327,6 +463,11 @@ class DatabaseManager:
             BEFORE UPDATE ON products
             FOR EACH ROW
             EXECUTE FUNCTION update_updated_at_column();
+        DROP TRIGGER IF EXISTS update_pagefetchledger_updated_at ON pagefetchledger;
+        CREATE TRIGGER update_pagefetchledger_updated_at
+            BEFORE UPDATE ON pagefetchledger
+            FOR EACH ROW
+            EXECUTE FUNCTION update_updated_at_column();
         """
 
         try:
@@ -507,6 +648,498 @@ class DatabaseManager:
             logger.error(f"❌ Failed to ingest products: {e}")
             raise
 
+    def get_fetch_ledger(self, urls: List[str]) -> Dict[str, Dict[str, Any]]:
+        """Load the fetch ledger entries recorded by previous jobs for these URLs"""
+        if not urls:
+            return {}
+        try:
+            with self.get_connection() as conn:
+                with conn.cursor(cursor_factory=RealDictCursor) as cur:
+                    cur.execute("""
+                        SELECT url, etag, last_modified, content_sha256, products, s3_markdown_url, last_fetched_at
+                        FROM pagefetchledger
+                        WHERE url = ANY(%s)
+                    """, (urls,))
+                    entries = {row['url']: dict(row) for row in cur.fetchall()}
+                    logger.info(f"📒 Loaded {len(entries)} fetch ledger entries for {len(urls)} URLs")
+                    return entries
+        except Exception as e:
+            logger.error(f"❌ Failed to load fetch ledger: {e}")
+            return {}
+
+    def upsert_fetch_ledger(self, job_id: str, entry: Dict[str, Any]):
+        """Record a page's validators, content fingerprint and extracted products"""
+        normalized_job_id = self.normalize_job_id(job_id)
+        try:
+            with self.get_connection() as conn:
+                with conn.cursor() as cur:
+                    cur.execute("""
+                        INSERT INTO pagefetchledger (
+                            url, domain, etag, last_modified, content_sha256, products, s3_markdown_url,
+                            last_status_code, last_job_id, last_fetched_at
+                        ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, CURRENT_TIMESTAMP)
+                        ON CONFLICT (url) DO UPDATE
+                        SET etag = EXCLUDED.etag,
+                            last_modified = EXCLUDED.last_modified,
+                            content_sha256 = EXCLUDED.content_sha256,
+                            products = EXCLUDED.products,
+                            s3_markdown_url = COALESCE(NULLIF(EXCLUDED.s3_markdown_url, ''), pagefetchledger.s3_markdown_url),
+                            last_status_code = EXCLUDED.last_status_code,
+                            last_job_id = EXCLUDED.last_job_id,
+                            last_fetched_at = CURRENT_TIMESTAMP
+                    """, (
+                        entry['url'],
+                        urlparse(entry['url']).netloc.replace('www.', ''),
+                        entry.get('etag'),
+                        entry.get('last_modified'),
+                        entry.get('content_sha256'),
+                        Json(entry.get('products') or []),
+                        entry.get('s3_markdown_url', ''),
+                        entry.get('status_code'),
+                        normalized_job_id
+                    ))
+        except Exception as e:
+            logger.error(f"❌ Failed to update fetch ledger for {entry.get('url')}: {e}")
+
+    def get_extraction_cache(self, cache_key: str, ttl_hours: float) -> Optional[Dict[str, Any]]:
+        """Return a cached extraction younger than ttl_hours and mark it as used, or None"""
+        try:
+            with self.get_connection() as conn:
+                with conn.cursor(cursor_factory=RealDictCursor) as cur:
+                    cur.execute("""
+                        UPDATE extractioncache
+                        SET hit_count = hit_count + 1,
+                            last_used_at = CURRENT_TIMESTAMP
+                        WHERE cache_key = %s
+                          AND created_at > CURRENT_TIMESTAMP - make_interval(secs => %s)
+                        RETURNING products, input_tokens, output_tokens, cost_usd, created_at
+                    """, (cache_key, ttl_hours * 3600))
+                    row = cur.fetchone()
+                    return dict(row) if row else None
+        except Exception as e:
+            logger.error(f"❌ Failed to read extraction cache: {e}")
+            return None
+
+    def put_extraction_cache(self, entry: Dict[str, Any]):
+        """Store the products and token usage of one Gemini extraction"""
+        try:
+            with self.get_connection() as conn:
+                with conn.cursor() as cur:
+                    cur.execute("""
+                        INSERT INTO extractioncache (
+                            cache_key, content_sha256, prompt_version, model_name, products,
+                            input_tokens, output_tokens, cost_usd
+                        ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
+                        ON CONFLICT (cache_key) DO UPDATE
+                        SET products = EXCLUDED.products,
+                            input_tokens = EXCLUDED.input_tokens,
+                            output_tokens = EXCLUDED.output_tokens,
+                            cost_usd = EXCLUDED.cost_usd,
+                            created_at = CURRENT_TIMESTAMP,
+                            last_used_at = CURRENT_TIMESTAMP
+                    """, (
+                        entry['cache_key'],
+                        entry['content_sha256'],
+                        entry['prompt_version'],
+                        entry['model_name'],
+                        Json(entry.get('products') or []),
+                        entry.get('input_tokens', 0),
+                        entry.get('output_tokens', 0),
+                        entry.get('cost_usd', 0.0)
+                    ))
+        except Exception as e:
+            logger.error(f"❌ Failed to write extraction cache: {e}")
+
+    def evict_extraction_cache(self, ttl_hours: float, max_entries: int) -> int:
+        """Delete expired entries, then the least recently used ones beyond max_entries"""
+        try:
+            with self.get_connection() as conn:
+                with conn.cursor() as cur:
+                    cur.execute("""
+                        DELETE FROM extractioncache
+                        WHERE created_at <= CURRENT_TIMESTAMP - make_interval(secs => %s)
+                    """, (ttl_hours * 3600,))
+                    expired = cur.rowcount
+                    cur.execute("""
+                        DELETE FROM extractioncache
+                        WHERE cache_key IN (
+                            SELECT cache_key FROM extractioncache
+                            ORDER BY last_used_at DESC
+                            OFFSET %s
+                        )
+                    """, (max_entries,))
+                    evicted = cur.rowcount
+                    logger.info(f"🧹 Extraction cache eviction: {expired} expired, {evicted} least recently used")
+                    return expired + evicted
+        except Exception as e:
+            logger.error(f"❌ Failed to evict extraction cache entries: {e}")
+            return 0
+
+    def get_domain_crawl_state(self, domain: str) -> Optional[Dict[str, Any]]:
+        """Get the last successful job for a domain"""
+        try:
+            with self.get_connection() as conn:
+                with conn.cursor(cursor_factory=RealDictCursor) as cur:
+                    cur.execute("""
+                        SELECT domain, last_success_job_id, last_success_at
+                        FROM domaincrawlstate
+                        WHERE domain = %s
+                    """, (domain,))
+                    row = cur.fetchone()
+                    return dict(row) if row else None
+        except Exception as e:
+            logger.error(f"❌ Failed to load crawl state for {domain}: {e}")
+            return None
+
+    def update_domain_crawl_state(self, domain: str, job_id: str):
+        """Record a successful job for a domain"""
+        normalized_job_id = self.normalize_job_id(job_id)
+        try:
+            with self.get_connection() as conn:
+                with conn.cursor() as cur:
+                    cur.execute("""
+                        INSERT INTO domaincrawlstate (domain, last_success_job_id, last_success_at)
+                        VALUES (%s, %s, CURRENT_TIMESTAMP)
+                        ON CONFLICT (domain) DO UPDATE
+                        SET last_success_job_id = EXCLUDED.last_success_job_id,
+                            last_success_at = EXCLUDED.last_success_at
+                    """, (domain, normalized_job_id))
+        except Exception as e:
+            logger.error(f"❌ Failed to update crawl state for {domain}: {e}")
+
+    def sync_sitemap_state(self, domain: str, entries: Dict[str, Dict[str, Any]]) -> Dict[str, Dict[str, Any]]:
+        """Store the current sitemap lastmod/changefreq for each URL and return the stored crawl state"""
+        if not entries:
+            return {}
+        try:
+            with self.get_connection() as conn:
+                with conn.cursor(cursor_factory=RealDictCursor) as cur:
+                    execute_values(cur, """
+                        INSERT INTO urlsitemapstate (url, domain, lastmod, changefreq)
+                        VALUES %s
+                        ON CONFLICT (url) DO UPDATE
+                        SET lastmod = EXCLUDED.lastmod,
+                            changefreq = EXCLUDED.changefreq,
+                            last_seen_at = CURRENT_TIMESTAMP
+                    """, [(url, domain, entry.get('lastmod'), entry.get('changefreq')) for url, entry in entries.items()], page_size=1000)
+                    cur.execute("""
+                        SELECT url, crawled_lastmod, last_crawled_at
+                        FROM urlsitemapstate
+                        WHERE url = ANY(%s)
+                    """, (list(entries),))
+                    return {row['url']: dict(row) for row in cur.fetchall()}
+        except Exception as e:
+            logger.error(f"❌ Failed to sync sitemap state for {domain}: {e}")
+            return {}
+
+    def mark_urls_crawled(self, job_id: str, crawled: List[tuple]):
+        """Remember the sitemap lastmod each URL had when it was crawled"""
+        if not crawled:
+            return
+        normalized_job_id = self.normalize_job_id(job_id)
+        try:
+            with self.get_connection() as conn:
+                with conn.cursor() as cur:
+                    execute_values(cur, """
+                        UPDATE urlsitemapstate AS s
+                        SET crawled_lastmod = c.lastmod,
+                            last_crawled_at = CURRENT_TIMESTAMP,
+                            last_crawled_job_id = c.job_id::uuid
+                        FROM (VALUES %s) AS c(url, lastmod, job_id)
+                        WHERE s.url = c.url
+                    """, [(url, lastmod, normalized_job_id) for url, lastmod in crawled], page_size=1000)
+                    logger.info(f"✅ Marked {len(crawled)} URLs as crawled")
+        except Exception as e:
+            logger.error(f"❌ Failed to mark URLs as crawled: {e}")
+
+    def get_template_yield(self, domain: str) -> Dict[str, Dict[str, int]]:
+        """Load historical product yield per URL template for a domain"""
+        try:
+            with self.get_connection() as conn:
+                with conn.cursor(cursor_factory=RealDictCursor) as cur:
+                    cur.execute("""
+                        SELECT template, pages_crawled, products_found
+                        FROM templateyield
+                        WHERE domain = %s
+                    """, (domain,))
+                    return {row['template']: dict(row) for row in cur.fetchall()}
+        except Exception as e:
+            logger.error(f"❌ Failed to load template yield for {domain}: {e}")
+            return {}
+
+    def record_template_yield(self, domain: str, template_stats: Dict[str, Dict[str, int]]):
+        """Add this job's pages and products per template to the domain's history"""
+        if not template_stats:
+            return
+        try:
+            with self.get_connection() as conn:
+                with conn.cursor() as cur:
+                    execute_values(cur, """
+                        INSERT INTO templateyield (domain, template, pages_crawled, products_found)
+                        VALUES %s
+                        ON CONFLICT (domain, template) DO UPDATE
+                        SET pages_crawled = templateyield.pages_crawled + EXCLUDED.pages_crawled,
+                            products_found = templateyield.products_found + EXCLUDED.products_found,
+                            updated_at = CURRENT_TIMESTAMP
+                    """, [(domain, template, stats['pages_crawled'], stats['products_found']) for template, stats in template_stats.items()])
+                    logger.info(f"✅ Recorded product yield for {len(template_stats)} URL templates")
+        except Exception as e:
+            logger.error(f"❌ Failed to record template yield for {domain}: {e}")
+
+    def get_fetch_tier_history(self) -> Dict[str, Dict[str, float]]:
+        """Load HTTP-tier attempts and browser escalations per domain"""
+        try:
+            with self.get_connection() as conn:
+                with conn.cursor(cursor_factory=RealDictCursor) as cur:
+                    cur.execute("SELECT domain, http_attempts, escalations FROM domainfetchtier")
+                    return {row['domain']: dict(row) for row in cur.fetchall()}
+        except Exception as e:
+            logger.error(f"❌ Failed to load fetch tier history: {e}")
+            return {}
+
+    def record_fetch_tier(self, domain: str, http_attempts: int, escalations: int):
+        """Fold a job's HTTP-tier outcome into the domain history, halving older jobs' weight"""
+        try:
+            with self.get_connection() as conn:
+                with conn.cursor() as cur:
+                    cur.execute("""
+                        INSERT INTO domainfetchtier (domain, http_attempts, escalations)
+                        VALUES (%s, %s, %s)
+                        ON CONFLICT (domain) DO UPDATE
+                        SET http_attempts = domainfetchtier.http_attempts * 0.5 + EXCLUDED.http_attempts,
+                            escalations = domainfetchtier.escalations * 0.5 + EXCLUDED.escalations,
+                            updated_at = CURRENT_TIMESTAMP
+                    """, (domain, http_attempts, escalations))
+        except Exception as e:
+            logger.error(f"❌ Failed to record fetch tier for {domain}: {e}")
+
+    def get_job_metadata(self, job_id: str) -> Dict[str, Any]:
+        """Load the metadata JSON stored on a scrape job"""
+        normalized_job_id = self.normalize_job_id(job_id)
+        try:
+            with self.get_connection() as conn:
+                with conn.cursor(cursor_factory=RealDictCursor) as cur:
+                    cur.execute("SELECT metadata FROM scrapejobs WHERE job_id = %s", (normalized_job_id,))
+                    row = cur.fetchone()
+                    return (row and row['metadata']) or {}
+        except Exception as e:
+            logger.error(f"❌ Failed to load metadata for job {job_id}: {e}")
+            return {}
+
+    def update_job_metadata(self, job_id: str, values: Dict[str, Any]):
+        """Merge top-level keys into a scrape job's metadata JSON"""
+        normalized_job_id = self.normalize_job_id(job_id)
+        try:
+            with self.get_connection() as conn:
+                with conn.cursor() as cur:
+                    cur.execute("""
+                        UPDATE scrapejobs
+                        SET metadata = COALESCE(metadata, '{}'::jsonb) || %s
+                        WHERE job_id = %s
+                    """, (Json(values, dumps=lambda obj: json.dumps(obj, default=str)), normalized_job_id))
+        except Exception as e:
+            logger.error(f"❌ Failed to update metadata for job {job_id}: {e}")
+
+    def get_checkpoints(self, job_id: str, urls: List[str] = None) -> Dict[str, Dict[str, Any]]:
+        """Load the per-URL checkpoints recorded for a job, optionally only for some URLs"""
+        normalized_job_id = self.normalize_job_id(job_id)
+        try:
+            with self.get_connection() as conn:
+                with conn.cursor(cursor_factory=RealDictCursor) as cur:
+                    cur.execute("""
+                        SELECT url, url_index, status, crawl_result, products, s3_markdown_url, s3_screenshot_url
+                        FROM crawlcheckpoints
+                        WHERE job_id = %s AND (%s::text[] IS NULL OR url = ANY(%s::text[]))
+                    """, (normalized_job_id, urls, urls))
+                    return {row['url']: dict(row) for row in cur.fetchall()}
+        except Exception as e:
+            logger.error(f"❌ Failed to load checkpoints for job {job_id}: {e}")
+            return {}
+
+    def save_checkpoint(self, job_id: str, url: str, url_index: int, status: str,
+                        crawl_result: Dict[str, Any], products: List[Dict[str, Any]]):
+        """Insert or update the checkpoint for one URL of a job"""
+        normalized_job_id = self.normalize_job_id(job_id)
+        try:
+            with self.get_connection() as conn:
+                with conn.cursor() as cur:
+                    cur.execute("""
+                        INSERT INTO crawlcheckpoints
+                            (job_id, url, url_index, status, crawl_result, products, s3_markdown_url, s3_screenshot_url)
+                        VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
+                        ON CONFLICT (job_id, url) DO UPDATE
+                        SET url_index = EXCLUDED.url_index,
+                            status = EXCLUDED.status,
+                            crawl_result = EXCLUDED.crawl_result,
+                            products = EXCLUDED.products,
+                            s3_markdown_url = EXCLUDED.s3_markdown_url,
+                            s3_screenshot_url = EXCLUDED.s3_screenshot_url,
+                            updated_at = CURRENT_TIMESTAMP
+                    """, (
+                        normalized_job_id,
+                        url,
+                        url_index,
+                        status,
+                        Json(crawl_result, dumps=lambda obj: json.dumps(obj, default=str)),
+                        Json(products or []),
+                        crawl_result.get('s3_markdown_url') or None,
+                        crawl_result.get('s3_screenshot_url') or None
+                    ))
+        except Exception as e:
+            logger.error(f"❌ Failed to save checkpoint for {url}: {e}")
+
+    def seed_frontier(self, job_id: str, discovered_urls: List[Dict[str, Any]]) -> int:
+        """Add a job's discovered URLs to the frontier, keeping their discovery order"""
+        if not discovered_urls:
+            return 0
+        normalized_job_id = self.normalize_job_id(job_id)
+        try:
+            with self.get_connection() as conn:
+                with conn.cursor() as cur:
+                    # RETURNING counts the rows every page actually inserted, conflicts included
+                    inserted = execute_values(cur, """
+                        INSERT INTO crawlfrontier (job_id, url, url_index, url_info)
+                        VALUES %s
+                        ON CONFLICT (job_id, url) DO NOTHING
+                        RETURNING url
+                    """, [
+                        (normalized_job_id, url_info['url'], index, Json(url_info, dumps=lambda obj: json.dumps(obj, default=str)))
+                        for index, url_info in enumerate(discovered_urls)
+                    ], page_size=1000, fetch=True)
+                    logger.info(f"✅ Seeded frontier of job {job_id} with {len(inserted)} new URLs ({len(discovered_urls) - len(inserted)} already present)")
+                    return len(inserted)
+        except Exception as e:
+            logger.error(f"❌ Failed to seed frontier for job {job_id}: {e}")
+            raise
+
+    def lease_frontier(self, job_id: str, worker_id: str, batch_size: int, lease_seconds: int, max_attempts: int) -> List[Dict[str, Any]]:
+        """Lease the next pending (or expired) frontier URLs to a worker, skipping rows other workers hold"""
+        normalized_job_id = self.normalize_job_id(job_id)
+        try:
+            with self.get_connection() as conn:
+                with conn.cursor(cursor_factory=RealDictCursor) as cur:
+                    # Leases that expired too often belong to a URL that keeps killing its worker
+                    cur.execute("""
+                        UPDATE crawlfrontier
+                        SET status = 'failed', lease_owner = NULL, updated_at = CURRENT_TIMESTAMP
+                        WHERE job_id = %s AND status = 'leased'
+                          AND lease_expires_at < CURRENT_TIMESTAMP AND attempts >= %s
+                    """, (normalized_job_id, max_attempts))
+                    cur.execute("""
+                        UPDATE crawlfrontier AS f
+                        SET status = 'leased',
+                            lease_owner = %s,
+                            lease_expires_at = CURRENT_TIMESTAMP + make_interval(secs => %s),
+                            attempts = f.attempts + 1,
+                            updated_at = CURRENT_TIMESTAMP
+                        FROM (
+                            SELECT job_id, url
+                            FROM crawlfrontier
+                            WHERE job_id = %s
+                              AND (status = 'pending' OR (status = 'leased' AND lease_expires_at < CURRENT_TIMESTAMP))
+                            ORDER BY url_index
+                            LIMIT %s
+                            FOR UPDATE SKIP LOCKED
+                        ) AS c
+                        WHERE f.job_id = c.job_id AND f.url = c.url
+                        RETURNING f.url, f.url_index, f.url_info, f.attempts
+                    """, (worker_id, lease_seconds, normalized_job_id, batch_size))
+                    return sorted((dict(row) for row in cur.fetchall()), key=lambda row: row['url_index'])
+        except Exception as e:
+            logger.error(f"❌ Failed to lease frontier URLs for job {job_id}: {e}")
+            return []
+
+    def heartbeat_frontier(self, job_id: str, worker_id: str, urls: List[str], lease_seconds: int) -> int:
+        """Extend a worker's leases; returns how many leases it still holds"""
+        normalized_job_id = self.normalize_job_id(job_id)
+        try:
+            with self.get_connection() as conn:
+                with conn.cursor() as cur:
+                    cur.execute("""
+                        UPDATE crawlfrontier
+                        SET lease_expires_at = CURRENT_TIMESTAMP + make_interval(secs => %s)
+                        WHERE job_id = %s AND url = ANY(%s) AND status = 'leased' AND lease_owner = %s
+                    """, (lease_seconds, normalized_job_id, urls, worker_id))
+                    return cur.rowcount
+        except Exception as e:
+            logger.error(f"❌ Failed to extend leases for worker {worker_id}: {e}")
+            return 0
+
+    def complete_frontier(self, job_id: str, worker_id: str, outcomes: List[tuple]):
+        """Mark leased URLs as done or failed; leases lost to another worker are left alone"""
+        if not outcomes:
+            return
+        normalized_job_id = self.normalize_job_id(job_id)
+        try:
+            with self.get_connection() as conn:
+                with conn.cursor() as cur:
+                    execute_values(cur, """
+                        UPDATE crawlfrontier AS f
+                        SET status = c.status, lease_owner = NULL, lease_expires_at = NULL, updated_at = CURRENT_TIMESTAMP
+                        FROM (VALUES %s) AS c(url, status, job_id, worker_id)
+                        WHERE f.job_id = c.job_id::uuid AND f.url = c.url
+                          AND f.status = 'leased' AND f.lease_owner = c.worker_id
+                    """, [(url, status, normalized_job_id, worker_id) for url, status in outcomes])
+        except Exception as e:
+            logger.error(f"❌ Failed to complete frontier URLs for worker {worker_id}: {e}")
+
+    def get_frontier_progress(self, job_id: str) -> Dict[str, int]:
+        """Count a job's frontier URLs by status"""
+        normalized_job_id = self.normalize_job_id(job_id)
+        try:
+            with self.get_connection() as conn:
+                with conn.cursor(cursor_factory=RealDictCursor) as cur:
+                    cur.execute("""
+                        SELECT status, COUNT(*) AS urls
+                        FROM crawlfrontier
+                        WHERE job_id = %s
+                        GROUP BY status
+                    """, (normalized_job_id,))
+                    return {row['status']: row['urls'] for row in cur.fetchall()}
+        except Exception as e:
+            logger.error(f"❌ Failed to load frontier progress for job {job_id}: {e}")
+            return {}
+
+    def acquire_advisory_lock(self, name: str, wait: bool = True):
+        """Take a session-level advisory lock on a dedicated pooled connection
+
+        Returns the connection holding the lock (pass it to release_advisory_lock),
+        or None when wait=False and another session holds the lock.
+        """
+        with self.lock:
+            conn = self.pool.getconn()
+        try:
+            with conn.cursor() as cur:
+                if wait:
+                    cur.execute("SELECT pg_advisory_lock(hashtext(%s))", (name,))
+                    acquired = True
+                else:
+                    cur.execute("SELECT pg_try_advisory_lock(hashtext(%s))", (name,))
+                    acquired = cur.fetchone()[0]
+            conn.commit()
+        except Exception as e:
+            logger.error(f"❌ Failed to take advisory lock {name}: {e}")
+            conn.rollback()
+            acquired = False
+        if not acquired:
+            with self.lock:
+                self.pool.putconn(conn)
+            return None
+        return conn
+
+    def release_advisory_lock(self, conn, name: str):
+        """Release an advisory lock taken with acquire_advisory_lock and return its connection"""
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SELECT pg_advisory_unlock(hashtext(%s))", (name,))
+            conn.commit()
+        except Exception as e:
+            logger.error(f"❌ Failed to release advisory lock {name}: {e}")
+            conn.rollback()
+        finally:
+            with self.lock:
+                self.pool.putconn(conn)
+
     def close(self):
         """Close all database connections"""
         if self.pool:
@@ -596,6 +1229,17 @@ class AWSService:
             logger.error(f"❌ Failed to upload string to S3: {e}")
             return ""
 
+    def upload_bytes_to_s3(self, data: bytes, s3_key: str, content_type: str = "application/octet-stream") -> str:
+        logger.info(f"📤 Uploading {len(data)} bytes to S3: {s3_key}")
+        try:
+            self.s3_client.put_object(Bucket=self.s3_bucket, Key=s3_key, Body=data, ContentType=content_type)
+            s3_url = f"https://{self.s3_bucket}.s3.{self.aws_region}.amazonaws.com/{s3_key}"
+            logger.info(f"✅ Successfully uploaded bytes to S3: {s3_key}")
+            return s3_url
+        except ClientError as e:
+            logger.error(f"❌ Failed to upload bytes to S3: {e}")
+            return ""
+
     def upload_json_to_s3(self, data: dict, s3_key: str) -> str:
         logger.info(f"📤 Uploading JSON data to S3: {s3_key}")
         try:
@@ -605,72 +1249,2293 @@ class AWSService:
             logger.error(f"❌ Failed to upload JSON to S3: {e}")
             return ""
 
-class EnhancedWebCrawler:
-    def __init__(self, model_name: str, output_dir: str, job_id: str = None):
-        logger.info(f"🤖 Initializing EnhancedWebCrawler with model: {model_name}")
-        self.model_name = model_name
-        self.base_output_dir = Path(output_dir)
-        self.job_id = job_id or f"crawl-{int(time.time())}"
-        logger.info(f"📁 Base output directory: {self.base_output_dir}")
-        logger.info(f"🆔 Job ID: {self.job_id}")
+    def download_json_from_s3(self, s3_key: str) -> Optional[dict]:
+        """Return the JSON object stored at s3_key, or None when it does not exist or cannot be read"""
+        try:
+            response = self.s3_client.get_object(Bucket=self.s3_bucket, Key=s3_key)
+            return json.loads(response['Body'].read())
+        except ClientError as e:
+            if e.response.get('Error', {}).get('Code') not in ('NoSuchKey', '404'):
+                logger.error(f"❌ Failed to download {s3_key} from S3: {e}")
+            return None
+        except Exception as e:
+            logger.error(f"❌ Unexpected error downloading {s3_key} from S3: {e}")
+            return None
 
-        logger.info("🔄 Setting up AWS services")
-        self.aws_service = AWSService()
-        
-        logger.info("🗄️ Setting up database manager")
-        self.db_manager = DatabaseManager()
+class PipelineStage:
+    """Queue depth and throughput bookkeeping for one stage of the crawl pipeline"""
 
-        logger.info("💰 Configuring pricing tiers for token usage")
-        self.pricing_tiers = {
-            "standard": {
-                "input": float(os.getenv("STANDARD_INPUT_PRICE", "0.075")),
-                "output": float(os.getenv("STANDARD_OUTPUT_PRICE", "0.30")),
-                "threshold": int(os.getenv("STANDARD_THRESHOLD", "128000"))
-            },
-            "large_context": {
-                "input": float(os.getenv("LARGE_CONTEXT_INPUT_PRICE", "0.15")),
-                "output": float(os.getenv("LARGE_CONTEXT_OUTPUT_PRICE", "0.60")),
-                "threshold": float('inf')
-            }
+    def __init__(self, name: str, queue: asyncio.Queue, workers: int):
+        self.name = name
+        self.queue = queue
+        self.workers = workers
+        self.processed = 0
+        self.failed = 0
+        self.busy_ms = 0.0
+        self.max_queue_depth = 0
+        self.depth_samples = 0
+        self.depth_total = 0
+        self.started_at = time.perf_counter()
+        self.finished_at = None
+
+    def sample_depth(self):
+        depth = self.queue.qsize()
+        self.max_queue_depth = max(self.max_queue_depth, depth)
+        self.depth_samples += 1
+        self.depth_total += depth
+
+    def record(self, duration_ms: float, success: bool = True):
+        self.processed += 1
+        self.busy_ms += duration_ms
+        if not success:
+            self.failed += 1
+
+    def snapshot(self) -> Dict[str, Any]:
+        elapsed = (self.finished_at or time.perf_counter()) - self.started_at
+        return {
+            "workers": self.workers,
+            "processed": self.processed,
+            "failed": self.failed,
+            "queue_depth": self.queue.qsize(),
+            "max_queue_depth": self.max_queue_depth,
+            "avg_queue_depth": round(self.depth_total / max(self.depth_samples, 1), 2),
+            "throughput_per_min": round(self.processed / max(elapsed, 1e-6) * 60, 2),
+            "avg_item_ms": round(self.busy_ms / max(self.processed, 1), 1),
+            "utilization": round(self.busy_ms / 1000 / max(elapsed * self.workers, 1e-6), 3)
         }
-        logger.info(f"📊 Pricing tiers configured: Standard threshold={self.pricing_tiers['standard']['threshold']} tokens")
 
-        self.output_dir = None
-        self.markdown_dir = None
-        self.image_dir = None
-        self.csv_dir = None
-        self.json_dir = None
-        self.s3_base_path = None
+class StageTimings:
+    """Per-URL stage spans for one job, summarised as p50/p95/p99 and exported as EMF and Prometheus text
 
-        logger.info("🔑 Retrieving Gemini API key")
-        secret_name = os.getenv("GEMINI_SECRET_NAME", "Gemini-API-ChatGPT")
-        secret_region = os.getenv("GEMINI_SECRET_REGION", "us-east-1")
-        key = get_secret(secret_name, secret_region)
-        if not key:
-            logger.info("🔍 API key not found in Secrets Manager, checking environment variables")
-            key = os.getenv("GEMINI_API_KEY")
-            if key:
-                logger.info("✅ Using Gemini API key from environment variable")
-            else:
-                logger.error("❌ GEMINI_API_KEY not found in Secrets Manager or environment variables")
-                raise EnvironmentError("GEMINI_API_KEY not found in Secrets Manager or environment variables")
-        else:
-            logger.info("✅ Using Gemini API key from AWS Secrets Manager")
+    Spans recorded with a URL also add up in that URL's CrawlMetrics.stage_ms;
+    job-level spans such as discovery and DB ingestion are recorded without one.
+    """
 
-        logger.info("🔄 Configuring Gemini API")
-        genai.configure(api_key=key)
-        self.model = genai.GenerativeModel(
-            self.model_name,
-            generation_config=genai.types.GenerationConfig(
-                temperature=float(os.getenv("MODEL_TEMPERATURE", "0.1")),
-                max_output_tokens=int(os.getenv("MAX_OUTPUT_TOKENS", "8192")),
-                response_mime_type="application/json",
-            )
+    QUANTILES = (0.5, 0.95, 0.99)
+
+    def __init__(self):
+        self.samples: Dict[str, array] = {}
+        self.by_url: Dict[str, Dict[str, float]] = {}
+
+    def record(self, stage: str, duration_ms: Optional[float], url: Optional[str] = None):
+        if duration_ms is None or duration_ms < 0:
+            return
+        self.samples.setdefault(stage, array('d')).append(duration_ms)
+        if url:
+            spans = self.for_url(url)
+            spans[stage] = round(spans.get(stage, 0.0) + duration_ms, 1)
+
+    @contextmanager
+    def span(self, stage: str, url: Optional[str] = None):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(stage, (time.perf_counter() - started) * 1000, url)
+
+    def for_url(self, url: str) -> Dict[str, float]:
+        return self.by_url.setdefault(url, {})
+
+    @staticmethod
+    def page_mark_hook(mark: str) -> Callable:
+        """crawl4ai hook that timestamps the current page, so arun() can be split into stages"""
+        async def hook(*args, **kwargs):
+            page_ctx = _page_context.get()
+            if page_ctx is not None:
+                page_ctx[mark] = time.perf_counter()
+        return hook
+
+    def record_page(self, url: str, page_ctx: Dict[str, Any], arun_finished: float):
+        """Split one browser render into page setup, navigation, render, screenshot and markdown stages"""
+        self.record("page_setup", page_ctx.get("page_setup_ms"), url)
+        self.record("screenshot", page_ctx.get("screenshot_ms"), url)
+        goto_started, goto_finished, html_ready = (page_ctx.get(mark) for mark in ("goto_started", "goto_finished", "html_ready"))
+        if goto_started and goto_finished:
+            self.record("navigation", (goto_finished - goto_started) * 1000, url)
+        if goto_finished and html_ready:
+            self.record("render", (html_ready - goto_finished) * 1000, url)
+        if html_ready:
+            # Scraping and markdown generation run after the HTML is returned; the screenshot is taken just before
+            self.record("markdown", (arun_finished - html_ready) * 1000 - (page_ctx.get("screenshot_ms") or 0), url)
+
+    @staticmethod
+    def percentile(ordered: List[float], q: float) -> float:
+        if not ordered:
+            return 0.0
+        position = (len(ordered) - 1) * q
+        lower = int(position)
+        upper = min(lower + 1, len(ordered) - 1)
+        return ordered[lower] + (ordered[upper] - ordered[lower]) * (position - lower)
+
+    def summary(self) -> Dict[str, Dict[str, float]]:
+        summary = {}
+        for stage, values in self.samples.items():
+            ordered = sorted(values)
+            summary[stage] = {
+                "count": len(ordered),
+                **{f"p{int(q * 100)}_ms": round(self.percentile(ordered, q), 1) for q in self.QUANTILES},
+                "max_ms": round(ordered[-1], 1),
+                "total_ms": round(sum(ordered), 1)
+            }
+        return summary
+
+    def slowest_stage(self, summary: Dict[str, Dict[str, float]] = None) -> Optional[str]:
+        """Stage the job spent the most time in"""
+        summary = summary or self.summary()
+        return max(summary, key=lambda stage: summary[stage]["total_ms"]) if summary else None
+
+    def emf_lines(self, namespace: str, dimensions: Dict[str, str], properties: Dict[str, Any] = None) -> List[str]:
+        """CloudWatch Embedded Metric Format records: percentiles per stage, then the raw spans in chunks of 100"""
+        timestamp = int(time.time() * 1000)
+        dimension_sets = [["Stage"], [*dimensions, "Stage"]]
+        lines = []
+        for stage, stats in self.summary().items():
+            percentiles = {f"P{int(q * 100)}": stats[f"p{int(q * 100)}_ms"] for q in self.QUANTILES}
+            lines.append(json.dumps({
+                "_aws": {"Timestamp": timestamp, "CloudWatchMetrics": [{
+                    "Namespace": namespace,
+                    "Dimensions": dimension_sets,
+                    "Metrics": [{"Name": name, "Unit": "Milliseconds"} for name in percentiles] + [{"Name": "Count", "Unit": "Count"}]
+                }]},
+                **(properties or {}), **dimensions, "Stage": stage, **percentiles, "Count": stats["count"]
+            }))
+            values = self.samples[stage]
+            for start in range(0, len(values), 100):
+                lines.append(json.dumps({
+                    "_aws": {"Timestamp": timestamp, "CloudWatchMetrics": [{
+                        "Namespace": namespace,
+                        "Dimensions": dimension_sets,
+                        "Metrics": [{"Name": "StageDuration", "Unit": "Milliseconds"}]
+                    }]},
+                    **(properties or {}), **dimensions, "Stage": stage, "StageDuration": [round(v, 1) for v in values[start:start + 100]]
+                }))
+        return lines
+
+    def prometheus_text(self, labels: Dict[str, str]) -> str:
+        """Prometheus text exposition of the stage durations as a summary metric"""
+        def label_string(extra: Dict[str, str]) -> str:
+            escaped = {k: str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for k, v in {**labels, **extra}.items()}
+            return "{" + ",".join(f'{k}="{v}"' for k, v in escaped.items()) + "}"
+
+        lines = [
+            "# HELP crawler_stage_duration_milliseconds Time spent per URL (or per job) in each crawl stage",
+            "# TYPE crawler_stage_duration_milliseconds summary"
+        ]
+        for stage, stats in self.summary().items():
+            for q in self.QUANTILES:
+                lines.append(f"crawler_stage_duration_milliseconds{label_string({'stage': stage, 'quantile': str(q)})} {stats[f'p{int(q * 100)}_ms']}")
+            lines.append(f"crawler_stage_duration_milliseconds_sum{label_string({'stage': stage})} {stats['total_ms']}")
+            lines.append(f"crawler_stage_duration_milliseconds_count{label_string({'stage': stage})} {stats['count']}")
+        return "\n".join(lines) + "\n"
+
+class DomainRateLimiter:
+    """Per-domain token bucket whose rate adapts to server health (AIMD)
+
+    The rate grows additively while responses are healthy and is cut
+    multiplicatively on 429/503, errors or response times well above the
+    domain's running average. A robots.txt Crawl-delay caps the rate.
+    """
+
+    BACKOFF_STATUS_CODES = {429, 503}
+
+    def __init__(self):
+        self.initial_rate = float(os.getenv("RATE_LIMIT_INITIAL_RPS", "1.0"))
+        self.min_rate = float(os.getenv("RATE_LIMIT_MIN_RPS", "0.2"))
+        self.max_rate = float(os.getenv("RATE_LIMIT_MAX_RPS", "5.0"))
+        self.burst = max(1.0, float(os.getenv("RATE_LIMIT_BURST", "1")))
+        self.increase_step = float(os.getenv("RATE_LIMIT_INCREASE_STEP", "0.25"))
+        self.backoff_factor = float(os.getenv("RATE_LIMIT_BACKOFF_FACTOR", "0.5"))
+        self.latency_factor = float(os.getenv("RATE_LIMIT_LATENCY_FACTOR", "2.0"))
+        self.respect_crawl_delay = os.getenv("RESPECT_ROBOTS_CRAWL_DELAY", "true").lower() == "true"
+        self.user_agent = os.getenv("ROBOTS_USER_AGENT", "*")
+        self.domains: Dict[str, Dict[str, Any]] = {}
+        self.decisions: List[Dict[str, Any]] = []
+        logger.info(f"🚦 Rate limiter: start={self.initial_rate} rps, range=[{self.min_rate}, {self.max_rate}] rps, "
+                    f"backoff x{self.backoff_factor}, +{self.increase_step} rps per healthy response")
+
+    def _fetch_crawl_delay(self, url: str) -> Optional[float]:
+        parsed = urlparse(url)
+        robots_url = f"{parsed.scheme or 'https'}://{parsed.netloc}/robots.txt"
+        try:
+            with urllib.request.urlopen(robots_url, timeout=10) as response:
+                lines = response.read().decode('utf-8', errors='ignore').splitlines()
+            parser = RobotFileParser()
+            parser.parse(lines)
+            delay = parser.crawl_delay(self.user_agent)
+            return float(delay) if delay else None
+        except Exception as e:
+            logger.debug(f"🤖 Could not read robots.txt from {robots_url}: {e}")
+            return None
+
+    async def _get_state(self, domain: str, url: str) -> Dict[str, Any]:
+        if domain not in self.domains:
+            self.domains[domain] = {
+                "lock": asyncio.Lock(),
+                "rate": min(self.initial_rate, self.max_rate),
+                "max_rate": self.max_rate,
+                "crawl_delay": None,
+                "tokens": self.burst,
+                "last_refill": time.monotonic(),
+                "paused_until": 0.0,
+                "ewma_latency_ms": None,
+                "requests": 0,
+                "increases": 0,
+                "backoffs": 0,
+                "total_wait_ms": 0.0
+            }
+            state = self.domains[domain]
+            if self.respect_crawl_delay:
+                async with state["lock"]:
+                    crawl_delay = await asyncio.to_thread(self._fetch_crawl_delay, url)
+                    if crawl_delay:
+                        state["crawl_delay"] = crawl_delay
+                        state["max_rate"] = min(self.max_rate, 1.0 / crawl_delay)
+                        state["rate"] = min(state["rate"], state["max_rate"])
+                        logger.info(f"🤖 robots.txt Crawl-delay for {domain}: {crawl_delay}s (max {state['max_rate']:.2f} rps)")
+        return self.domains[domain]
+
+    async def acquire(self, domain: str, url: str) -> Dict[str, Any]:
+        """Wait for a request slot on the domain and return how long that took"""
+        state = await self._get_state(domain, url)
+        async with state["lock"]:
+            now = time.monotonic()
+            state["tokens"] = min(self.burst, state["tokens"] + (now - state["last_refill"]) * state["rate"])
+            state["last_refill"] = now
+            wait = max(0.0, state["paused_until"] - now)
+            if state["tokens"] < 1.0:
+                wait = max(wait, (1.0 - state["tokens"]) / state["rate"])
+            if wait > 0:
+                # Tokens keep accruing while we sleep; the slot we wait for is consumed up front
+                state["tokens"] = min(self.burst, state["tokens"] + wait * state["rate"]) - 1.0
+                state["last_refill"] = now + wait
+                await asyncio.sleep(wait)
+            else:
+                state["tokens"] -= 1.0
+            state["requests"] += 1
+            state["total_wait_ms"] += wait * 1000
+            return {"wait_ms": round(wait * 1000, 1), "rate_rps": round(state["rate"], 3)}
+
+    def record(self, domain: str, status_code: Optional[int], latency_ms: float, retry_after: Optional[str] = None) -> Dict[str, Any]:
+        """Feed a response back into the domain's rate and return the decision taken"""
+        state = self.domains.get(domain)
+        if state is None:
+            return {}
+        previous_rate = state["rate"]
+        baseline = state["ewma_latency_ms"]
+        if status_code in self.BACKOFF_STATUS_CODES or status_code is None:
+            action = "backoff"
+            reason = f"status {status_code}" if status_code else "request error"
+        elif baseline is not None and state["requests"] > 3 and latency_ms > baseline * self.latency_factor:
+            action = "backoff"
+            reason = f"latency {latency_ms:.0f}ms > {self.latency_factor}x avg {baseline:.0f}ms"
+        elif 200 <= status_code < 400:
+            action = "increase"
+            reason = f"healthy status {status_code}"
+        else:
+            action = "hold"
+            reason = f"status {status_code}"
+
+        if action == "backoff":
+            state["rate"] = max(self.min_rate, state["rate"] * self.backoff_factor)
+            state["backoffs"] += 1
+            if retry_after:
+                try:
+                    state["paused_until"] = time.monotonic() + float(retry_after)
+                    reason += f", Retry-After {retry_after}s"
+                except ValueError:
+                    pass
+        elif action == "increase":
+            state["rate"] = min(state["max_rate"], state["rate"] + self.increase_step)
+            if state["rate"] > previous_rate:
+                state["increases"] += 1
+        if status_code is not None:
+            state["ewma_latency_ms"] = latency_ms if baseline is None else 0.8 * baseline + 0.2 * latency_ms
+
+        decision = {
+            "domain": domain,
+            "action": action,
+            "reason": reason,
+            "previous_rate_rps": round(previous_rate, 3),
+            "rate_rps": round(state["rate"], 3),
+            "timestamp": datetime.now().isoformat()
+        }
+        if action == "backoff":
+            logger.warning(f"🚦 Backing off {domain}: {previous_rate:.2f} -> {state['rate']:.2f} rps ({reason})")
+        else:
+            logger.debug(f"🚦 {domain}: {action} {previous_rate:.2f} -> {state['rate']:.2f} rps ({reason})")
+        self.decisions.append(decision)
+        if len(self.decisions) > 1000:
+            self.decisions = self.decisions[-1000:]
+        return decision
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            domain: {
+                "rate_rps": round(state["rate"], 3),
+                "max_rate_rps": round(state["max_rate"], 3),
+                "robots_crawl_delay": state["crawl_delay"],
+                "requests": state["requests"],
+                "increases": state["increases"],
+                "backoffs": state["backoffs"],
+                "total_wait_ms": round(state["total_wait_ms"], 1),
+                "ewma_latency_ms": round(state["ewma_latency_ms"], 1) if state["ewma_latency_ms"] is not None else None
+            }
+            for domain, state in self.domains.items()
+        }
+
+# Per-page state shared between a crawl task and the browser hooks that run inside
+# crawler.arun(). Each task sets its own dict, so hooks always see the page they belong to.
+_page_context: contextvars.ContextVar = contextvars.ContextVar("page_context", default=None)
+
+class UrlBloomFilter:
+    """Fixed-size Bloom filter for URL dedupe; memory depends only on capacity and error rate"""
+
+    def __init__(self, capacity: int, error_rate: float = 0.001):
+        capacity = max(1, capacity)
+        self.size = max(64, int(-capacity * math.log(error_rate) / (math.log(2) ** 2)))
+        self.hash_count = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, url: str):
+        digest = hashlib.blake2b(url.encode('utf-8'), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        return ((h1 + i * h2) % self.size for i in range(self.hash_count))
+
+    def add(self, url: str) -> bool:
+        """Add url and return True if it was not seen before (false positives at error_rate)"""
+        added = False
+        for position in self._positions(url):
+            byte, bit = divmod(position, 8)
+            if not self.bits[byte] & (1 << bit):
+                self.bits[byte] |= 1 << bit
+                added = True
+        return added
+
+
+class SitemapReader:
+    """Streams sitemap entries with their lastmod/changefreq, following robots.txt and sitemap indexes
+
+    Child sitemaps are downloaded and parsed concurrently, chunk by chunk, with
+    gzip inflated on the fly. Entries pass through a bounded queue and are
+    deduped with a Bloom filter. Memory stays bounded on indexes with hundreds of
+    children and millions of URLs.
+    """
+
+    def __init__(self, client: httpx.AsyncClient, max_urls: int = 50000, max_sitemaps: int = 50,
+                 concurrency: int = 4, buffer_size: int = 1000, error_rate: float = 0.001):
+        self.client = client
+        self.max_urls = max_urls
+        self.max_sitemaps = max_sitemaps
+        self.concurrency = concurrency
+        self.buffer_size = buffer_size
+        self.error_rate = error_rate
+        self.stats: Dict[str, int] = {}
+
+    async def _fetch(self, url: str) -> Optional[bytes]:
+        try:
+            response = await self.client.get(url)
+            if response.status_code != 200:
+                return None
+            content = response.content
+            if content[:2] == b'\x1f\x8b':
+                content = gzip.decompress(content)
+            return content
+        except (httpx.HTTPError, OSError) as e:
+            logger.warning(f"⚠️ Could not fetch {url}: {e}")
+            return None
+
+    async def _sitemap_roots(self, root_url: str) -> List[str]:
+        robots = await self._fetch(urljoin(root_url, "/robots.txt"))
+        roots = []
+        if robots:
+            for line in robots.decode('utf-8', errors='ignore').splitlines():
+                if line.lower().startswith('sitemap:'):
+                    roots.append(line.split(':', 1)[1].strip())
+        return roots or [urljoin(root_url, "/sitemap.xml"), urljoin(root_url, "/sitemap_index.xml")]
+
+    @staticmethod
+    def _local_name(tag: str) -> str:
+        return tag.rsplit('}', 1)[-1]
+
+    async def _parse_sitemap(self, sitemap_url: str, on_child: Callable[[str], None], entries: asyncio.Queue):
+        """Parse one sitemap incrementally, queueing child sitemaps and URL entries as their elements close"""
+        parser = ET.XMLPullParser(events=('start', 'end'))
+        decompressor = None
+        root = None
+        try:
+            async with self.client.stream("GET", sitemap_url) as response:
+                if response.status_code != 200:
+                    return
+                async for chunk in response.aiter_bytes():
+                    if decompressor is None:
+                        decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS) if chunk[:2] == b'\x1f\x8b' else False
+                    parser.feed(decompressor.decompress(chunk) if decompressor else chunk)
+                    for event, element in parser.read_events():
+                        if event == 'start':
+                            if root is None:
+                                root = element
+                            continue
+                        kind = self._local_name(element.tag)
+                        if kind not in ('url', 'sitemap'):
+                            continue
+                        fields = {self._local_name(child.tag): (child.text or '').strip() for child in element}
+                        # Drop parsed entries so the tree never holds more than the current one
+                        root.clear()
+                        loc = fields.get('loc')
+                        if not loc:
+                            continue
+                        if kind == 'sitemap':
+                            on_child(loc)
+                        else:
+                            await entries.put((loc, {'lastmod': fields.get('lastmod') or None, 'changefreq': fields.get('changefreq') or None}))
+            # Raises on a truncated document; entries parsed before the cut are kept
+            parser.close()
+            self.stats["sitemaps_read"] += 1
+        except ET.ParseError as e:
+            logger.warning(f"⚠️ Invalid sitemap XML at {sitemap_url}: {e}")
+            self.stats["errors"] += 1
+        except (httpx.HTTPError, OSError, zlib.error) as e:
+            logger.warning(f"⚠️ Could not fetch {sitemap_url}: {e}")
+            self.stats["errors"] += 1
+
+    async def stream(self, root_url: str, max_urls: Optional[int] = None) -> AsyncIterator[Tuple[str, Dict[str, Optional[str]]]]:
+        """Yield (url, {"lastmod", "changefreq"}) for each unique sitemap URL as soon as it is parsed
+
+        Stops after max_urls (default: the reader's max_urls) unique URLs and
+        cancels the remaining downloads.
+        """
+        limit = min(max_urls or self.max_urls, self.max_urls)
+        self.stats = {"sitemaps_read": 0, "sitemaps_skipped": 0, "errors": 0, "urls": 0, "duplicates": 0}
+        seen = UrlBloomFilter(limit, self.error_rate)
+        sitemaps: asyncio.Queue = asyncio.Queue()
+        entries: asyncio.Queue = asyncio.Queue(maxsize=self.buffer_size)
+        visited = set()
+
+        def on_child(sitemap_url: str):
+            if sitemap_url in visited:
+                return
+            if len(visited) >= self.max_sitemaps:
+                self.stats["sitemaps_skipped"] += 1
+                return
+            visited.add(sitemap_url)
+            sitemaps.put_nowait(sitemap_url)
+
+        async def sitemap_worker():
+            while True:
+                sitemap_url = await sitemaps.get()
+                try:
+                    await self._parse_sitemap(sitemap_url, on_child, entries)
+                finally:
+                    sitemaps.task_done()
+
+        async def close_when_done():
+            await sitemaps.join()
+            await entries.put(None)
+
+        for sitemap_url in await self._sitemap_roots(root_url):
+            on_child(sitemap_url)
+        tasks = [asyncio.create_task(sitemap_worker()) for _ in range(self.concurrency)]
+        tasks.append(asyncio.create_task(close_when_done()))
+        try:
+            while self.stats["urls"] < limit:
+                item = await entries.get()
+                if item is None:
+                    break
+                if not seen.add(item[0]):
+                    self.stats["duplicates"] += 1
+                    continue
+                self.stats["urls"] += 1
+                yield item
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            logger.info(f"🗺️ Streamed {self.stats['urls']} sitemap entries from {self.stats['sitemaps_read']} sitemap(s): {self.stats}")
+
+    async def read(self, root_url: str) -> Dict[str, Dict[str, Optional[str]]]:
+        """Return {url: {"lastmod", "changefreq"}} for every URL listed in the site's sitemaps"""
+        return {url: entry async for url, entry in self.stream(root_url)}
+
+
+class DiscoveryCache:
+    """TTL cache of discovered URLs per domain and seeding config, kept on local disk with an S3 copy
+
+    An entry is also invalidated when the ETag/Last-Modified of robots.txt or of
+    a root sitemap no longer matches the values seen when it was written.
+    """
+
+    VERSION = 1
+
+    def __init__(self, client: httpx.AsyncClient, aws_service: Optional["AWSService"], cache_dir: str, s3_prefix: str,
+                 ttl: timedelta, enabled: bool = True, force_refresh: bool = False):
+        self.client = client
+        self.aws_service = aws_service
+        self.cache_dir = cache_dir
+        self.s3_prefix = s3_prefix.strip('/')
+        self.ttl = ttl
+        self.enabled = enabled
+        self.force_refresh = force_refresh
+        self.validators_by_domain: Dict[str, Dict[str, str]] = {}
+        self.stats: Dict[str, Any] = {}
+
+    @classmethod
+    def cache_key(cls, config: Dict[str, Any]) -> str:
+        payload = json.dumps({"version": cls.VERSION, **config}, sort_keys=True)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()[:16]
+
+    def _local_path(self, domain: str, key: str) -> str:
+        return os.path.join(self.cache_dir, domain, f"{key}.json")
+
+    def _s3_key(self, domain: str, key: str) -> str:
+        return f"{self.s3_prefix}/{domain}/{key}.json"
+
+    @staticmethod
+    def _validator(response: httpx.Response) -> Optional[str]:
+        headers = response.headers
+        if headers.get('etag'):
+            return f"etag:{headers['etag']}"
+        if headers.get('last-modified'):
+            return f"last-modified:{headers['last-modified']}"
+        return None
+
+    async def validators(self, root_url: str, domain: str) -> Dict[str, str]:
+        """ETag (or Last-Modified) of robots.txt and of the sitemaps it lists, keyed by URL
+
+        Resources that fail to respond or send neither header are left out, so a
+        transient error never invalidates an entry on its own.
+        """
+        if domain in self.validators_by_domain:
+            return self.validators_by_domain[domain]
+        validators = {}
+        robots_url = urljoin(root_url, "/robots.txt")
+        sitemap_urls = []
+        try:
+            response = await self.client.get(robots_url)
+            if response.status_code == 200:
+                validator = self._validator(response)
+                if validator is None:
+                    validator = f"sha256:{hashlib.sha256(response.content).hexdigest()}"
+                validators[robots_url] = validator
+                for line in response.text.splitlines():
+                    if line.lower().startswith('sitemap:'):
+                        sitemap_urls.append(line.split(':', 1)[1].strip())
+        except httpx.HTTPError as e:
+            logger.warning(f"⚠️ Could not fetch {robots_url} for discovery cache validation: {e}")
+        for sitemap_url in (sitemap_urls or [urljoin(root_url, "/sitemap.xml")])[:5]:
+            try:
+                response = await self.client.head(sitemap_url)
+                validator = self._validator(response) if response.status_code == 200 else None
+                if validator:
+                    validators[sitemap_url] = validator
+            except httpx.HTTPError as e:
+                logger.warning(f"⚠️ Could not check {sitemap_url} for discovery cache validation: {e}")
+        self.validators_by_domain[domain] = validators
+        return validators
+
+    def _read_local(self, path: str) -> Optional[Dict[str, Any]]:
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            logger.warning(f"⚠️ Ignoring unreadable discovery cache file {path}: {e}")
+            return None
+
+    def _write_local(self, path: str, entry: Dict[str, Any]):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(entry, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+
+    async def get(self, root_url: str, domain: str, config: Dict[str, Any]) -> Optional[List[Dict[str, Any]]]:
+        """Cached URL list for this domain and config, or None when discovery has to run"""
+        if not self.enabled:
+            self.stats = {"status": "disabled"}
+            return None
+        key = self.cache_key(config)
+        if self.force_refresh:
+            self.stats = {"status": "refreshed", "key": key}
+            logger.info(f"🔄 Forced refresh: ignoring cached discovery for {domain}")
+            return None
+        path = self._local_path(domain, key)
+        entry = await asyncio.to_thread(self._read_local, path)
+        source = "local"
+        if entry is None and self.aws_service:
+            entry = await asyncio.to_thread(self.aws_service.download_json_from_s3, self._s3_key(domain, key))
+            source = "s3"
+            if entry is not None:
+                try:
+                    await asyncio.to_thread(self._write_local, path, entry)
+                except OSError as e:
+                    logger.warning(f"⚠️ Could not write discovery cache file {path}: {e}")
+        if not entry or not entry.get('urls'):
+            self.stats = {"status": "miss", "key": key}
+            logger.info(f"📭 No cached discovery for {domain}")
+            return None
+
+        age = datetime.now(timezone.utc) - datetime.fromisoformat(entry['created_at'])
+        if age > self.ttl:
+            self.stats = {"status": "expired", "key": key, "age_seconds": int(age.total_seconds())}
+            logger.info(f"⌛ Cached discovery for {domain} expired ({age} old)")
+            return None
+        current = await self.validators(root_url, domain)
+        stored = entry.get('validators', {})
+        changed = [url for url, validator in current.items() if url in stored and stored[url] != validator]
+        if changed:
+            self.stats = {"status": "invalidated", "key": key, "changed": changed}
+            logger.info(f"♻️ Cached discovery for {domain} invalidated by {self.stats['changed']}")
+            return None
+
+        self.stats = {"status": "hit", "key": key, "source": source, "age_seconds": int(age.total_seconds()), "urls": len(entry['urls'])}
+        logger.info(f"📬 Reusing {len(entry['urls'])} discovered URLs for {domain} from the {source} cache ({age} old)")
+        return entry['urls']
+
+    async def put(self, root_url: str, domain: str, config: Dict[str, Any], urls: List[Dict[str, Any]]):
+        """Store a discovery result locally and in S3"""
+        if not self.enabled or not urls:
+            return
+        key = self.cache_key(config)
+        entry = {
+            "domain": domain,
+            "config": config,
+            "created_at": datetime.now(timezone.utc).isoformat(),
+            "validators": await self.validators(root_url, domain),
+            "urls": urls
+        }
+        path = self._local_path(domain, key)
+        try:
+            await asyncio.to_thread(self._write_local, path, entry)
+        except OSError as e:
+            logger.warning(f"⚠️ Could not write discovery cache file {path}: {e}")
+        if self.aws_service:
+            await asyncio.to_thread(self.aws_service.upload_json_to_s3, entry, self._s3_key(domain, key))
+        self.stats["stored"] = len(urls)
+        logger.info(f"💾 Cached {len(urls)} discovered URLs for {domain} (key {key}, ttl {self.ttl})")
+
+
+class UrlCanonicalizer:
+    """Normalises discovered URLs so aliases of one page are crawled once
+
+    The host is lower-cased, www. and default ports are folded into the root URL's
+    host, the scheme follows the root URL, fragments, duplicate slashes and trailing
+    slashes are dropped, tracking parameters are removed and the remaining query keys
+    are sorted. A same-site <link rel="canonical"> from the page head wins over the
+    listed URL. URL_CANONICAL_RULES takes JSON rules per domain ("*" for all), e.g.
+    {"shop.com": {"drop_params": ["variant", "sort_by"], "lowercase_path": true}}.
+    """
+
+    TRACKING_PARAMS = (
+        "utm_*", "gclid", "gbraid", "wbraid", "dclid", "fbclid", "msclkid", "yclid", "igshid", "mc_cid", "mc_eid",
+        "_ga", "_gl", "_hsenc", "_hsmi", "srsltid", "spm", "_pos", "_sid", "_ss", "_psq", "_kx",
+    )
+    DEFAULT_RULES = {
+        "drop_params": [],
+        "keep_params": None,
+        "default_params": {"page": "1"},
+        "lowercase_path": False,
+        "trailing_slash": False,
+        "follow_canonical": True,
+    }
+
+    def __init__(self, root_url: str):
+        parsed = urlparse(root_url if root_url.startswith("http") else f"https://{root_url}")
+        self.scheme = parsed.scheme or "https"
+        self.root_host = (parsed.hostname or "").lower()
+        self.root_port = self._port(parsed)
+        self.domain = self.root_host[4:] if self.root_host.startswith("www.") else self.root_host
+        try:
+            configured = json.loads(os.getenv("URL_CANONICAL_RULES", "{}") or "{}")
+        except ValueError as e:
+            logger.warning(f"⚠️ Invalid URL_CANONICAL_RULES JSON, ignoring: {e}")
+            configured = {}
+        self.rules = {**self.DEFAULT_RULES, **configured.get("*", {})}
+        for pattern, rules in configured.items():
+            if pattern != "*" and self.same_site(self.domain, pattern):
+                self.rules.update(rules)
+        self.stats = {"input": 0, "unique": 0, "collapsed": 0, "collapsed_by_canonical_tag": 0, "off_site": 0}
+
+    @staticmethod
+    def same_site(host: str, domain: str) -> bool:
+        """True for the domain itself and its subdomains (not for lookalikes such as evil-shop.com)"""
+        host = host.lower()
+        return host == domain or host.endswith("." + domain)
+
+    @staticmethod
+    def canonical_from_head(head_data: Optional[Dict[str, Any]]) -> Optional[str]:
+        """href of the <link rel="canonical"> the URL seeder found in a page head"""
+        links = ((head_data or {}).get('link') or {}).get('canonical') or []
+        return links[0].get('href') if links else None
+
+    @staticmethod
+    def _port(parsed) -> Optional[int]:
+        """Explicit non-default port of a parsed URL; raises ValueError for an invalid port"""
+        port = parsed.port
+        return None if port in (80, 443) else port
+
+    def _drop_param(self, key: str, value: str) -> bool:
+        key = key.lower()
+        if any(fnmatch.fnmatch(key, pattern) for pattern in self.TRACKING_PARAMS):
+            return True
+        if any(fnmatch.fnmatch(key, pattern.lower()) for pattern in self.rules["drop_params"]):
+            return True
+        if self.rules["keep_params"] is not None and key not in self.rules["keep_params"]:
+            return True
+        return self.rules["default_params"].get(key) == value
+
+    def canonicalize(self, url: str) -> Optional[str]:
+        """Canonical form of a URL, or None for URLs outside the site"""
+        parsed = urlparse(url if "://" in url else f"https://{url}")
+        host = (parsed.hostname or "").lower()
+        if not host or not self.same_site(host, self.domain):
+            return None
+        try:
+            port = self._port(parsed)
+        except ValueError:
+            return None
+        if host in (self.domain, "www." + self.domain) and port == self.root_port:
+            host = self.root_host
+        netloc = f"{host}:{port}" if port else host
+        path = re.sub(r"/{2,}", "/", parsed.path or "/")
+        if self.rules["lowercase_path"]:
+            path = path.lower()
+        if not self.rules["trailing_slash"] and len(path) > 1:
+            path = path.rstrip("/") or "/"
+        query = sorted(
+            (key, value) for key, value in parse_qsl(parsed.query, keep_blank_values=True) if not self._drop_param(key, value)
+        )
+        return urlunparse((self.scheme, netloc, path, "", urlencode(query), ""))
+
+    def dedupe(self, url_infos: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Canonicalise discovered URLs, keeping the first entry of each canonical URL in order"""
+        unique: Dict[str, Dict[str, Any]] = {}
+        tag_targets = set()
+        for url_info in url_infos:
+            self.stats["input"] += 1
+            url = url_info['url']
+            canonical = self.canonicalize(url)
+            if canonical is None:
+                self.stats["off_site"] += 1
+                continue
+            via_tag = False
+            if self.rules["follow_canonical"] and url_info.get('canonical'):
+                tagged = self.canonicalize(urljoin(url, url_info['canonical']))
+                if tagged and tagged != canonical:
+                    canonical, via_tag = tagged, True
+            if canonical in unique:
+                self.stats["collapsed"] += 1
+                self.stats["collapsed_by_canonical_tag"] += int(via_tag or canonical in tag_targets)
+                existing = unique[canonical]
+                existing['alias_count'] = existing.get('alias_count', 0) + 1
+                for key in ('title', 'meta_description'):
+                    existing[key] = existing.get(key) or url_info.get(key, '')
+                continue
+            if via_tag:
+                tag_targets.add(canonical)
+            entry = {**url_info, 'url': canonical}
+            if canonical != url:
+                entry['original_url'] = url
+            unique[canonical] = entry
+        self.stats["unique"] = len(unique)
+        return list(unique.values())
+
+class UrlPrioritizer:
+    """Scores discovered URLs by likely product yield and budgets the crawl
+
+    URLs are grouped by path template (``/products/{slug}``). A template's score
+    comes from its historical products per page once enough pages have been
+    crawled, otherwise from path keywords; the page title/meta nudge individual
+    URLs. Templates scoring below the product threshold are only sampled.
+    """
+
+    PRODUCT_SEGMENTS = {
+        "products", "product", "p", "item", "items", "shop", "store", "collections", "collection",
+        "category", "categories", "catalog", "catalogue", "c", "dp", "buy", "sale", "new-arrivals", "bestsellers"
+    }
+    NON_PRODUCT_SEGMENTS = {
+        "pages", "blogs", "blog", "news", "articles", "about", "about-us", "contact", "contact-us", "policies",
+        "policy", "privacy", "terms", "faq", "faqs", "account", "cart", "checkout", "login", "careers",
+        "search", "tag", "tags", "author", "press"
+    }
+    PRODUCT_HINTS = re.compile(r"(₹|\$|€|£|\bprice\b|\bbuy\b|\bshop\b|add to cart|\bsale\b|% off)", re.IGNORECASE)
+    NON_PRODUCT_HINTS = re.compile(r"\b(blog|about us|privacy|terms|policy|contact|careers|faq)\b", re.IGNORECASE)
+
+    def __init__(self, template_yield: Dict[str, Dict[str, int]], sample_rate: float = 0.1,
+                 min_history_pages: int = 3, product_threshold: float = 0.4):
+        self.template_yield = template_yield
+        self.sample_rate = sample_rate
+        self.min_history_pages = min_history_pages
+        self.product_threshold = product_threshold
+
+    @classmethod
+    def template(cls, url: str) -> str:
+        """Collapse slugs and ids in a URL path, e.g. /products/red-shoe -> /products/{slug}"""
+        segments = [segment for segment in urlparse(url).path.split('/') if segment]
+        parts = []
+        for i, segment in enumerate(segments):
+            lower = segment.lower()
+            if lower in cls.PRODUCT_SEGMENTS or lower in cls.NON_PRODUCT_SEGMENTS:
+                parts.append(lower)
+            elif lower.isdigit():
+                parts.append("{id}")
+            elif i == 0 and lower.isalpha() and len(lower) <= 15:
+                parts.append(lower)
+            else:
+                parts.append("{slug}")
+        return "/" + "/".join(parts)
+
+    def _prior(self, template: str) -> float:
+        segments = set(template.strip('/').split('/')) if template != "/" else set()
+        if not segments:
+            return 0.6  # home pages usually feature a product grid
+        score = 0.5
+        if segments & self.PRODUCT_SEGMENTS:
+            score += 0.3
+        if segments & self.NON_PRODUCT_SEGMENTS:
+            score -= 0.35
+        return score
+
+    def score(self, url_info: Dict[str, Any]) -> float:
+        template = url_info['template']
+        score = self._prior(template)
+        history = self.template_yield.get(template)
+        if history and history['pages_crawled'] >= self.min_history_pages:
+            products_per_page = history['products_found'] / history['pages_crawled']
+            score = 0.7 * min(1.0, products_per_page / 5) + 0.3 * score
+        head_text = f"{url_info.get('title') or ''} {url_info.get('meta_description') or ''}"
+        if self.PRODUCT_HINTS.search(head_text):
+            score += 0.1
+        if self.NON_PRODUCT_HINTS.search(head_text):
+            score -= 0.1
+        return round(min(1.0, max(0.0, score)), 3)
+
+    def prioritize(self, urls: List[Dict[str, Any]], budget: int) -> tuple:
+        """Return (selected URLs in priority order, stats)
+
+        Savings are measured against the baseline without prioritisation: the
+        first ``budget`` URLs in discovery order. pages_skipped counts baseline
+        URLs of low-yield templates that were sampled out or pushed past the
+        budget, i.e. crawls of non-product pages the baseline would have paid
+        for. Candidates beyond the budget are only seeded for prioritisation,
+        so they count as extra discovery, not as pages skipped.
+        """
+        groups: Dict[str, List[tuple]] = {}
+        for index, url_info in enumerate(urls):
+            url_info['template'] = self.template(url_info['url'])
+            url_info['priority_score'] = self.score(url_info)
+            groups.setdefault(url_info['template'], []).append((index, url_info))
+
+        candidates = []
+        sampled_templates = {}
+        low_yield_templates = set()
+        skipped_by_sampling = 0
+        for template, group in groups.items():
+            group.sort(key=lambda item: (-item[1]['priority_score'], item[0]))
+            template_score = sum(url_info['priority_score'] for _, url_info in group) / len(group)
+            if template_score < self.product_threshold:
+                low_yield_templates.add(template)
+                keep = max(1, math.ceil(len(group) * self.sample_rate))
+                if keep < len(group):
+                    sampled_templates[template] = {"discovered": len(group), "sampled": keep}
+                    skipped_by_sampling += len(group) - keep
+                group = group[:keep]
+            candidates.extend(group)
+
+        candidates.sort(key=lambda item: (-item[1]['priority_score'], item[0]))
+        selected = [url_info for _, url_info in candidates[:budget]]
+        baseline = urls[:budget]
+        selected_ids = {id(url_info) for url_info in selected}
+        dropped = [url_info for url_info in baseline if id(url_info) not in selected_ids]
+        stats = {
+            "candidates": len(urls),
+            "templates": len(groups),
+            "selected": len(selected),
+            "baseline_pages": len(baseline),
+            "pages_skipped": sum(1 for url_info in dropped if url_info['template'] in low_yield_templates),
+            "baseline_pages_replaced": len(dropped),
+            "extra_candidates": max(0, len(urls) - budget),
+            "skipped_by_sampling": skipped_by_sampling,
+            "skipped_by_budget": max(0, len(candidates) - budget),
+            "sampled_templates": sampled_templates
+        }
+        return selected, stats
+
+
+class NearDuplicateIndex:
+    """SimHash fingerprints of page markdown with a banded LSH index
+
+    Sorted, variant and aliased URLs of a page render the same products with
+    different links around them, so pages are compared with every earlier page
+    of the same domain. Link targets and numbers are stripped before hashing
+    3-word shingles, taken within each line so reordered cards shingle the same,
+    into a 64-bit SimHash. With max_distance d the fingerprint is split into
+    d + 1 bands: any fingerprint within d bits of an indexed one matches it
+    exactly on at least one band. Short pages move several bits for a one-line
+    change, so earlier pages with exactly the same headings are candidates too.
+
+    Distinct products on one theme share most of their text, so a candidate is
+    only confirmed when the pages have the same headings (a product's title, a
+    collection's name and card titles) and their shingles with numbers kept and
+    their price lines reach min_jaccard. Pagination and pages that differ in
+    one product block do not match.
+    """
+
+    BITS = 64
+    LINK_TARGETS = re.compile(r"\]\([^)]*\)|https?://\S+")
+    TOKENS = re.compile(r"[^\W\d_]+")
+    PRICE = re.compile(r"(₹|\$|€|£)\s?\d|\d\s?(₹|€|£|kr\b)", re.IGNORECASE)
+    EXACT_TOKENS = re.compile(r"[^\W_]+")
+
+    def __init__(self, max_distance: int = 2, min_tokens: int = 50, min_jaccard: float = 0.9):
+        self.max_distance = max(0, min(max_distance, 15))
+        self.min_tokens = min_tokens
+        self.min_jaccard = min_jaccard
+        self.band_count = self.max_distance + 1
+        self.band_width = self.BITS // self.band_count
+        self.bands: Dict[str, List[Dict[int, List[tuple]]]] = {}
+        self.by_headings: Dict[tuple, List[tuple]] = {}
+
+    @staticmethod
+    def scope(url: str) -> str:
+        """Pages are compared within their domain"""
+        host = (urlparse(url).hostname or "").lower()
+        return host[4:] if host.startswith("www.") else host
+
+    @staticmethod
+    def _stable_hash(text: str) -> int:
+        """Process-independent 64-bit hash (built-in hash() of str is salted per process)"""
+        return int.from_bytes(hashlib.blake2b(text.encode("utf-8"), digest_size=8).digest(), "big")
+
+    @staticmethod
+    def _shingles(lines: List[List[str]]) -> List[str]:
+        shingles = []
+        for tokens in lines:
+            if 0 < len(tokens) < 3:
+                shingles.append(" ".join(tokens))
+            shingles.extend(" ".join(tokens[i:i + 3]) for i in range(len(tokens) - 2))
+        return shingles
+
+    def signature(self, markdown: str) -> Optional[tuple]:
+        """(SimHash, exact shingle hashes, price lines, headings) of the page; None for pages too short to compare reliably
+
+        CPU-bound on long pages, so callers on the event loop run it in a thread.
+        """
+        lines = self.LINK_TARGETS.sub(" ", markdown or "").lower().splitlines()
+        tokens = [self.TOKENS.findall(line) for line in lines]
+        if sum(len(line_tokens) for line_tokens in tokens) < self.min_tokens:
+            return None
+        weights = [0] * self.BITS
+        for shingle, count in Counter(self._shingles(tokens)).items():
+            value = self._stable_hash(shingle)
+            for bit in range(self.BITS):
+                weights[bit] += count if value >> bit & 1 else -count
+        fingerprint = sum(1 << bit for bit, weight in enumerate(weights) if weight > 0)
+        exact = frozenset(self._stable_hash(shingle) for shingle in self._shingles([self.EXACT_TOKENS.findall(line) for line in lines]))
+        prices = frozenset(" ".join(line.split()) for line in lines if self.PRICE.search(line))
+        headings = frozenset(" ".join(line.split()) for line in lines if line.lstrip().startswith("#"))
+        return fingerprint, exact, prices, headings
+
+    def _band_keys(self, fingerprint: int):
+        mask = (1 << self.band_width) - 1
+        for band in range(self.band_count):
+            yield band, fingerprint >> (band * self.band_width) & mask
+
+    @staticmethod
+    def jaccard(first: frozenset, second: frozenset) -> float:
+        union = len(first | second)
+        return len(first & second) / union if union else 1.0
+
+    def find(self, signature: tuple, scope: str) -> Optional[tuple]:
+        """Return (key, distance, jaccard) of the most similar confirmed page in the same domain"""
+        fingerprint, exact, prices, headings = signature
+        candidates = {}
+        for band, band_key in self._band_keys(fingerprint):
+            for entry in self.bands.get(scope, [{}] * self.band_count)[band].get(band_key, []):
+                if bin(entry[0] ^ fingerprint).count("1") <= self.max_distance:
+                    candidates[id(entry)] = entry
+        if headings:
+            for entry in self.by_headings.get((scope, headings), []):
+                candidates[id(entry)] = entry
+        best = None
+        for candidate, candidate_exact, candidate_prices, candidate_headings, key in candidates.values():
+            if headings != candidate_headings or self.jaccard(prices, candidate_prices) < self.min_jaccard:
+                continue
+            similarity = self.jaccard(exact, candidate_exact)
+            if similarity >= self.min_jaccard and (best is None or similarity > best[2]):
+                best = (key, bin(candidate ^ fingerprint).count("1"), round(similarity, 3))
+        return best
+
+    def add(self, signature: tuple, scope: str, key: Any):
+        entry = (*signature, key)
+        bands = self.bands.setdefault(scope, [{} for _ in range(self.band_count)])
+        for band, band_key in self._band_keys(signature[0]):
+            bands[band].setdefault(band_key, []).append(entry)
+        if signature[3]:
+            self.by_headings.setdefault((scope, signature[3]), []).append(entry)
+
+
+class LinkExpander:
+    """Bounded breadth-first expansion of a crawl through links found on crawled pages
+
+    Same-site links are canonicalised, scored with the URL prioritiser (links below
+    the product threshold are dropped) and capped by link depth, total expanded
+    pages and expanded pages per URL template, so faceted or calendar-style URL
+    spaces cannot take over the crawl.
+    """
+
+    SKIP_EXTENSIONS = re.compile(r"\.(jpe?g|png|gif|webp|avif|svg|ico|pdf|zip|css|js|json|xml|txt|mp4|mp3|woff2?)$", re.IGNORECASE)
+
+    def __init__(self, canonicalizer: UrlCanonicalizer, prioritizer: UrlPrioritizer, known_urls,
+                 max_depth: int = 3, max_pages: int = 100, max_per_template: int = 50):
+        self.canonicalizer = canonicalizer
+        self.prioritizer = prioritizer
+        self.seen = set(known_urls)
+        self.max_depth = max_depth
+        self.max_pages = max_pages
+        self.max_per_template = max_per_template
+        self.template_counts: Counter = Counter()
+        self.stats = {"pages_harvested": 0, "new_links": 0, "queued": 0, "restored": 0, "skipped_low_score": 0,
+                      "skipped_template_cap": 0, "skipped_page_cap": 0, "max_depth_reached": 0}
+
+    def wants_links(self, depth: int) -> bool:
+        return depth < self.max_depth
+
+    def harvest(self, page_url: str, links: List[Any], depth: int) -> List[Dict[str, Any]]:
+        """URL infos for the new, product-like links of a page crawled at the given depth"""
+        self.stats["pages_harvested"] += 1
+        queued = []
+        for link in links:
+            href = link.get('href') if isinstance(link, dict) else link
+            canonical = self.canonicalizer.canonicalize(urljoin(page_url, href)) if href else None
+            if not canonical or canonical in self.seen or self.SKIP_EXTENSIONS.search(urlparse(canonical).path):
+                continue
+            self.seen.add(canonical)
+            self.stats["new_links"] += 1
+            url_info = {
+                'url': canonical,
+                'template': UrlPrioritizer.template(canonical),
+                'title': (link.get('text') or '').strip()[:200] if isinstance(link, dict) else '',
+                'meta_description': '',
+                'source': 'link_expansion',
+                'depth': depth + 1,
+                'parent_url': page_url
+            }
+            url_info['score'] = self.prioritizer.score(url_info)
+            if url_info['score'] < self.prioritizer.product_threshold:
+                self.stats["skipped_low_score"] += 1
+            elif self.template_counts[url_info['template']] >= self.max_per_template:
+                self.stats["skipped_template_cap"] += 1
+            elif self.stats["queued"] >= self.max_pages:
+                self.stats["skipped_page_cap"] += 1
+            else:
+                self.template_counts[url_info['template']] += 1
+                self.stats["queued"] += 1
+                self.stats["max_depth_reached"] = max(self.stats["max_depth_reached"], url_info['depth'])
+                queued.append(url_info)
+        return queued
+
+    def restore(self, url_infos: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Re-queue links a checkpointed page expanded before a restart, counting them against the caps"""
+        restored = []
+        for url_info in url_infos:
+            if url_info['url'] in self.seen:
+                continue
+            self.seen.add(url_info['url'])
+            self.template_counts[url_info['template']] += 1
+            self.stats["queued"] += 1
+            self.stats["restored"] += 1
+            restored.append(url_info)
+        return restored
+
+class HttpFetchTier:
+    """Plain HTTP fetch with in-process HTML to markdown conversion, escalating to the browser when needed
+
+    A page escalates when the response looks JS-rendered: an empty framework mount
+    point, a product grid without any prices, or too little text. Escalation rates
+    are tracked per domain so domains that always need a browser skip the HTTP
+    attempt, with an occasional probe in case the site changes.
+    """
+
+    SHELL_PATTERN = re.compile(r'<div[^>]+id=["\'](root|app|__next|__nuxt|svelte)["\'][^>]*>\s*</div>', re.IGNORECASE)
+    GRID_PATTERN = re.compile(r'class=["\'][^"\']*(product-grid|products-grid|product-list|collection-grid|product-card|product-item)', re.IGNORECASE)
+    PRICE_PATTERN = re.compile(r'(₹|\$|€|£|\brs\.?|\binr|\busd)\s?\d', re.IGNORECASE)
+    JS_REQUIRED_PATTERN = re.compile(r'(enable|requires?) javascript', re.IGNORECASE)
+
+    def __init__(self, client: httpx.AsyncClient, history: Dict[str, Dict[str, float]], excluded_tags: List[str],
+                 word_count_threshold: int = 10):
+        self.client = client
+        self.history = history
+        self.excluded_tags = excluded_tags
+        self.word_count_threshold = word_count_threshold
+        self.mode = os.getenv("FETCH_TIER_MODE", "auto").lower()
+        self.min_text_chars = int(os.getenv("HTTP_TIER_MIN_TEXT_CHARS", "500"))
+        self.min_samples = int(os.getenv("FETCH_TIER_MIN_SAMPLES", "10"))
+        self.escalation_threshold = float(os.getenv("FETCH_TIER_ESCALATION_THRESHOLD", "0.8"))
+        self.probe_interval = max(1, int(os.getenv("FETCH_TIER_PROBE_INTERVAL", "20")))
+        self.scraping_strategy = LXMLWebScrapingStrategy()
+        self.markdown_generator = DefaultMarkdownGenerator()
+        self.job_stats: Dict[str, Dict[str, Any]] = {}
+        logger.info(f"⚙️ Fetch tier mode: {self.mode}")
+
+    def _domain_stats(self, domain: str) -> Dict[str, Any]:
+        return self.job_stats.setdefault(domain, {"http_attempts": 0, "http_served": 0, "escalations": 0, "browser_direct": 0, "reasons": {}})
+
+    def choose_tier(self, domain: str) -> str:
+        if self.mode in ("http", "browser"):
+            return self.mode
+        stats = self._domain_stats(domain)
+        history = self.history.get(domain, {})
+        attempts = (history.get('http_attempts') or 0) + stats["http_attempts"]
+        escalations = (history.get('escalations') or 0) + stats["escalations"]
+        if attempts >= self.min_samples and escalations / attempts >= self.escalation_threshold:
+            stats["browser_direct"] += 1
+            if stats["browser_direct"] % self.probe_interval != 0:
+                return "browser"
+        return "http"
+
+    def escalation_reason(self, html: str, markdown: str) -> Optional[str]:
+        text_chars = len(re.sub(r'\s+', ' ', markdown).strip())
+        if self.SHELL_PATTERN.search(html) and text_chars < self.min_text_chars * 2:
+            return "framework_shell"
+        if text_chars < self.min_text_chars:
+            return "too_little_text"
+        if self.GRID_PATTERN.search(html) and not self.PRICE_PATTERN.search(markdown):
+            return "empty_grid"
+        if self.JS_REQUIRED_PATTERN.search(markdown) and text_chars < self.min_text_chars * 4:
+            return "javascript_required"
+        return None
+
+    def _convert(self, url: str, html: str) -> tuple:
+        scraped = self.scraping_strategy.scrap(
+            url, html, excluded_tags=self.excluded_tags, word_count_threshold=self.word_count_threshold
+        )
+        markdown = self.markdown_generator.generate_markdown(input_html=scraped.cleaned_html, base_url=url)
+        links = {
+            "internal": [link.model_dump() for link in scraped.links.internal],
+            "external": [link.model_dump() for link in scraped.links.external]
+        }
+        return markdown, links, scraped.metadata
+
+    async def fetch(self, url: str, domain: str) -> tuple:
+        """Return (CrawlResult or None, escalation reason); None means the browser should render the page"""
+        stats = self._domain_stats(domain)
+        stats["http_attempts"] += 1
+        reason = None
+        result = None
+        try:
+            response = await self.client.get(url)
+            headers = dict(response.headers)
+            content_type = response.headers.get('content-type', '')
+            if response.status_code in (404, 410, 429, 503):
+                # The browser would get the same answer; let the caller record the failure
+                result = CrawlResult(url=url, html="", success=False, status_code=response.status_code, response_headers=headers)
+            elif response.status_code != 200:
+                reason = f"http_{response.status_code}"
+            elif 'html' not in content_type:
+                reason = "non_html"
+            else:
+                html = response.text
+                markdown, links, metadata = await asyncio.to_thread(self._convert, str(response.url), html)
+                reason = self.escalation_reason(html, markdown.raw_markdown)
+                # In http-only mode the converted page is used even when it looks JS-rendered
+                if not reason or self.mode == "http":
+                    result = CrawlResult(
+                        url=url, html=html, success=True, markdown=markdown, links=links, metadata=metadata,
+                        status_code=response.status_code, response_headers=headers
+                    )
+        except httpx.HTTPError as e:
+            reason = "request_error"
+            logger.warning(f"⚠️ HTTP tier request failed for {url}: {e}")
+        if reason:
+            stats["escalations"] += 1
+            stats["reasons"][reason] = stats["reasons"].get(reason, 0) + 1
+        if result is not None and result.success:
+            stats["http_served"] += 1
+        return result, reason
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "mode": self.mode,
+            "domains": {
+                domain: {**stats, "escalation_rate": round(stats["escalations"] / max(stats["http_attempts"], 1), 3)}
+                for domain, stats in self.job_stats.items()
+            }
+        }
+
+
+CURRENCY_SYMBOLS = {"INR": "₹", "USD": "$", "EUR": "€", "GBP": "£", "JPY": "¥", "AUD": "A$", "CAD": "C$"}
+
+
+def format_price(price: Any, currency: Optional[str]) -> str:
+    """Format a price the way the Gemini prompt asks for, e.g. ₹250 or $12"""
+    if price in (None, ""):
+        return "N/A"
+    currency = (currency or "").upper()
+    symbol = CURRENCY_SYMBOLS.get(currency)
+    if symbol:
+        return f"{symbol}{price}"
+    return f"{currency} {price}".strip()
+
+
+def page_markdown_header(url: str) -> str:
+    return f"# Content from {url}\n\n**URL:** [{url}]({url})\n\n---\n\n"
+
+
+def read_page_markdown(markdown_file: str, url: str) -> str:
+    """Read a page's markdown back from the file crawl_single_url wrote, without the header it added"""
+    with open(markdown_file, 'r', encoding='utf-8') as f:
+        content = f.read()
+    header = page_markdown_header(url)
+    return content[len(header):] if content.startswith(header) else content
+
+
+def html_to_text(html: Optional[str], limit: int = 300) -> str:
+    """Plain-text excerpt of an HTML fragment, or N/A when empty"""
+    if not html or not html.strip():
+        return "N/A"
+    try:
+        text = lxml.html.fromstring(html).text_content()
+    except (ValueError, lxml.etree.ParserError):
+        text = html
+    text = re.sub(r'\s+', ' ', text).strip()
+    return text[:limit] or "N/A"
+
+
+class StructuredDataExtractor:
+    """Deterministic product extraction from schema.org JSON-LD, microdata and OpenGraph tags"""
+
+    PRICE_PATTERN = re.compile(r'(₹|\$|€|£|\brs\.?|\binr|\busd)\s?\d', re.IGNORECASE)
+
+    def extract(self, html: str, url: str, markdown: str = "") -> Dict[str, Any]:
+        """Return {"products": [...], "source": str or None, "complete": bool}"""
+        if not html:
+            return {"products": [], "source": None, "complete": False}
+        try:
+            tree = lxml.html.fromstring(html)
+        except (ValueError, lxml.etree.ParserError) as e:
+            logger.warning(f"⚠️ Could not parse HTML of {url} for structured data: {e}")
+            return {"products": [], "source": None, "complete": False}
+        for source, nodes in (("json-ld", self._json_ld_products(tree)),
+                              ("microdata", self._microdata_products(tree)),
+                              ("opengraph", self._opengraph_products(tree))):
+            products = [product for product in (self._to_product(node, url) for node in nodes) if product]
+            if products:
+                return {"products": products, "source": source, "complete": self.is_complete(products, markdown)}
+        return {"products": [], "source": None, "complete": False}
+
+    def is_complete(self, products: List[Dict[str, Any]], markdown: str) -> bool:
+        """True when every product has a name and price and the page shows no more prices than these products explain"""
+        if not products or not all(p['productname'] != "N/A" and p['current_price'] != "N/A" for p in products):
+            return False
+        return len(self.PRICE_PATTERN.findall(markdown or "")) <= len(products) * 3
+
+    def _json_ld_products(self, tree) -> List[Dict[str, Any]]:
+        nodes = []
+        for script in tree.xpath('//script[@type="application/ld+json"]'):
+            try:
+                data = json.loads(script.text_content().strip() or "null", strict=False)
+            except ValueError:
+                continue
+            stack = [data]
+            while stack:
+                node = stack.pop()
+                if isinstance(node, list):
+                    stack.extend(reversed(node))
+                elif isinstance(node, dict):
+                    types = node.get('@type')
+                    types = types if isinstance(types, list) else [types]
+                    if "Product" in types:
+                        nodes.append(node)
+                        continue
+                    for key in ('@graph', 'itemListElement', 'item', 'mainEntity'):
+                        if key in node:
+                            stack.append(node[key])
+        return nodes
+
+    def _microdata_item(self, element) -> Dict[str, Any]:
+        item = {}
+        for child in element.iterchildren():
+            if not isinstance(child.tag, str):
+                continue
+            prop = child.get('itemprop')
+            if prop:
+                if child.get('itemscope') is not None:
+                    value = self._microdata_item(child)
+                else:
+                    value = child.get('content') or child.get('src') or child.get('href') or child.text_content().strip()
+                item.setdefault(prop, value)
+            if child.get('itemscope') is None:
+                item.update({k: v for k, v in self._microdata_item(child).items() if k not in item})
+        return item
+
+    def _microdata_products(self, tree) -> List[Dict[str, Any]]:
+        return [self._microdata_item(element) for element in tree.xpath('//*[@itemscope][contains(@itemtype, "schema.org/Product")]')]
+
+    def _opengraph_products(self, tree) -> List[Dict[str, Any]]:
+        meta = {}
+        for tag in tree.xpath('//meta[@property or @name]'):
+            key = (tag.get('property') or tag.get('name') or '').lower()
+            if key and key not in meta:
+                meta[key] = tag.get('content') or ''
+        if not meta.get('og:type', '').startswith('product'):
+            return []
+        price = meta.get('product:price:amount') or meta.get('og:price:amount')
+        return [{
+            "name": meta.get('og:title'),
+            "description": meta.get('og:description'),
+            "image": meta.get('og:image'),
+            "offers": {"price": price, "priceCurrency": meta.get('product:price:currency') or meta.get('og:price:currency')} if price else None
+        }]
+
+    def _first(self, value: Any) -> Any:
+        return value[0] if isinstance(value, list) and value else value
+
+    def _to_product(self, node: Dict[str, Any], url: str) -> Optional[Dict[str, Any]]:
+        name = self._first(node.get('name'))
+        if not name or not isinstance(name, str):
+            return None
+        offers = self._first(node.get('offers')) or {}
+        offers = offers if isinstance(offers, dict) else {}
+        currency = offers.get('priceCurrency')
+        price = offers.get('price', offers.get('lowPrice'))
+        original = None
+        specs = offers.get('priceSpecification') or []
+        for spec in specs if isinstance(specs, list) else [specs]:
+            if isinstance(spec, dict) and any(marker in str(spec.get('priceType', '')) for marker in ("StrikethroughPrice", "ListPrice")):
+                original = spec.get('price')
+        if original is None and offers.get('@type') == "AggregateOffer":
+            original = offers.get('highPrice')
+        rating = node.get('aggregateRating') or {}
+        rating = rating if isinstance(rating, dict) else {}
+        image = self._first(node.get('image'))
+        if isinstance(image, dict):
+            image = image.get('url') or image.get('contentUrl')
+        current_price = format_price(price, currency)
+        return ProductInfo(
+            productname=name.strip(),
+            description=str(self._first(node.get('description')) or "")[:300].strip() or "N/A",
+            current_price=current_price,
+            original_price=format_price(original, currency) if original not in (None, "") else current_price,
+            rating=str(rating.get('ratingValue') or "N/A"),
+            review=str(rating.get('reviewCount') or rating.get('ratingCount') or "N/A"),
+            image_url=urljoin(url, image) if isinstance(image, str) and image else "N/A",
+            source_url=url
+        ).model_dump()
+
+
+class MarkdownReducer:
+    """Shrinks page markdown before Gemini extraction
+
+    Three passes: boilerplate lines (cookie banners, newsletter and legal text,
+    promo bars, runs of menu links) are dropped; repeated lines are kept once;
+    and when the page shows prices, only windows of lines around each price are
+    kept, plus H1 headings, with "..." marking the gaps. Only banner-like lines
+    (plain text, no heading or link) count as boilerplate, and never when they
+    carry or sit next to a price, so a product called "Chocolate Chip Cookie"
+    keeps its title. Long grids keep every product instead of being cut off by
+    the prompt's character limit.
+    """
+
+    CURRENCY = r'₹|\$|€|£|¥|\brs\.?|\binr\b|\busd\b|\beur\b|\bgbp\b|\bchf\b|\bkr\.?|\bsek\b|\bnok\b|\bdkk\b|\bzł|\bpln\b|\bczk\b|\bkč'
+    # "$24", "Rs. 250" and "24,99 €", "100 kr"
+    PRICE_PATTERN = re.compile(rf'({CURRENCY})\s?\d|\d\s?({CURRENCY})(?!\w)', re.IGNORECASE)
+    BOILERPLATE_PATTERN = re.compile(
+        r'cookie|newsletter|unsubscribe|all rights reserved|©|\(c\) \d{4}|copyright|privacy policy|terms (of|&|and) (service|use)|'
+        r'skip to (main )?content|sign in|log in|create an account|follow us|powered by|enable javascript',
+        re.IGNORECASE
+    )
+    PROMO_PATTERN = re.compile(r'free (shipping|delivery)|(orders?|purchases?) (over|above)|use code|promo code', re.IGNORECASE)
+    MENU_LINK_PATTERN = re.compile(r'^\s*[*+-]?\s*\[[^\]!]*\]\([^)]*\)\s*$')
+    BANNER_MAX_WORDS = 40
+    PRICE_NEIGHBOURHOOD = 2
+    GAP = "..."
+
+    def __init__(self, window_before: int = 6, window_after: int = 4, min_chars: int = 1500):
+        self.window_before = window_before
+        self.window_after = window_after
+        self.min_chars = min_chars
+
+    def _is_banner(self, line: str) -> bool:
+        """Plain text that could be a banner: no heading, link or image, and not a paragraph of copy"""
+        stripped = line.strip()
+        return not stripped.startswith("#") and "](" not in stripped and len(stripped.split()) <= self.BANNER_MAX_WORDS
+
+    def _is_boilerplate(self, line: str, near_price: bool) -> bool:
+        if not self._is_banner(line):
+            return False
+        if self.PROMO_PATTERN.search(line):
+            return True
+        return not near_price and bool(self.BOILERPLATE_PATTERN.search(line))
+
+    def _drop_menus(self, lines: List[str], keep: List[bool]):
+        """Runs of three or more bare link list items (navigation, footer menus)"""
+        run = []
+        for index, line in enumerate(lines + [""]):
+            if index < len(lines) and keep[index] and self.MENU_LINK_PATTERN.match(line):
+                run.append(index)
+                continue
+            if len(run) >= 3:
+                for menu_index in run:
+                    keep[menu_index] = False
+            run = []
+
+    def reduce(self, markdown: str) -> Tuple[str, Dict[str, int]]:
+        """Return the reduced markdown and per-pass line counts"""
+        stats = {"original_chars": len(markdown), "reduced_chars": len(markdown), "boilerplate_lines": 0,
+                 "repeated_lines": 0, "windowed_lines": 0}
+        if len(markdown) < self.min_chars:
+            return markdown, stats
+        lines = [line.rstrip() for line in markdown.splitlines()]
+        keep = [bool(line.strip()) for line in lines]
+        # Promo bars quote prices ("orders over $50") but are not product prices
+        has_price = [keep[index] and bool(self.PRICE_PATTERN.search(line)) and not self.PROMO_PATTERN.search(line)
+                     for index, line in enumerate(lines)]
+
+        non_blank = [index for index in range(len(lines)) if keep[index]]
+        near_price = [False] * len(lines)
+        for position, index in enumerate(non_blank):
+            if has_price[index]:
+                for near in non_blank[max(0, position - self.PRICE_NEIGHBOURHOOD):position + self.PRICE_NEIGHBOURHOOD + 1]:
+                    near_price[near] = True
+        for index, line in enumerate(lines):
+            if keep[index] and self._is_boilerplate(line, near_price[index]):
+                keep[index] = False
+                stats["boilerplate_lines"] += 1
+        before_menus = sum(keep)
+        self._drop_menus(lines, keep)
+        stats["boilerplate_lines"] += before_menus - sum(keep)
+
+        seen = set()
+        for index, line in enumerate(lines):
+            if not keep[index]:
+                continue
+            normalized = re.sub(r'\s+', ' ', line).strip().lower()
+            # Short price lines repeat legitimately ("$24.00" under two products); long ones are duplicate cards
+            if normalized in seen and (not has_price[index] or len(normalized) >= 40):
+                keep[index] = False
+                stats["repeated_lines"] += 1
+            seen.add(normalized)
+
+        kept = [index for index in range(len(lines)) if keep[index]]
+        price_positions = [position for position, index in enumerate(kept) if has_price[index]]
+        if price_positions:
+            in_window = [False] * len(kept)
+            for position in price_positions:
+                for near in range(max(0, position - self.window_before), min(len(kept), position + self.window_after + 1)):
+                    in_window[near] = True
+            for position, index in enumerate(kept):
+                if not in_window[position] and lines[index].startswith("# "):
+                    in_window[position] = True
+            stats["windowed_lines"] = in_window.count(False)
+        else:
+            in_window = [True] * len(kept)
+
+        output = []
+        for position, index in enumerate(kept):
+            if in_window[position]:
+                output.append(lines[index])
+            elif output and output[-1] != self.GAP:
+                output.append(self.GAP)
+        reduced = "\n".join(output)
+        stats["reduced_chars"] = len(reduced)
+        return reduced, stats
+
+
+class CatalogIngester:
+    """Bulk catalog download from Shopify /products.json and the WooCommerce Store API"""
+
+    def __init__(self, client: httpx.AsyncClient, rate_limiter: DomainRateLimiter, concurrency: int = 4, max_pages: int = 100):
+        self.client = client
+        self.rate_limiter = rate_limiter
+        self.concurrency = max(1, concurrency)
+        self.max_pages = max(1, max_pages)
+        self.requests = 0
+        self.failed_pages = 0
+
+    async def _get_json(self, url: str) -> tuple:
+        """GET a JSON endpoint through the domain rate limiter; returns (data or None, headers)"""
+        domain = urlparse(url).netloc.replace('www.', '')
+        await self.rate_limiter.acquire(domain, url)
+        started = time.perf_counter()
+        self.requests += 1
+        try:
+            response = await self.client.get(url, headers={"Accept": "application/json"})
+        except httpx.HTTPError as e:
+            self.rate_limiter.record(domain, None, (time.perf_counter() - started) * 1000)
+            logger.warning(f"⚠️ Catalog request failed for {url}: {e}")
+            return None, {}
+        self.rate_limiter.record(domain, response.status_code, (time.perf_counter() - started) * 1000, response.headers.get('retry-after'))
+        if response.status_code != 200:
+            return None, response.headers
+        try:
+            return response.json(), response.headers
+        except ValueError:
+            return None, response.headers
+
+    async def detect_platform(self, root_url: str) -> Optional[str]:
+        data, _ = await self._get_json(urljoin(root_url, "/products.json?limit=1"))
+        if isinstance(data, dict) and isinstance(data.get('products'), list):
+            return "shopify"
+        data, _ = await self._get_json(urljoin(root_url, "/wp-json/wc/store/products?per_page=1"))
+        if isinstance(data, list):
+            return "woocommerce"
+        return None
+
+    async def fetch_catalog(self, root_url: str) -> Optional[Dict[str, Any]]:
+        """Return {"platform", "products", "pages"} or None when the store has no usable catalog endpoint"""
+        platform = await self.detect_platform(root_url)
+        if not platform:
+            logger.info(f"ℹ️ No Shopify or WooCommerce catalog endpoint found for {root_url}")
+            return None
+        logger.info(f"🛒 Detected {platform} storefront, downloading catalog")
+        if platform == "shopify":
+            products, pages = await self._shopify_catalog(root_url)
+        else:
+            products, pages = await self._woocommerce_catalog(root_url)
+        if self.failed_pages:
+            # A partial catalog would silently drop products; crawl the site instead
+            logger.warning(f"⚠️ {self.failed_pages} catalog page(s) failed for {root_url}, falling back to crawling")
+            return None
+        return {"platform": platform, "products": products, "pages": pages}
+
+    async def _shopify_currency(self, root_url: str) -> Optional[str]:
+        data, _ = await self._get_json(urljoin(root_url, "/cart.js"))
+        return data.get('currency') if isinstance(data, dict) else None
+
+    async def _shopify_catalog(self, root_url: str) -> tuple:
+        currency = await self._shopify_currency(root_url)
+        products = []
+        page = 1
+        # The total is unknown up front, so fetch windows of pages until one comes back empty
+        while page <= self.max_pages:
+            window = list(range(page, min(page + self.concurrency, self.max_pages + 1)))
+            batches = await asyncio.gather(*(self._get_json(urljoin(root_url, f"/products.json?limit=250&page={n}")) for n in window))
+            for data, _ in batches:
+                if not isinstance(data, dict) or not isinstance(data.get('products'), list):
+                    self.failed_pages += 1
+                    return products, page - 1
+                if not data['products']:
+                    return products, page - 1
+                products.extend(self._shopify_product(item, root_url, currency) for item in data['products'])
+                page += 1
+        logger.warning(f"⚠️ Stopped after CATALOG_MAX_PAGES={self.max_pages} Shopify pages")
+        return products, page - 1
+
+    def _shopify_product(self, item: Dict[str, Any], root_url: str, currency: Optional[str]) -> Dict[str, Any]:
+        variants = item.get('variants') or [{}]
+        variant = next((v for v in variants if v.get('available')), variants[0])
+        current_price = format_price(variant.get('price'), currency)
+        images = item.get('images') or []
+        return ProductInfo(
+            productname=item.get('title') or "N/A",
+            description=html_to_text(item.get('body_html')),
+            current_price=current_price,
+            original_price=format_price(variant.get('compare_at_price'), currency) if variant.get('compare_at_price') else current_price,
+            rating="N/A",
+            review="N/A",
+            image_url=images[0].get('src', "N/A") if images else "N/A",
+            source_url=urljoin(root_url, f"/products/{item.get('handle', '')}")
+        ).model_dump()
+
+    async def _woocommerce_catalog(self, root_url: str) -> tuple:
+        endpoint = urljoin(root_url, "/wp-json/wc/store/products?per_page=100&page={page}")
+        data, headers = await self._get_json(endpoint.format(page=1))
+        if not isinstance(data, list):
+            self.failed_pages += 1
+            return [], 1
+        total_pages = min(int(headers.get('x-wp-totalpages', "1") or 1), self.max_pages)
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def fetch_page(page: int):
+            async with semaphore:
+                return await self._get_json(endpoint.format(page=page))
+
+        batches = [data] + [batch for batch, _ in await asyncio.gather(*(fetch_page(page) for page in range(2, total_pages + 1)))]
+        products = []
+        for batch in batches:
+            if not isinstance(batch, list):
+                self.failed_pages += 1
+                continue
+            products.extend(self._woocommerce_product(item) for item in batch)
+        return products, total_pages
+
+    def _woocommerce_product(self, item: Dict[str, Any]) -> Dict[str, Any]:
+        prices = item.get('prices') or {}
+        minor_unit = int(prices.get('currency_minor_unit') or 0)
+        code = prices.get('currency_code')
+
+        def amount(raw: Any) -> str:
+            if raw in (None, ""):
+                return "N/A"
+            value = f"{int(raw) / 10 ** minor_unit:.{minor_unit}f}"
+            return format_price(value, code) if code in CURRENCY_SYMBOLS else f"{prices.get('currency_symbol', '')}{value}"
+
+        images = item.get('images') or []
+        review_count = item.get('review_count') or 0
+        return ProductInfo(
+            productname=html_to_text(item.get('name')),
+            description=html_to_text(item.get('short_description') or item.get('description')),
+            current_price=amount(prices.get('price')),
+            original_price=amount(prices.get('regular_price') or prices.get('price')),
+            rating=str(item.get('average_rating')) if review_count else "N/A",
+            review=str(review_count) if review_count else "N/A",
+            image_url=images[0].get('src', "N/A") if images else "N/A",
+            source_url=item.get('permalink') or "N/A"
+        ).model_dump()
+
+
+class ScreenshotPolicy:
+    """Decides which pages get a screenshot and captures them from the browser hooks
+
+    Modes: off, sampled (stable per-URL sample), first_n, on_failure (error status or
+    near-empty HTML) and all. Captures are viewport JPEGs, re-encoded at lower quality
+    when they exceed SCREENSHOT_MAX_BYTES; full-page captures are clipped in height.
+    """
+
+    def __init__(self):
+        self.mode = os.getenv("SCREENSHOT_MODE", "first_n").lower()
+        self.sample_rate = float(os.getenv("SCREENSHOT_SAMPLE_RATE", "0.1"))
+        self.first_n = int(os.getenv("SCREENSHOT_FIRST_N", "10"))
+        self.quality = int(os.getenv("SCREENSHOT_QUALITY", "70"))
+        self.max_bytes = int(os.getenv("SCREENSHOT_MAX_BYTES", "300000"))
+        self.full_page = os.getenv("SCREENSHOT_FULL_PAGE", "false").lower() == "true"
+        self.max_height = int(os.getenv("SCREENSHOT_MAX_HEIGHT", "4000"))
+        self.failure_html_bytes = int(os.getenv("SCREENSHOT_FAILURE_HTML_BYTES", "2000"))
+        self.pages_seen = 0
+        self.captures = 0
+        self.bytes_captured = 0
+        self.capture_ms: List[float] = []
+        logger.info(f"📸 Screenshot mode: {self.mode}")
+
+    def should_capture(self, url: str) -> Optional[str]:
+        """Return "always", "on_failure" or None for a page about to be rendered"""
+        self.pages_seen += 1
+        if self.mode == "all":
+            return "always"
+        if self.mode == "first_n":
+            return "always" if self.pages_seen <= self.first_n else None
+        if self.mode == "sampled":
+            bucket = int(hashlib.sha1(url.encode('utf-8')).hexdigest()[:8], 16) % 10000
+            return "always" if bucket < self.sample_rate * 10000 else None
+        if self.mode == "on_failure":
+            return "on_failure"
+        return None
+
+    async def record_status_hook(self, page, response=None, **kwargs):
+        page_ctx = _page_context.get()
+        if page_ctx is not None and response is not None:
+            page_ctx["goto_status"] = response.status
+        return page
+
+    async def capture_hook(self, page, html: str = None, **kwargs):
+        page_ctx = _page_context.get()
+        if not page_ctx or not page_ctx.get("screenshot"):
+            return page
+        if page_ctx["screenshot"] == "on_failure":
+            failed = (page_ctx.get("goto_status") or 200) >= 400 or len(html or "") < self.failure_html_bytes
+            if not failed:
+                return page
+        started = time.perf_counter()
+        try:
+            data = await self._capture(page)
+        except Exception as e:
+            logger.warning(f"⚠️ Screenshot failed for {page_ctx.get('url')}: {e}")
+            return page
+        capture_ms = (time.perf_counter() - started) * 1000
+        page_ctx["screenshot_bytes"] = data
+        page_ctx["screenshot_ms"] = capture_ms
+        self.captures += 1
+        self.bytes_captured += len(data)
+        self.capture_ms.append(capture_ms)
+        return page
+
+    async def _capture(self, page) -> bytes:
+        options = {"type": "jpeg", "quality": self.quality, "full_page": False}
+        if self.full_page:
+            height = await page.evaluate("document.documentElement.scrollHeight")
+            width = (page.viewport_size or {}).get("width", 1280)
+            options.update(full_page=True, clip={"x": 0, "y": 0, "width": width, "height": min(height, self.max_height)})
+        data = await page.screenshot(**options)
+        quality = self.quality
+        while len(data) > self.max_bytes and quality > 30:
+            quality = max(30, quality // 2)
+            data = await page.screenshot(**{**options, "quality": quality})
+        return data
+
+    def get_stats(self) -> Dict[str, Any]:
+        avg_bytes = self.bytes_captured / max(self.captures, 1)
+        skipped = max(self.pages_seen - self.captures, 0)
+        return {
+            "mode": self.mode,
+            "browser_pages": self.pages_seen,
+            "captures": self.captures,
+            "pages_without_capture": skipped,
+            "bytes_captured": self.bytes_captured,
+            "avg_capture_bytes": round(avg_bytes),
+            "avg_capture_ms": round(sum(self.capture_ms) / max(len(self.capture_ms), 1), 1),
+            "max_capture_ms": round(max(self.capture_ms, default=0.0), 1),
+            "estimated_bytes_saved": round(skipped * avg_bytes)
+        }
+
+
+class ScreenshotUploader:
+    """Background workers that encode, save and upload screenshots off the crawl path"""
+
+    def __init__(self, aws_service: AWSService, image_format: str = "jpeg", workers: int = 1, queue_size: int = 50):
+        if image_format == "webp" and Image is None:
+            logger.warning("⚠️ SCREENSHOT_FORMAT=webp needs Pillow, keeping JPEG")
+            image_format = "jpeg"
+        self.aws_service = aws_service
+        self.image_format = image_format
+        self.workers = max(1, workers)
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=max(1, queue_size))
+        self.tasks: List[asyncio.Task] = []
+        self.image_dir = None
+        self.s3_prefix = None
+        self.uploaded = 0
+        self.dropped = 0
+        self.bytes_uploaded = 0
+        self.upload_ms: List[float] = []
+
+    def start(self, image_dir: Path, s3_prefix: str):
+        self.image_dir = image_dir
+        self.s3_prefix = s3_prefix
+        self.tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    def submit(self, result: Dict[str, Any], data: bytes):
+        """Queue a capture without ever blocking the crawl; drops it if the queue is full"""
+        try:
+            self.queue.put_nowait((result, data))
+        except asyncio.QueueFull:
+            self.dropped += 1
+            logger.warning(f"⚠️ Screenshot queue full, dropping capture for {result['url']}")
+
+    def _encode(self, data: bytes) -> tuple:
+        """Return (bytes, format); falls back to the captured JPEG if WebP encoding fails"""
+        if self.image_format != "webp":
+            return data, "jpeg"
+        try:
+            output = io.BytesIO()
+            Image.open(io.BytesIO(data)).save(output, format="WEBP", quality=int(os.getenv("SCREENSHOT_QUALITY", "70")))
+            return output.getvalue(), "webp"
+        except Exception as e:
+            logger.warning(f"⚠️ WebP encoding failed, keeping JPEG: {e}")
+            return data, "jpeg"
+
+    def _save(self, path: Path, data: bytes):
+        with open(path, "wb") as f:
+            f.write(data)
+
+    async def _worker(self):
+        while True:
+            result, data = await self.queue.get()
+            started = time.perf_counter()
+            try:
+                data, image_format = await asyncio.to_thread(self._encode, data)
+                extension = "webp" if image_format == "webp" else "jpg"
+                screenshot_file = self.image_dir / f"{result['filename']}.{extension}"
+                await asyncio.to_thread(self._save, screenshot_file, data)
+                result['screenshot_file'] = str(screenshot_file)
+                result['s3_screenshot_url'] = await asyncio.to_thread(
+                    self.aws_service.upload_bytes_to_s3, data, f"{self.s3_prefix}/images/{result['filename']}.{extension}", f"image/{image_format}"
+                )
+                self.uploaded += 1
+                self.bytes_uploaded += len(data)
+                self.upload_ms.append((time.perf_counter() - started) * 1000)
+            except Exception as e:
+                logger.error(f"❌ Screenshot upload failed for {result['url']}: {e}")
+            finally:
+                self.queue.task_done()
+
+    async def drain(self):
+        """Wait for queued uploads to finish and stop the workers"""
+        if not self.tasks:
+            return
+        await self.queue.join()
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        self.tasks = []
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "format": self.image_format,
+            "uploaded": self.uploaded,
+            "dropped": self.dropped,
+            "bytes_uploaded": self.bytes_uploaded,
+            "avg_upload_ms": round(sum(self.upload_ms) / max(len(self.upload_ms), 1), 1)
+        }
+
+
+class RequestInterceptor:
+    """Playwright route interception that blocks heavy or irrelevant requests while a page renders
+
+    Profiles: off, light (fonts and media), standard (light plus analytics/ad hosts and
+    third-party chat/social widgets) and aggressive (standard plus images and all
+    third-party scripts). Images, first-party scripts, XHR and stylesheets are allowed
+    by default so lazy-loaded product grids still render; aggressive lets images through
+    on pages picked for a screenshot.
+
+    REQUEST_BLOCK_OVERRIDES takes per-domain JSON, e.g.
+    {"shop.com": {"profile": "light", "allow_hosts": ["cdn.shop.com"], "block_hosts": [], "block_types": ["image"]}}.
+    """
+
+    PROFILES = {
+        "off": {"types": set(), "tracker_hosts": False, "third_party_scripts": False},
+        "light": {"types": {"font", "media"}, "tracker_hosts": False, "third_party_scripts": False},
+        "standard": {"types": {"font", "media"}, "tracker_hosts": True, "third_party_scripts": False},
+        "aggressive": {"types": {"font", "media", "image"}, "tracker_hosts": True, "third_party_scripts": True},
+    }
+    TRACKER_HOSTS = (
+        "google-analytics.com", "googletagmanager.com", "doubleclick.net", "googlesyndication.com", "adservice.google.com",
+        "facebook.net", "connect.facebook.net", "hotjar.com", "clarity.ms", "segment.io", "segment.com", "mixpanel.com",
+        "analytics.tiktok.com", "sc-static.net", "ct.pinterest.com", "bat.bing.com", "criteo.com", "criteo.net", "taboola.com",
+        "outbrain.com", "amazon-adsystem.com", "quantserve.com", "scorecardresearch.com", "newrelic.com", "nr-data.net",
+        "fullstory.com", "mouseflow.com", "intercom.io", "intercomcdn.com", "tawk.to", "crisp.chat", "zdassets.com",
+        "zopim.com", "drift.com", "livechatinc.com", "freshchat.com", "gorgias.chat", "js.hs-scripts.com", "hs-analytics.net",
+        "static.klaviyo.com", "platform.twitter.com", "youtube.com", "ytimg.com", "vimeo.com", "player.vimeo.com",
+    )
+    # Rough transfer sizes used to estimate bytes saved; blocked requests are never downloaded
+    ESTIMATED_BYTES = {"font": 40000, "media": 500000, "image": 60000, "script": 80000, "stylesheet": 20000}
+    DEFAULT_ESTIMATED_BYTES = 15000
+
+    def __init__(self):
+        self.profile = os.getenv("REQUEST_BLOCK_PROFILE", "standard").lower()
+        if self.profile not in self.PROFILES:
+            logger.warning(f"⚠️ Unknown REQUEST_BLOCK_PROFILE '{self.profile}', using standard")
+            self.profile = "standard"
+        try:
+            self.overrides = json.loads(os.getenv("REQUEST_BLOCK_OVERRIDES", "{}") or "{}")
+        except ValueError as e:
+            logger.warning(f"⚠️ Invalid REQUEST_BLOCK_OVERRIDES JSON, ignoring: {e}")
+            self.overrides = {}
+        self.blocked = 0
+        self.allowed = 0
+        self.blocked_by_type: Dict[str, int] = {}
+        self.blocked_by_host: Dict[str, int] = {}
+        self.estimated_bytes_saved = 0
+        logger.info(f"🛡️ Request block profile: {self.profile} ({len(self.overrides)} domain override(s))")
+
+    @staticmethod
+    def _host_matches(host: str, patterns) -> bool:
+        return any(host == pattern or host.endswith("." + pattern) for pattern in patterns)
+
+    def _rules_for(self, domain: str) -> Dict[str, Any]:
+        override = self.overrides.get(domain, {})
+        profile = self.PROFILES.get(override.get("profile", self.profile), self.PROFILES[self.profile])
+        return {
+            "types": (profile["types"] | set(override.get("block_types", []))) - set(override.get("allow_types", [])),
+            "tracker_hosts": profile["tracker_hosts"],
+            "third_party_scripts": profile["third_party_scripts"],
+            "allow_hosts": override.get("allow_hosts", []),
+            "block_hosts": override.get("block_hosts", []),
+        }
+
+    def should_block(self, rules: Dict[str, Any], site_domain: str, request_url: str, resource_type: str) -> bool:
+        host = (urlparse(request_url).hostname or "").lower()
+        if not host or resource_type == "document":
+            return False
+        if self._host_matches(host, rules["allow_hosts"]):
+            return False
+        if self._host_matches(host, rules["block_hosts"]):
+            return True
+        if resource_type in rules["types"]:
+            return True
+        if rules["tracker_hosts"] and self._host_matches(host, self.TRACKER_HOSTS):
+            return True
+        first_party = self._host_matches(host, [site_domain])
+        return rules["third_party_scripts"] and resource_type == "script" and not first_party
+
+    async def install(self, page, **kwargs):
+        """on_page_context_created hook: route every request of the page through the profile"""
+        page_ctx = _page_context.get() or {}
+        site_domain = urlparse(page_ctx.get("url", "")).netloc.lower().replace('www.', '')
+        rules = self._rules_for(site_domain)
+        if page_ctx.get("screenshot") == "always":
+            rules["types"] = rules["types"] - {"image"}  # captures need the real images
+        if not rules["types"] and not rules["tracker_hosts"] and not rules["block_hosts"]:
+            return page
+        page_ctx["blocked_requests"] = 0
+
+        async def handle(route):
+            request = route.request
+            if self.should_block(rules, site_domain, request.url, request.resource_type):
+                self.blocked += 1
+                page_ctx["blocked_requests"] += 1
+                self.blocked_by_type[request.resource_type] = self.blocked_by_type.get(request.resource_type, 0) + 1
+                host = urlparse(request.url).hostname or ""
+                self.blocked_by_host[host] = self.blocked_by_host.get(host, 0) + 1
+                self.estimated_bytes_saved += self.ESTIMATED_BYTES.get(request.resource_type, self.DEFAULT_ESTIMATED_BYTES)
+                await route.abort()
+            else:
+                self.allowed += 1
+                await route.continue_()
+
+        await page.route("**/*", handle)
+        return page
+
+    def get_stats(self) -> Dict[str, Any]:
+        top_hosts = sorted(self.blocked_by_host.items(), key=lambda item: item[1], reverse=True)[:10]
+        return {
+            "profile": self.profile,
+            "blocked_requests": self.blocked,
+            "allowed_requests": self.allowed,
+            "blocked_by_type": self.blocked_by_type,
+            "top_blocked_hosts": dict(top_hosts),
+            "estimated_bytes_saved": self.estimated_bytes_saved
+        }
+
+
+class BrowserPool:
+    """Job-scoped pool of long-lived browsers that hand out an isolated page per URL"""
+
+    BROWSER_FAILURE_MARKERS = (
+        "has been closed",
+        "browser closed",
+        "connection closed",
+        "target crashed",
+    )
+
+    def __init__(self, browser_config: BrowserConfig, size: int = 1, pages_per_browser: int = 1, max_pages_per_browser: int = 0):
+        logger.info(f"🌐 Initializing BrowserPool: size={size}, pages_per_browser={pages_per_browser}, recycle_after={max_pages_per_browser or 'never'}")
+        self.browser_config = browser_config
+        self.size = max(1, size)
+        self.pages_per_browser = max(1, pages_per_browser)
+        self.max_pages_per_browser = max(0, max_pages_per_browser)
+        self.browsers: List[Dict[str, Any]] = []
+        self.hooks: Dict[str, List[Callable]] = {}
+        self.condition = None
+        self.started = False
+        self.start_lock = asyncio.Lock()
+        self.pending_launches = 0
+        self.browsers_launched = 0
+        self.pages_served = 0
+        self.browser_launch_ms: List[float] = []
+        self.page_setup_ms: List[float] = []
+
+    def add_hook(self, hook_type: str, hook: Callable):
+        """Register an extra crawl4ai hook; hooks of the same type run in registration order"""
+        self.hooks.setdefault(hook_type, []).append(hook)
+        for entry in self.browsers:
+            self._install_hooks(entry["crawler"])
+
+    async def start(self):
+        async with self.start_lock:
+            if self.started:
+                return
+            logger.info(f"🚀 Starting browser pool with {self.size} browser(s)")
+            self.condition = asyncio.Condition()
+            for _ in range(self.size):
+                self.browsers.append(await self._launch_browser())
+            self.started = True
+            logger.info(f"✅ Browser pool ready")
+
+    async def close(self):
+        if not self.started:
+            return
+        logger.info(f"🔄 Closing browser pool ({len(self.browsers)} browser(s))")
+        for entry in self.browsers:
+            await self._close_browser(entry)
+        self.browsers = []
+        self.started = False
+        logger.info(f"✅ Browser pool closed: {self.get_stats()}")
+
+    async def _launch_browser(self) -> Dict[str, Any]:
+        launch_start = time.perf_counter()
+        crawler = AsyncWebCrawler(config=self.browser_config)
+        self._install_hooks(crawler)
+        await crawler.start()
+        launch_ms = (time.perf_counter() - launch_start) * 1000
+        self.browsers_launched += 1
+        self.browser_launch_ms.append(launch_ms)
+        logger.info(f"🚀 Launched browser #{self.browsers_launched} in {launch_ms:.0f}ms")
+        return {"crawler": crawler, "active": 0, "pages_served": 0, "retiring": False}
+
+    async def _close_browser(self, entry: Dict[str, Any]):
+        try:
+            await entry["crawler"].close()
+        except Exception as e:
+            logger.warning(f"⚠️ Failed to close browser cleanly: {e}")
+
+    def _install_hooks(self, crawler: AsyncWebCrawler):
+        crawler.crawler_strategy.set_hook("on_page_context_created", self._on_page_context_created)
+        for hook_type in self.hooks:
+            if hook_type != "on_page_context_created":
+                crawler.crawler_strategy.set_hook(hook_type, self._make_hook_chain(hook_type))
+
+    def _make_hook_chain(self, hook_type: str) -> Callable:
+        async def run_hooks(*args, **kwargs):
+            for hook in self.hooks.get(hook_type, []):
+                result = hook(*args, **kwargs)
+                if asyncio.iscoroutine(result):
+                    await result
+            return args[0] if args else kwargs.get("page")
+        return run_hooks
+
+    async def _on_page_context_created(self, page, **kwargs):
+        page_ctx = _page_context.get()
+        if page_ctx is not None and page_ctx.get("arun_started") is not None:
+            setup_ms = (time.perf_counter() - page_ctx["arun_started"]) * 1000
+            page_ctx["page_setup_ms"] = setup_ms
+            self.page_setup_ms.append(setup_ms)
+        return await self._make_hook_chain("on_page_context_created")(page, **kwargs)
+
+    async def _acquire(self) -> Dict[str, Any]:
+        async with self.condition:
+            while True:
+                candidates = [b for b in self.browsers if not b["retiring"] and b["active"] < self.pages_per_browser]
+                if candidates:
+                    entry = min(candidates, key=lambda b: b["active"])
+                    entry["active"] += 1
+                    return entry
+                if not self.browsers and self.pending_launches == 0:
+                    raise RuntimeError("Browser pool has no live browsers")
+                await self.condition.wait()
+
+    async def _release(self, entry: Dict[str, Any], broken: bool = False):
+        async with self.condition:
+            entry["active"] -= 1
+            entry["pages_served"] += 1
+            if broken or (self.max_pages_per_browser and entry["pages_served"] >= self.max_pages_per_browser):
+                entry["retiring"] = True
+            replace = entry["retiring"] and entry["active"] == 0 and entry in self.browsers
+            if replace:
+                self.browsers.remove(entry)
+                self.pending_launches += 1
+            self.condition.notify_all()
+        if not replace:
+            return
+        reason = "browser failure" if broken else f"{entry['pages_served']} pages served"
+        logger.info(f"♻️ Recycling browser ({reason})")
+        await self._close_browser(entry)
+        new_entry = None
+        try:
+            new_entry = await self._launch_browser()
+        except Exception as e:
+            logger.error(f"❌ Failed to relaunch browser: {e}")
+        async with self.condition:
+            self.pending_launches -= 1
+            if new_entry:
+                self.browsers.append(new_entry)
+            self.condition.notify_all()
+
+    def _is_browser_failure(self, error: Exception) -> bool:
+        message = str(error).lower()
+        return any(marker in message for marker in self.BROWSER_FAILURE_MARKERS)
+
+    async def arun(self, url: str, config: CrawlerRunConfig):
+        """Render a URL in a fresh page of a pooled browser"""
+        if not self.started:
+            await self.start()
+        entry = await self._acquire()
+        page_ctx = _page_context.get()
+        if page_ctx is None:
+            page_ctx = {"url": url}
+            _page_context.set(page_ctx)
+        page_ctx["arun_started"] = time.perf_counter()
+        broken = False
+        try:
+            result = await entry["crawler"].arun(url=url, config=config)
+            self.pages_served += 1
+            return result
+        except Exception as e:
+            broken = self._is_browser_failure(e)
+            raise
+        finally:
+            await self._release(entry, broken)
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "browsers_launched": self.browsers_launched,
+            "pages_served": self.pages_served,
+            "launches_saved": max(self.pages_served - self.browsers_launched, 0),
+            "avg_browser_launch_ms": round(sum(self.browser_launch_ms) / max(len(self.browser_launch_ms), 1), 1),
+            "avg_page_setup_ms": round(sum(self.page_setup_ms) / max(len(self.page_setup_ms), 1), 1),
+            "max_page_setup_ms": round(max(self.page_setup_ms, default=0.0), 1)
+        }
+
+# Part of the extraction cache key: bump when the extraction prompt or its parsing changes
+EXTRACTION_PROMPT_VERSION = "2"
+
+
+class EnhancedWebCrawler:
+    def __init__(self, model_name: str, output_dir: str, job_id: str = None):
+        logger.info(f"🤖 Initializing EnhancedWebCrawler with model: {model_name}")
+        self.model_name = model_name
+        self.base_output_dir = Path(output_dir)
+        self.job_id = job_id or f"crawl-{int(time.time())}"
+        logger.info(f"📁 Base output directory: {self.base_output_dir}")
+        logger.info(f"🆔 Job ID: {self.job_id}")
+
+        logger.info("🔄 Setting up AWS services")
+        self.aws_service = AWSService()
+        
+        logger.info("🗄️ Setting up database manager")
+        self.db_manager = DatabaseManager()
+
+        logger.info("💰 Configuring pricing tiers for token usage")
+        self.pricing_tiers = {
+            "standard": {
+                "input": float(os.getenv("STANDARD_INPUT_PRICE", "0.075")),
+                "output": float(os.getenv("STANDARD_OUTPUT_PRICE", "0.30")),
+                "threshold": int(os.getenv("STANDARD_THRESHOLD", "128000"))
+            },
+            "large_context": {
+                "input": float(os.getenv("LARGE_CONTEXT_INPUT_PRICE", "0.15")),
+                "output": float(os.getenv("LARGE_CONTEXT_OUTPUT_PRICE", "0.60")),
+                "threshold": float('inf')
+            }
+        }
+        logger.info(f"📊 Pricing tiers configured: Standard threshold={self.pricing_tiers['standard']['threshold']} tokens")
+
+        self.output_dir = None
+        self.markdown_dir = None
+        self.image_dir = None
+        self.csv_dir = None
+        self.json_dir = None
+        self.s3_base_path = None
+
+        llm_mode = get_backend_mode()
+        if llm_mode != "replay":
+            logger.info("🔑 Retrieving Gemini API key")
+            secret_name = os.getenv("GEMINI_SECRET_NAME", "Gemini-API-ChatGPT")
+            secret_region = os.getenv("GEMINI_SECRET_REGION", "us-east-1")
+            key = get_secret(secret_name, secret_region)
+            if not key:
+                logger.info("🔍 API key not found in Secrets Manager, checking environment variables")
+                key = os.getenv("GEMINI_API_KEY")
+                if key:
+                    logger.info("✅ Using Gemini API key from environment variable")
+                else:
+                    logger.error("❌ GEMINI_API_KEY not found in Secrets Manager or environment variables")
+                    raise EnvironmentError("GEMINI_API_KEY not found in Secrets Manager or environment variables")
+            else:
+                logger.info("✅ Using Gemini API key from AWS Secrets Manager")
+
+            logger.info("🔄 Configuring Gemini API")
+            genai.configure(api_key=key)
+        # Replay mode answers from recorded responses, so neither the key nor the model is needed
+        self.llm = create_backend(self.model_name, lambda: genai.GenerativeModel(
+            self.model_name,
+            generation_config=genai.types.GenerationConfig(
+                temperature=float(os.getenv("MODEL_TEMPERATURE", "0.1")),
+                max_output_tokens=int(os.getenv("MAX_OUTPUT_TOKENS", "8192")),
+                response_mime_type="application/json",
+            )
+        ), llm_mode)
+        logger.info(f"✅ Gemini model {self.model_name} initialized successfully ({llm_mode} mode)")
+
+        self.max_concurrent_pages = max(1, int(os.getenv("MAX_CONCURRENT_PAGES", "1")))
+        self.max_concurrent_per_domain = max(1, int(os.getenv("MAX_CONCURRENT_PER_DOMAIN", str(self.max_concurrent_pages))))
+        self.rate_limiter = DomainRateLimiter()
+        self.extraction_workers = max(1, int(os.getenv("EXTRACTION_WORKERS", "2")))
+        self.persist_workers = max(1, int(os.getenv("PERSIST_WORKERS", "2")))
+        self.pipeline_queue_size = max(1, int(os.getenv("PIPELINE_QUEUE_SIZE", "10")))
+        logger.info(f"⚙️ Crawl concurrency: {self.max_concurrent_pages} pages, {self.max_concurrent_per_domain} per domain")
+        logger.info(f"⚙️ Pipeline: {self.extraction_workers} extraction worker(s), {self.persist_workers} persistence worker(s), queue size {self.pipeline_queue_size}")
+
+        logger.info("🌐 Configuring job-scoped browser pool")
+        browser_pool_size = max(1, int(os.getenv("BROWSER_POOL_SIZE", "1")))
+        default_pages_per_browser = -(-self.max_concurrent_pages // browser_pool_size)
+        self.browser_pool = BrowserPool(
+            self.build_browser_config(),
+            size=browser_pool_size,
+            pages_per_browser=int(os.getenv("BROWSER_PAGES_PER_BROWSER", str(default_pages_per_browser))),
+            max_pages_per_browser=int(os.getenv("BROWSER_MAX_PAGES", "100"))
+        )
+        self.conditional_recrawl = os.getenv("CONDITIONAL_RECRAWL", "true").lower() == "true"
+        self.http_client = httpx.AsyncClient(
+            http2=True,
+            follow_redirects=True,
+            timeout=float(os.getenv("HTTP_TIMEOUT_SECONDS", "20")),
+            limits=httpx.Limits(max_connections=int(os.getenv("HTTP_MAX_CONNECTIONS", "20")), max_keepalive_connections=10),
+            headers={
+                "User-Agent": self.browser_pool.browser_config.user_agent,
+                "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8",
+                "Accept-Language": "en-US,en;q=0.9"
+            }
+        )
+        self.excluded_tags = ['script', 'style', 'nav', 'footer', 'header']
+        self.word_count_threshold = int(os.getenv("WORD_COUNT_THRESHOLD", "10"))
+        self.fetch_tier = HttpFetchTier(self.http_client, {}, self.excluded_tags, self.word_count_threshold)
+        self.structured_data = os.getenv("STRUCTURED_DATA_EXTRACTION", "true").lower() == "true"
+        self.structured_extractor = StructuredDataExtractor()
+        self.request_interceptor = RequestInterceptor()
+        self.browser_pool.add_hook("on_page_context_created", self.request_interceptor.install)
+        # Registered before the screenshot hook so "html_ready" excludes the capture time
+        self.stage_timings = StageTimings()
+        self.browser_pool.add_hook("before_goto", StageTimings.page_mark_hook("goto_started"))
+        self.browser_pool.add_hook("after_goto", StageTimings.page_mark_hook("goto_finished"))
+        self.browser_pool.add_hook("before_return_html", StageTimings.page_mark_hook("html_ready"))
+        self.screenshot_policy = ScreenshotPolicy()
+        self.browser_pool.add_hook("after_goto", self.screenshot_policy.record_status_hook)
+        self.browser_pool.add_hook("before_return_html", self.screenshot_policy.capture_hook)
+        self.screenshot_uploader = ScreenshotUploader(
+            self.aws_service,
+            image_format=os.getenv("SCREENSHOT_FORMAT", "jpeg").lower(),
+            workers=int(os.getenv("SCREENSHOT_UPLOAD_WORKERS", "1")),
+            queue_size=int(os.getenv("SCREENSHOT_QUEUE_SIZE", "50"))
+        )
+        self.catalog_ingestion = os.getenv("CATALOG_INGESTION", "false").lower() == "true"
+        self.catalog_stats = {}
+        self.structured_data_stats = {"pages_checked": 0, "pages_with_structured_data": 0, "gemini_skipped": 0, "products": 0, "sources": {}}
+        self.fetch_ledger = {}
+        self.extraction_failures = set()
+        self.fetch_status_counts = {"rendered": 0, "not_modified": 0, "content_unchanged": 0}
+        logger.info(f"⚙️ Conditional re-crawl: {'enabled' if self.conditional_recrawl else 'disabled'}")
+        self.incremental_discovery = os.getenv("INCREMENTAL_DISCOVERY", "false").lower() == "true"
+        self.incremental_max_staleness = timedelta(days=float(os.getenv("INCREMENTAL_MAX_STALENESS_DAYS", "7")))
+        self.sitemap_reader = SitemapReader(
+            self.http_client,
+            max_urls=int(os.getenv("SITEMAP_MAX_URLS", "50000")),
+            max_sitemaps=int(os.getenv("SITEMAP_MAX_SITEMAPS", "50")),
+            concurrency=int(os.getenv("SITEMAP_CONCURRENCY", "4")),
+            buffer_size=int(os.getenv("SITEMAP_BUFFER_SIZE", "1000"))
+        )
+        self.skipped_unchanged_urls = []
+        self.incremental_stats = {}
+        self.discovery_cache = DiscoveryCache(
+            self.http_client,
+            self.aws_service,
+            cache_dir=os.getenv("DISCOVERY_CACHE_DIR", "/tmp/discovery_cache"),
+            s3_prefix=os.getenv("DISCOVERY_CACHE_S3_PREFIX", "crawl-data/discovery-cache"),
+            ttl=timedelta(hours=float(os.getenv("DISCOVERY_CACHE_TTL_HOURS", "24"))),
+            enabled=os.getenv("DISCOVERY_CACHE", "true").lower() == "true",
+            force_refresh=os.getenv("DISCOVERY_CACHE_REFRESH", "false").lower() == "true"
         )
-        logger.info(f"✅ Gemini model {self.model_name} initialized successfully")
+        logger.info(f"⚙️ Incremental discovery: {'enabled' if self.incremental_discovery else 'disabled'}")
+        self.url_canonicalizer = None
+        self.canonicalization_stats = {}
+        self.link_expansion = os.getenv("LINK_EXPANSION", "fallback").lower()
+        self.link_expansion_stats = {}
+        self.url_prioritizer = None
+        self.url_prioritization = os.getenv("URL_PRIORITIZATION", "true").lower() == "true"
+        self.prioritization_stats = {}
+        self.checkpointing = os.getenv("CRAWL_CHECKPOINTS", "true").lower() == "true"
+        self.checkpoints = {}
+        self.resume_stats = {"resumed": False, "urls_skipped": 0, "extractions_reused": 0, "uploads_resumed": 0}
+        self.worker_id = None
+        self.near_duplicate_detection = os.getenv("NEAR_DUPLICATE_DETECTION", "true").lower() == "true"
+        self.near_duplicate_stats = {"pages_fingerprinted": 0, "near_duplicates": 0, "gemini_calls_avoided": 0, "products_inherited": 0, "fallbacks": 0}
+        self.extraction_cache = os.getenv("EXTRACTION_CACHE", "true").lower() == "true"
+        self.extraction_cache_ttl_hours = float(os.getenv("EXTRACTION_CACHE_TTL_HOURS", "720"))
+        self.extraction_cache_max_entries = int(os.getenv("EXTRACTION_CACHE_MAX_ENTRIES", "100000"))
+        logger.info(f"⚙️ Extraction cache: {'enabled' if self.extraction_cache else 'disabled'}")
+        self.markdown_reduction = os.getenv("MARKDOWN_REDUCTION", "true").lower() == "true"
+        self.markdown_reducer = MarkdownReducer(
+            window_before=int(os.getenv("MARKDOWN_WINDOW_BEFORE", "6")),
+            window_after=int(os.getenv("MARKDOWN_WINDOW_AFTER", "4")),
+            min_chars=int(os.getenv("MARKDOWN_REDUCTION_MIN_CHARS", "1500"))
+        )
+        self.markdown_reduction_stats = {"pages": 0, "original_chars": 0, "reduced_chars": 0}
+        logger.info(f"⚙️ Markdown reduction: {'enabled' if self.markdown_reduction else 'disabled'}")
         self.all_products = []
         self.processed_urls = set()
         self.crawl_metrics = []
+        self.crawl_metrics_by_url = {}
+        self.pipeline_stats = {}
         self.discovered_urls_data = []
         self.s3_urls = {}
         self.total_token_usage = TokenUsage(
@@ -683,6 +3548,33 @@ class EnhancedWebCrawler:
         )
         logger.info("✅ EnhancedWebCrawler initialization complete")
 
+    def build_browser_config(self) -> BrowserConfig:
+        """Browser settings shared by every page of the job"""
+        browser_args = [
+            "--no-sandbox",
+            "--disable-dev-shm-usage",
+            "--disable-gpu",
+            "--disable-web-security",
+            "--disable-features=VizDisplayCompositor",
+            "--disable-extensions",
+            "--disable-plugins",
+            # Heavy resources are blocked per request by RequestInterceptor instead of
+            # --disable-images/--disable-javascript, which broke JS-rendered product grids
+        ]
+        return BrowserConfig(
+            browser_type="chromium",
+            headless=True,
+            verbose=False,
+            extra_args=browser_args,
+            user_agent="Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36"
+        )
+
+    def record_crawl_metric(self, crawl_metric: CrawlMetrics):
+        # Shared dict: spans recorded later in the pipeline (Gemini, S3, DB) show up on the metric too
+        crawl_metric.stage_ms = self.stage_timings.for_url(crawl_metric.url)
+        self.crawl_metrics.append(crawl_metric)
+        self.crawl_metrics_by_url[crawl_metric.url] = crawl_metric
+
     def setup_job_in_database(self, url: str, job_id: str = None) -> str:
         """Setup scrape job in database"""
         logger.info("📝 STEP 1: Setting up scrape job in database")
@@ -787,61 +3679,18 @@ class EnhancedWebCrawler:
         discovered_urls = []
         try:
             max_urls = int(os.getenv("MAX_URLS", "100"))
-            logger.info(f"🔧 Configuring URL seeder with max_urls={max_urls}")
-            logger.info("🔄 Trying URL Seeding with sitemap...")
-            async with AsyncUrlSeeder() as seeder:
-                sitemap_config = SeedingConfig(
-                    source="sitemap",
-                    extract_head=True,
-                    live_check=False,
-                    max_urls=max_urls,
-                    verbose=False,
-                    force=True
-                )
-                try:
-                    sitemap_urls = await seeder.urls(domain, sitemap_config)
-                    if sitemap_urls:
-                        logger.info(f"✅ Found {len(sitemap_urls)} URLs via sitemap")
-                        for url_info in sitemap_urls:
-                            discovered_urls.append({
-                                'url': url_info['url'],
-                                'status': url_info.get('status', 'unknown'),
-                                'title': url_info.get('head_data', {}).get('title', ''),
-                                'meta_description': url_info.get('head_data', {}).get('meta', {}).get('description', ''),
-                                'source': 'sitemap'
-                            })
-                    else:
-                        logger.warning("⚠️ No URLs found via sitemap")
-                except Exception as e:
-                    logger.warning(f"⚠️ URL seeding with sitemap failed: {e}")
-
-            if not discovered_urls:
-                logger.info("🔄 Trying Common Crawl as backup...")
-                async with AsyncUrlSeeder() as seeder:
-                    cc_config = SeedingConfig(
-                        source="cc",
-                        extract_head=False,
-                        max_urls=max_urls,
-                        verbose=False
-                    )
-                    try:
-                        cc_urls = await seeder.urls(domain, cc_config)
-                        if cc_urls:
-                            logger.info(f"✅ Found {len(cc_urls)} URLs via Common Crawl")
-                            for url_info in cc_urls:
-                                discovered_urls.append({
-                                    'url': url_info['url'],
-                                    'status': url_info.get('status', 'unknown'),
-                                    'title': '',
-                                    'meta_description': '',
-                                    'source': 'common_crawl'
-                                })
-                        else:
-                            logger.warning("⚠️ No URLs found via Common Crawl")
-                    except Exception as e:
-                        logger.warning(f"⚠️ Common Crawl failed: {e}")
+            # Seed more candidates than the crawl budget so prioritisation can pick the product pages
+            seed_limit = int(os.getenv("DISCOVERY_MAX_URLS", str(max_urls * 5))) if self.url_prioritization else max_urls
+            logger.info(f"🔧 Configuring URL seeder with max_urls={seed_limit} (crawl budget {max_urls})")
+            incremental_urls = None
+            if self.incremental_discovery:
+                incremental_urls = await self.discover_incremental_urls(root_url, domain, seed_limit)
+            if incremental_urls is not None:
+                discovered_urls = incremental_urls
+            else:
+                discovered_urls = await self.seed_urls(root_url, domain, seed_limit)
 
-            if not discovered_urls:
+            if not discovered_urls and incremental_urls is None:
                 logger.info("🔄 Using manual URL discovery as fallback...")
                 common_paths = [
                     "", "/collections/all", "/collections/skincare", "/collections/haircare", "/collections/bundles",
@@ -859,28 +3708,283 @@ class EnhancedWebCrawler:
                     })
                 logger.info(f"✅ Added {len(discovered_urls)} URLs via manual discovery")
 
-            seen_urls = set()
-            unique_urls = []
-            base_domain = domain
-            for url_info in discovered_urls:
-                url = url_info['url']
-                if not url.startswith('http'):
-                    url = f"https://{url}"
-                url_info['url'] = url
-                try:
-                    url_domain = urlparse(url).netloc.replace('www.', '')
-                    if base_domain in url_domain and url not in seen_urls:
-                        seen_urls.add(url)
-                        unique_urls.append(url_info)
-                except Exception:
-                    continue
+            self.url_canonicalizer = UrlCanonicalizer(root_url)
+            unique_urls = self.url_canonicalizer.dedupe(discovered_urls)
+            self.canonicalization_stats = self.url_canonicalizer.stats
+            logger.info(f"🎯 Discovered {len(unique_urls)} URLs from domain {domain} (canonicalisation: {self.canonicalization_stats})")
+            if self.url_prioritization:
+                unique_urls = await self.prioritize_urls(unique_urls, domain, max_urls)
             self.discovered_urls_data = unique_urls
-            logger.info(f"🎯 Discovered {len(unique_urls)} URLs from domain {domain}")
             return unique_urls
         except Exception as e:
             logger.error(f"❌ Error discovering URLs: {str(e)}")
             return []
 
+    async def seed_urls(self, root_url: str, domain: str, seed_limit: int) -> List[Dict[str, Any]]:
+        """Discover URLs from the sitemap, falling back to Common Crawl, through the discovery cache"""
+        cache_config = {"sources": ["sitemap", "cc"], "max_urls": seed_limit, "extract_head": True, "max_sitemaps": self.sitemap_reader.max_sitemaps}
+        cached_urls = await self.discovery_cache.get(root_url, domain, cache_config)
+        if cached_urls is not None:
+            return cached_urls
+        discovered_urls = []
+        logger.info("🔄 Streaming URLs from sitemap...")
+        head_batch_size = int(os.getenv("SITEMAP_HEAD_BATCH_SIZE", "200"))
+        async with AsyncUrlSeeder() as seeder:
+            async def add_batch(batch: List[str]):
+                # Head extraction runs while the sitemap workers keep parsing into their bounded buffer
+                head_by_url = {}
+                try:
+                    heads = await seeder.extract_head_for_urls(batch)
+                    head_by_url = {head['url']: head for head in heads}
+                except Exception as e:
+                    logger.warning(f"⚠️ Head extraction failed for {len(batch)} sitemap URLs: {e}")
+                for url in batch:
+                    head = head_by_url.get(url, {})
+                    discovered_urls.append({
+                        'url': url,
+                        'status': head.get('status', 'unknown'),
+                        'title': (head.get('head_data') or {}).get('title', ''),
+                        'meta_description': (head.get('head_data') or {}).get('meta', {}).get('description', ''),
+                        'canonical': UrlCanonicalizer.canonical_from_head(head.get('head_data')),
+                        'source': 'sitemap'
+                    })
+
+            batch = []
+            async for url, _ in self.sitemap_reader.stream(root_url, max_urls=seed_limit):
+                batch.append(url)
+                if len(batch) >= head_batch_size:
+                    await add_batch(batch)
+                    batch = []
+            if batch:
+                await add_batch(batch)
+        if discovered_urls:
+            logger.info(f"✅ Found {len(discovered_urls)} URLs via sitemap")
+        else:
+            logger.warning("⚠️ No URLs found via sitemap")
+
+        if not discovered_urls:
+            logger.info("🔄 Trying Common Crawl as backup...")
+            async with AsyncUrlSeeder() as seeder:
+                cc_config = SeedingConfig(
+                    source="cc",
+                    extract_head=False,
+                    max_urls=seed_limit,
+                    verbose=False
+                )
+                try:
+                    cc_urls = await seeder.urls(domain, cc_config)
+                    if cc_urls:
+                        logger.info(f"✅ Found {len(cc_urls)} URLs via Common Crawl")
+                        for url_info in cc_urls:
+                            discovered_urls.append({
+                                'url': url_info['url'],
+                                'status': url_info.get('status', 'unknown'),
+                                'title': '',
+                                'meta_description': '',
+                                'source': 'common_crawl'
+                            })
+                    else:
+                        logger.warning("⚠️ No URLs found via Common Crawl")
+                except Exception as e:
+                    logger.warning(f"⚠️ Common Crawl failed: {e}")
+
+        await self.discovery_cache.put(root_url, domain, cache_config, discovered_urls)
+        return discovered_urls
+
+    async def discover_incremental_urls(self, root_url: str, domain: str, max_urls: int) -> Optional[List[Dict[str, Any]]]:
+        """Select sitemap URLs that are new, modified or stale since they were last crawled
+
+        Returns None when the site has no readable sitemap so the caller falls back
+        to full discovery.
+        """
+        domain_state = await asyncio.to_thread(self.db_manager.get_domain_crawl_state, domain)
+        if domain_state:
+            logger.info(f"📅 Last successful job for {domain}: {domain_state['last_success_at']}")
+        now = datetime.now(timezone.utc)
+        stats = {"sitemap_urls": 0, "new": 0, "modified": 0, "stale": 0, "unchanged": 0, "deferred": 0}
+        # Min-heap holding only the max_urls most urgent URLs: new and modified before stale, most recent lastmod first
+        due_heap = []
+
+        def classify(batch: Dict[str, Dict[str, Optional[str]]], url_state: Dict[str, Dict[str, Any]]):
+            offset = stats["sitemap_urls"] - len(batch)
+            for position, (url, entry) in enumerate(batch.items(), offset):
+                state = url_state.get(url)
+                if not domain_state or not state or not state.get('last_crawled_at'):
+                    reason = "new"
+                elif entry.get('lastmod') and entry['lastmod'] != state.get('crawled_lastmod'):
+                    reason = "modified"
+                elif now - state['last_crawled_at'] > self.incremental_max_staleness:
+                    reason = "stale"
+                else:
+                    stats["unchanged"] += 1
+                    self.skipped_unchanged_urls.append(url)
+                    continue
+                stats[reason] += 1
+                item = {'url': url, 'lastmod': entry.get('lastmod'), 'changefreq': entry.get('changefreq'), 'reason': reason}
+                key = (reason != "stale", item['lastmod'] or '', -position)
+                if len(due_heap) < max_urls:
+                    heapq.heappush(due_heap, (key, item))
+                else:
+                    heapq.heappushpop(due_heap, (key, item))
+
+        # Sync and classify in batches so only one batch of sitemap entries is held at a time
+        batch_size = int(os.getenv("SITEMAP_SYNC_BATCH_SIZE", "5000"))
+        batch = {}
+        async for url, entry in self.sitemap_reader.stream(root_url):
+            stats["sitemap_urls"] += 1
+            batch[url] = entry
+            if len(batch) >= batch_size:
+                classify(batch, await asyncio.to_thread(self.db_manager.sync_sitemap_state, domain, batch))
+                batch = {}
+        if batch:
+            classify(batch, await asyncio.to_thread(self.db_manager.sync_sitemap_state, domain, batch))
+        if not stats["sitemap_urls"]:
+            logger.warning("⚠️ No sitemap entries for incremental discovery, falling back to full discovery")
+            return None
+
+        due = [item for _, item in sorted(due_heap, key=lambda pair: pair[0], reverse=True)]
+        stats["deferred"] = stats["new"] + stats["modified"] + stats["stale"] - len(due)
+        self.incremental_stats = stats
+        logger.info(f"📅 Incremental discovery: {stats}")
+
+        head_by_url = {}
+        if due:
+            try:
+                async with AsyncUrlSeeder() as seeder:
+                    heads = await seeder.extract_head_for_urls([item['url'] for item in due])
+                    head_by_url = {head['url']: head for head in heads}
+            except Exception as e:
+                logger.warning(f"⚠️ Head extraction failed for incremental URLs: {e}")
+        discovered_urls = []
+        for item in due:
+            head = head_by_url.get(item['url'], {})
+            discovered_urls.append({
+                'url': item['url'],
+                'status': head.get('status', 'unknown'),
+                'title': (head.get('head_data') or {}).get('title', ''),
+                'meta_description': (head.get('head_data') or {}).get('meta', {}).get('description', ''),
+                'canonical': UrlCanonicalizer.canonical_from_head(head.get('head_data')),
+                'source': 'sitemap_incremental',
+                'lastmod': item['lastmod'],
+                'changefreq': item['changefreq'],
+                'incremental_reason': item['reason']
+            })
+        return discovered_urls
+
+    async def prioritize_urls(self, urls: List[Dict[str, Any]], domain: str, budget: int) -> List[Dict[str, Any]]:
+        """Order discovered URLs by expected product yield and apply the crawl budget"""
+        template_yield = await asyncio.to_thread(self.db_manager.get_template_yield, domain)
+        prioritizer = UrlPrioritizer(
+            template_yield,
+            sample_rate=float(os.getenv("NON_PRODUCT_SAMPLE_RATE", "0.1")),
+            min_history_pages=int(os.getenv("TEMPLATE_YIELD_MIN_PAGES", "3")),
+            product_threshold=float(os.getenv("PRODUCT_SCORE_THRESHOLD", "0.4"))
+        )
+        selected, stats = prioritizer.prioritize(urls, budget)
+        # Over-seeding is paid for in discovery: sitemap URLs had their heads fetched unless the discovery cache hit
+        head_fetched = self.discovery_cache.stats.get("status") != "hit"
+        stats["extra_head_requests"] = sum(1 for url_info in urls[budget:] if head_fetched and url_info.get('source') == 'sitemap')
+        self.url_prioritizer = prioritizer
+        self.prioritization_stats = stats
+        logger.info(f"🎯 Prioritised {stats['candidates']} URLs over {stats['templates']} templates: "
+                    f"crawling {stats['selected']} (baseline {stats['baseline_pages']}, {stats['baseline_pages_replaced']} replaced), "
+                    f"skipped {stats['skipped_by_sampling']} by sampling and {stats['skipped_by_budget']} by budget, "
+                    f"{stats['extra_candidates']} extra candidates seeded ({stats['extra_head_requests']} head requests)")
+        for template, sample in stats['sampled_templates'].items():
+            logger.info(f"🎲 Sampled {sample['sampled']}/{sample['discovered']} URLs of low-yield template {template}")
+        return selected
+
+    def record_template_yield(self, domain: str, crawl_results: List[Dict[str, Any]]):
+        """Store products per page for each template crawled in this job"""
+        template_stats: Dict[str, Dict[str, int]] = {}
+        for result in crawl_results:
+            if not result.get('success'):
+                continue
+            stats = template_stats.setdefault(UrlPrioritizer.template(result['url']), {"pages_crawled": 0, "products_found": 0})
+            stats["pages_crawled"] += 1
+            stats["products_found"] += result.get('products_found', 0)
+        self.db_manager.record_template_yield(domain, template_stats)
+
+    def estimate_extraction_savings(self, pages: int) -> Dict[str, Any]:
+        """Estimate the Gemini input tokens and cost of extracting this many more pages"""
+        extracted_pages = sum(1 for metric in self.crawl_metrics if metric.token_usage)
+        if extracted_pages:
+            tokens_per_page = self.total_token_usage.input_tokens / extracted_pages
+        else:
+            tokens_per_page = int(os.getenv("ESTIMATED_TOKENS_PER_PAGE", "12000"))
+        pricing_info = self.calculate_pricing_tier_and_cost(int(tokens_per_page), 0)
+        return {
+            "estimated_tokens_saved": int(pages * tokens_per_page),
+            "estimated_cost_saved_usd": round(pages * pricing_info["total_cost"], 4)
+        }
+
+    def estimate_prioritization_savings(self) -> Dict[str, Any]:
+        """Estimate the Gemini tokens avoided against the baseline crawl of the first MAX_URLS discovered pages"""
+        return {
+            **self.prioritization_stats,
+            **self.estimate_extraction_savings(self.prioritization_stats.get("pages_skipped", 0))
+        }
+
+    def near_duplicate_summary(self) -> Dict[str, Any]:
+        """Near-duplicate detection counters with the Gemini spend they avoided"""
+        return {
+            "enabled": self.near_duplicate_detection,
+            **self.near_duplicate_stats,
+            **self.estimate_extraction_savings(self.near_duplicate_stats["gemini_calls_avoided"])
+        }
+
+    def structured_data_summary(self) -> Dict[str, Any]:
+        stats = self.structured_data_stats
+        return {
+            **stats,
+            "hit_rate": round(stats["gemini_skipped"] / max(stats["pages_checked"], 1), 3),
+            **self.estimate_extraction_savings(stats["gemini_skipped"])
+        }
+
+    async def ingest_catalog(self, root_url: str) -> Optional[Dict[str, Any]]:
+        """Load the whole catalog from a Shopify/WooCommerce endpoint instead of crawling pages"""
+        started = time.perf_counter()
+        ingester = CatalogIngester(
+            self.http_client,
+            self.rate_limiter,
+            concurrency=int(os.getenv("CATALOG_CONCURRENCY", "4")),
+            max_pages=int(os.getenv("CATALOG_MAX_PAGES", "100"))
+        )
+        try:
+            catalog = await ingester.fetch_catalog(root_url)
+        except Exception as e:
+            logger.warning(f"⚠️ Catalog ingestion failed for {root_url}, falling back to crawling: {e}")
+            catalog = None
+        self.catalog_stats = {
+            "platform": catalog["platform"] if catalog else None,
+            "used": bool(catalog and catalog["products"]),
+            "products": len(catalog["products"]) if catalog else 0,
+            "pages": catalog["pages"] if catalog else 0,
+            "requests": ingester.requests,
+            "duration_ms": round((time.perf_counter() - started) * 1000, 1)
+        }
+        if not self.catalog_stats["used"]:
+            return None
+        self.all_products.extend(catalog["products"])
+        logger.info(f"✅ Catalog ingestion: {self.catalog_stats}")
+        return catalog
+
+    async def carry_forward_unchanged_products(self):
+        """Add the last extracted products of URLs skipped by incremental discovery"""
+        if not self.skipped_unchanged_urls:
+            return
+        if not self.conditional_recrawl:
+            logger.warning(f"⚠️ {len(self.skipped_unchanged_urls)} unchanged URLs skipped but CONDITIONAL_RECRAWL is disabled, their products are not carried forward")
+            return
+        ledger = await asyncio.to_thread(self.db_manager.get_fetch_ledger, self.skipped_unchanged_urls)
+        carried = 0
+        for url in self.skipped_unchanged_urls:
+            products = (ledger.get(url) or {}).get('products') or []
+            self.all_products.extend(products)
+            carried += len(products)
+        self.incremental_stats["carried_forward_products"] = carried
+        logger.info(f"♻️ Carried forward {carried} products from {len(self.skipped_unchanged_urls)} unchanged URLs")
+
     def display_url_tree(self, urls: List[Dict[str, Any]], domain: str):
         if not urls:
             logger.info("⚠️ No URLs to display")
@@ -905,7 +4009,8 @@ class EnhancedWebCrawler:
             if len(source_urls) > 10:
                 logger.info(f" ... and {len(source_urls) - 10} more URLs")
 
-    async def crawl_single_url(self, url: str, domain: str) -> Dict[str, Any]:
+    async def crawl_single_url(self, url: str, domain: str, need_links: bool = False) -> Dict[str, Any]:
+        """Fetch one page; need_links skips the not-modified shortcut because its result has no links"""
         logger.info(f"🕸️ Crawling URL: {url}")
         filename = self.url_to_filename(url, domain)
         crawl_start_time = datetime.now()
@@ -916,48 +4021,57 @@ class EnhancedWebCrawler:
             # Enhanced crawler configuration for better reliability
             config = CrawlerRunConfig(
                 cache_mode=CacheMode.BYPASS,
-                screenshot=True,
-                word_count_threshold=int(os.getenv("WORD_COUNT_THRESHOLD", "10")),
+                screenshot=False,  # captured by ScreenshotPolicy according to SCREENSHOT_MODE
+                word_count_threshold=self.word_count_threshold,
                 only_text=False,
                 process_iframes=True,
-                wait_for_images=True,
+                wait_for_images=False,
                 page_timeout=page_timeout,
                 exclude_external_links=True,
-                excluded_tags=['script', 'style', 'nav', 'footer', 'header'],
+                excluded_tags=self.excluded_tags,
                 remove_overlay_elements=True,
-                # Additional browser args for better stability
-                browser_type="chromium",
-                headless=True,
                 verbose=False
             )
             
+            # Skip rendering entirely when the server confirms the page is unchanged since the last job
+            ledger_entry = self.fetch_ledger.get(url)
+            if ledger_entry and not need_links:
+                with self.stage_timings.span("revalidate", url):
+                    revalidated_status = await self.revalidate_page(url, ledger_entry)
+                if revalidated_status == 304:
+                    return self.reuse_ledger_entry(url, filename, ledger_entry, crawl_start_time)
+
             logger.info(f"🔄 Starting crawler for URL: {url}")
             
-            # Use enhanced browser configuration
-            browser_args = [
-                "--no-sandbox",
-                "--disable-dev-shm-usage",
-                "--disable-gpu",
-                "--disable-web-security",
-                "--disable-features=VizDisplayCompositor",
-                "--disable-extensions",
-                "--disable-plugins",
-                "--disable-images",  # Speed up loading
-                "--disable-javascript",  # For basic content extraction
-                "--user-agent=Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36"
-            ]
-            
-            async with AsyncWebCrawler(
-                verbose=False,
-                browser_type="chromium",
-                headless=True,
-                browser_args=browser_args
-            ) as crawler:
+            page_ctx = {"url": url, "domain": domain}
+            _page_context.set(page_ctx)
+            # Try a plain HTTP fetch first and escalate to the browser only for JS-rendered pages
+            url_domain = self.get_domain_name(url)
+            fetch_tier = self.fetch_tier.choose_tier(url_domain)
+            escalation_reason = None
+            if fetch_tier == "http":
+                with self.stage_timings.span("http_fetch", url):
+                    result, escalation_reason = await self.fetch_tier.fetch(url, url_domain)
+                if escalation_reason and self.fetch_tier.mode != "http":
+                    logger.info(f"⬆️ Escalating {url} to browser ({escalation_reason})")
+                    fetch_tier = "browser"
+            if fetch_tier == "browser":
+                page_ctx["screenshot"] = self.screenshot_policy.should_capture(url)
+                if page_ctx["screenshot"] == "always":
+                    config = config.clone(wait_for_images=True)
+                # Render in a fresh page of the job's pooled browser instead of launching Chromium per URL
                 logger.info(f"⏳ Crawler running on {url} (this may take a while)")
-                result = await crawler.arun(url=url, config=config)
+                result = await self.browser_pool.arun(url, config)
+                self.stage_timings.record_page(url, page_ctx, time.perf_counter())
+            page_setup_ms = page_ctx.get("page_setup_ms")
+            if page_setup_ms is not None:
+                logger.info(f"⏱️ Page setup took {page_setup_ms:.0f}ms on pooled browser")
             
             crawl_end_time = datetime.now()
             crawl_duration = (crawl_end_time - crawl_start_time).total_seconds() * 1000
+            status_code = (getattr(result, 'status_code', None) or 200) if result and result.markdown else getattr(result, 'status_code', None)
+            response_headers = {k.lower(): v for k, v in ((getattr(result, 'response_headers', None) or {}) if result else {}).items()}
+            retry_after = response_headers.get('retry-after')
 
             if not result or not result.markdown:
                 logger.warning(f"⚠️ No content returned from {url}")
@@ -968,41 +4082,50 @@ class EnhancedWebCrawler:
                     crawl_duration_ms=int(crawl_duration),
                     content_length=0,
                     success=False,
-                    error_message="No content returned"
+                    error_message="No content returned",
+                    page_setup_ms=page_setup_ms,
+                    status_code=status_code,
+                    fetch_tier=fetch_tier,
+                    escalation_reason=escalation_reason
                 )
-                self.crawl_metrics.append(crawl_metric)
-                return {'url': url, 'filename': filename, 'success': False, 'content_length': 0}
+                crawl_metric.screenshot_ms = page_ctx.get("screenshot_ms")
+                crawl_metric.blocked_requests = page_ctx.get("blocked_requests")
+                self.record_crawl_metric(crawl_metric)
+                failure_result = {'url': url, 'filename': filename, 'success': False, 'content_length': 0,
+                                  'status_code': status_code, 'retry_after': retry_after, 'crawl_duration_ms': int(crawl_duration),
+                                  'screenshot_file': "", 's3_screenshot_url': ""}
+                if page_ctx.get("screenshot_bytes"):
+                    crawl_metric.screenshot_bytes = len(page_ctx["screenshot_bytes"])
+                    self.screenshot_uploader.submit(failure_result, page_ctx.pop("screenshot_bytes"))
+                return failure_result
+
+            # Fingerprint the rendered markdown so an identical page can reuse the previous extraction
+            content_sha256 = hashlib.sha256(result.markdown.encode('utf-8')).hexdigest()
+            fetch_status = "rendered"
+            if ledger_entry and ledger_entry.get('content_sha256') == content_sha256:
+                fetch_status = "content_unchanged"
+                logger.info(f"♻️ Content unchanged since last job for {url}, reusing {len(ledger_entry.get('products') or [])} products")
+
+            # Zero-token fast path: schema.org data in the raw HTML can replace the Gemini call
+            structured = None
+            if self.structured_data and fetch_status == "rendered":
+                with self.stage_timings.span("structured_data", url):
+                    structured = await asyncio.to_thread(self.structured_extractor.extract, result.html, url, str(result.markdown))
+                self.record_structured_data(url, structured)
 
             # Save and log content
-            markdown_content = f"# Content from {url}\n\n**URL:** [{url}]({url})\n\n---\n\n{result.markdown}"
+            # Page bodies only live on disk from here on; results carry the file path
+            markdown_content = page_markdown_header(url) + result.markdown
             markdown_file = self.markdown_dir / f"{filename}.md"
-            with open(markdown_file, 'w', encoding='utf-8') as f:
+            with self.stage_timings.span("markdown_write", url), open(markdown_file, 'w', encoding='utf-8') as f:
                 f.write(markdown_content)
             logger.info(f"✅ Saved markdown to {markdown_file}")
             logger.info(f"🔎 Markdown _snippet_ for {url}: {markdown_content[:200].replace(chr(10),' ')} ...")
 
-            s3_markdown_key = f"{self.s3_base_path}/markdown/{filename}.md"
-            s3_markdown_url = self.aws_service.upload_string_to_s3(
-                markdown_content, s3_markdown_key, "text/markdown"
-            )
-            screenshot_file = ""
-            s3_screenshot_url = ""
-            if result.screenshot:
-                try:
-                    logger.info(f"📸 Processing screenshot for {url}")
-                    screenshot_file = self.image_dir / f"{filename}.png"
-                    with open(screenshot_file, "wb") as f:
-                        f.write(b64decode(result.screenshot))
-                    logger.info(f"✅ Saved screenshot to {screenshot_file}")
-                    s3_screenshot_key = f"{self.s3_base_path}/images/{filename}.png"
-                    s3_screenshot_url = self.aws_service.upload_to_s3(
-                        str(screenshot_file), s3_screenshot_key, "image/png"
-                    )
-                    logger.info(f"✅ Screenshot saved locally and to S3")
-                except Exception as e:
-                    logger.warning(f"⚠️ Failed to save screenshot: {e}")
-            else:
-                logger.info("ℹ️ No screenshot available for this URL")
+            # Markdown is uploaded by the persistence stage; screenshots go to the background uploader
+            screenshot_bytes = page_ctx.pop("screenshot_bytes", None)
+            if screenshot_bytes:
+                logger.info(f"📸 Captured {len(screenshot_bytes)} byte screenshot in {page_ctx['screenshot_ms']:.0f}ms")
             logger.info(f"✅ Saved: {filename}.md ({len(result.markdown)} chars)")
 
             crawl_metric = CrawlMetrics(
@@ -1011,21 +4134,45 @@ class EnhancedWebCrawler:
                 crawl_end_time=crawl_end_time.isoformat(),
                 crawl_duration_ms=int(crawl_duration),
                 content_length=len(result.markdown),
-                success=True
+                success=True,
+                page_setup_ms=page_setup_ms,
+                status_code=status_code,
+                fetch_status=fetch_status,
+                fetch_tier=fetch_tier,
+                escalation_reason=escalation_reason,
+                extraction_source="ledger" if fetch_status == "content_unchanged" else None,
+                screenshot_ms=page_ctx.get("screenshot_ms"),
+                screenshot_bytes=len(screenshot_bytes) if screenshot_bytes else None,
+                blocked_requests=page_ctx.get("blocked_requests")
             )
-            self.crawl_metrics.append(crawl_metric)
-            return {
+            self.record_crawl_metric(crawl_metric)
+            page_result = {
                 'url': url,
                 'filename': filename,
                 'success': True,
                 'content_length': len(result.markdown),
                 'markdown_file': str(markdown_file),
-                'screenshot_file': str(screenshot_file) if screenshot_file else "",
-                's3_markdown_url': s3_markdown_url,
-                's3_screenshot_url': s3_screenshot_url,
-                'markdown_content': result.markdown,
-                'crawl_duration_ms': int(crawl_duration)
+                'screenshot_file': "",
+                's3_markdown_url': "",
+                's3_screenshot_url': "",
+                'crawl_duration_ms': int(crawl_duration),
+                'status_code': status_code,
+                'retry_after': retry_after,
+                'fetch_status': fetch_status,
+                'fetch_tier': fetch_tier,
+                'content_sha256': content_sha256,
+                'etag': response_headers.get('etag'),
+                'last_modified': response_headers.get('last-modified'),
+                'links': (result.links or {}).get('internal', []) if need_links else []
             }
+            if screenshot_bytes:
+                self.screenshot_uploader.submit(page_result, screenshot_bytes)
+            if fetch_status == "content_unchanged":
+                page_result['ledger_products'] = ledger_entry.get('products') or []
+            elif structured and structured['complete']:
+                crawl_metric.extraction_source = f"structured_data:{structured['source']}"
+                page_result['structured_products'] = structured['products']
+            return page_result
         except Exception as e:
             crawl_end_time = datetime.now()
             crawl_duration = (crawl_end_time - crawl_start_time).total_seconds() * 1000
@@ -1039,8 +4186,415 @@ class EnhancedWebCrawler:
                 success=False,
                 error_message=str(e)
             )
-            self.crawl_metrics.append(crawl_metric)
-            return {'url': url, 'filename': filename, 'success': False, 'error': str(e)}
+            self.record_crawl_metric(crawl_metric)
+            return {'url': url, 'filename': filename, 'success': False, 'error': str(e), 'crawl_duration_ms': int(crawl_duration)}
+
+    def record_structured_data(self, url: str, structured: Dict[str, Any]):
+        """Tally structured-data coverage for the job's token usage report"""
+        stats = self.structured_data_stats
+        stats["pages_checked"] += 1
+        if not structured['products']:
+            return
+        stats["pages_with_structured_data"] += 1
+        stats["sources"][structured['source']] = stats["sources"].get(structured['source'], 0) + 1
+        if structured['complete']:
+            stats["gemini_skipped"] += 1
+            stats["products"] += len(structured['products'])
+            logger.info(f"🧩 {len(structured['products'])} products from {structured['source']} on {url}, skipping Gemini")
+        else:
+            logger.info(f"🧩 Partial {structured['source']} data on {url} ({len(structured['products'])} products), using Gemini")
+
+    async def revalidate_page(self, url: str, ledger_entry: Dict[str, Any]) -> Optional[int]:
+        """Conditional GET with the validators stored by the previous job; returns the status code"""
+        headers = {}
+        if ledger_entry.get('etag'):
+            headers['If-None-Match'] = ledger_entry['etag']
+        if ledger_entry.get('last_modified'):
+            headers['If-Modified-Since'] = ledger_entry['last_modified']
+        if not headers:
+            return None
+        try:
+            # Stream so a changed page's body is never downloaded; the browser renders it next
+            async with self.http_client.stream("GET", url, headers=headers) as response:
+                logger.info(f"🔁 Revalidated {url}: HTTP {response.status_code}")
+                return response.status_code
+        except httpx.HTTPError as e:
+            logger.warning(f"⚠️ Revalidation failed for {url}: {e}")
+            return None
+
+    def reuse_ledger_entry(self, url: str, filename: str, ledger_entry: Dict[str, Any], crawl_start_time: datetime) -> Dict[str, Any]:
+        """Build a crawl result for a page the server reported as not modified"""
+        crawl_end_time = datetime.now()
+        crawl_duration = (crawl_end_time - crawl_start_time).total_seconds() * 1000
+        products = ledger_entry.get('products') or []
+        logger.info(f"♻️ Not modified since last job: {url}, reusing {len(products)} products")
+        crawl_metric = CrawlMetrics(
+            url=url,
+            crawl_start_time=crawl_start_time.isoformat(),
+            crawl_end_time=crawl_end_time.isoformat(),
+            crawl_duration_ms=int(crawl_duration),
+            content_length=0,
+            success=True,
+            status_code=304,
+            fetch_status="not_modified",
+            extraction_source="ledger"
+        )
+        self.record_crawl_metric(crawl_metric)
+        return {
+            'url': url,
+            'filename': filename,
+            'success': True,
+            'content_length': 0,
+            'markdown_file': "",
+            'screenshot_file': "",
+            's3_markdown_url': ledger_entry.get('s3_markdown_url') or "",
+            's3_screenshot_url': "",
+            'crawl_duration_ms': int(crawl_duration),
+            'status_code': 304,
+            'retry_after': None,
+            'fetch_status': "not_modified",
+            'ledger_products': products
+        }
+
+    async def load_resume_state(self) -> Optional[List[Dict[str, Any]]]:
+        """Load the URL list and per-URL checkpoints left by a previous attempt of this job"""
+        metadata = await asyncio.to_thread(self.db_manager.get_job_metadata, self.job_id)
+        resume_state = metadata.get('resume') or {}
+        if 'discovered_urls' not in resume_state:
+            logger.info(f"🔁 No discovery recorded for job {self.job_id}, starting from scratch")
+            return None
+        self.checkpoints = await asyncio.to_thread(self.db_manager.get_checkpoints, self.job_id)
+        self.skipped_unchanged_urls = resume_state.get('skipped_unchanged_urls') or []
+        self.resume_stats["resumed"] = True
+        completed = sum(1 for checkpoint in self.checkpoints.values() if checkpoint['status'] == 'complete')
+        logger.info(f"🔁 Resuming job {self.job_id}: {len(resume_state['discovered_urls'])} URLs, {completed} complete, {len(self.checkpoints) - completed} extracted but not uploaded")
+        return resume_state['discovered_urls']
+
+    async def save_resume_state(self, discovered_urls: List[Dict[str, Any]]):
+        """Store the discovered URLs on the job so a retry crawls the same list in the same order"""
+        if not self.checkpointing:
+            return
+        await asyncio.to_thread(self.db_manager.update_job_metadata, self.job_id, {
+            "resume": {"discovered_urls": discovered_urls, "skipped_unchanged_urls": self.skipped_unchanged_urls}
+        })
+
+    async def save_checkpoint(self, index: int, result: Dict[str, Any], products: List[Dict[str, Any]], status: str):
+        """Record how far a URL got: 'extracted' (products known) or 'complete' (artifacts uploaded)"""
+        if not self.checkpointing or result['url'] in self.extraction_failures:
+            # A failed Gemini call is retried on resume rather than checkpointed as "no products"
+            return
+        await asyncio.to_thread(
+            self.db_manager.save_checkpoint, self.job_id, result['url'], index, status, result, products
+        )
+
+    async def update_fetch_ledger(self, result: Dict[str, Any], products: List[Dict[str, Any]]):
+        """Store the page's validators, fingerprint and products for the next job"""
+        if not self.conditional_recrawl or not result.get('content_sha256'):
+            return
+        if result['url'] in self.extraction_failures:
+            # Keep the previous entry so a failed Gemini call is never replayed as "no products"
+            return
+        await asyncio.to_thread(self.db_manager.upsert_fetch_ledger, self.job_id, {**result, 'products': products})
+
+    async def persist_page_artifacts(self, result: Dict[str, Any]):
+        """Upload a crawled page's markdown to S3"""
+        filename = result['filename']
+        if result.get('markdown_file'):
+            s3_markdown_key = f"{self.s3_base_path}/markdown/{filename}.md"
+            result['s3_markdown_url'] = await asyncio.to_thread(
+                self.aws_service.upload_to_s3, result['markdown_file'], s3_markdown_key, "text/markdown"
+            )
+
+    def build_link_expander(self, discovered_urls: List[Dict[str, Any]]) -> Optional[LinkExpander]:
+        """Link expander for this crawl, or None when LINK_EXPANSION does not apply
+
+        "fallback" (default) expands only when sitemap and Common Crawl discovery
+        found nothing and the crawl started from the manual path list; "always"
+        expands every crawl. Frontier workers never expand: their share of URLs is
+        fixed when the frontier is seeded.
+        """
+        if self.link_expansion not in ("always", "fallback") or self.worker_id or not discovered_urls:
+            return None
+        if self.link_expansion == "fallback" and not any(url_info.get('source') == 'manual_discovery' for url_info in discovered_urls):
+            return None
+        max_urls = int(os.getenv("MAX_URLS", "100"))
+        prioritizer = self.url_prioritizer or UrlPrioritizer(
+            {}, product_threshold=float(os.getenv("PRODUCT_SCORE_THRESHOLD", "0.4"))
+        )
+        expander = LinkExpander(
+            self.url_canonicalizer or UrlCanonicalizer(discovered_urls[0]['url']),
+            prioritizer,
+            [url_info['url'] for url_info in discovered_urls] + self.skipped_unchanged_urls,
+            max_depth=int(os.getenv("LINK_EXPANSION_MAX_DEPTH", "3")),
+            max_pages=int(os.getenv("LINK_EXPANSION_MAX_PAGES", str(max_urls))),
+            max_per_template=int(os.getenv("LINK_EXPANSION_MAX_PER_TEMPLATE", "50"))
+        )
+        logger.info(f"🔗 Link expansion enabled: depth {expander.max_depth}, {expander.max_pages} pages, {expander.max_per_template} per template")
+        return expander
+
+    async def crawl_urls(self, discovered_urls: List[Dict[str, Any]], domain: str, positions: List[int] = None) -> List[Dict[str, Any]]:
+        """Run the crawl -> extract -> persist pipeline, keeping results in discovery order
+
+        Each stage has its own worker pool and the stages are connected by bounded
+        queues, so Gemini calls and S3 uploads overlap with browser rendering and a
+        slow stage applies backpressure to the one before it. positions are the URLs'
+        indexes in the job's full URL list (used for checkpoints) when crawling a
+        leased share of it.
+
+        The crawl queue is ordered by (link depth, rank): discovered URLs keep their
+        prioritised order and, with link expansion, links harvested from crawled
+        pages are appended to discovered_urls and crawled breadth-first, best
+        scoring first.
+        """
+        total = len(discovered_urls)
+        positions = positions or list(range(total))
+        crawl_queue = asyncio.PriorityQueue()
+        extract_queue = asyncio.Queue(maxsize=self.pipeline_queue_size)
+        persist_queue = asyncio.Queue(maxsize=self.pipeline_queue_size)
+        crawl_results: List[Optional[Dict[str, Any]]] = [None] * total
+        products_by_index: List[List[Dict[str, Any]]] = [[] for _ in range(total)]
+        near_duplicates = NearDuplicateIndex(
+            max_distance=int(os.getenv("NEAR_DUPLICATE_MAX_DISTANCE", "2")),
+            min_tokens=int(os.getenv("NEAR_DUPLICATE_MIN_TOKENS", "50")),
+            min_jaccard=float(os.getenv("NEAR_DUPLICATE_MIN_JACCARD", "0.9"))
+        ) if self.near_duplicate_detection else None
+        # Products of each fingerprinted page, resolved when its extraction finishes (None if it failed)
+        extraction_futures: Dict[int, asyncio.Future] = {}
+        inherit_tasks: List[asyncio.Task] = []
+        expander = self.build_link_expander(discovered_urls)
+        for index, url_info in enumerate(discovered_urls):
+            crawl_queue.put_nowait((url_info.get('depth', 0), index, index, url_info))
+        crawl_workers = self.max_concurrent_pages if expander else min(self.max_concurrent_pages, max(total, 1))
+        stages = {
+            "crawl": PipelineStage("crawl", crawl_queue, crawl_workers),
+            "extract": PipelineStage("extract", extract_queue, self.extraction_workers),
+            "persist": PipelineStage("persist", persist_queue, self.persist_workers)
+        }
+        logger.info(f"👷 Crawling {crawl_queue.qsize()} URLs: " + ", ".join(f"{name}={stage.workers} worker(s)" for name, stage in stages.items()))
+        domain_semaphores: Dict[str, asyncio.Semaphore] = {}
+        if self.fetch_tier.mode == "auto":
+            self.fetch_tier.history = await asyncio.to_thread(self.db_manager.get_fetch_tier_history)
+        if self.conditional_recrawl:
+            self.fetch_ledger = await asyncio.to_thread(
+                self.db_manager.get_fetch_ledger, [url_info['url'] for url_info in discovered_urls]
+            )
+
+        async def schedule_links(url_infos: List[Dict[str, Any]]):
+            if self.conditional_recrawl:
+                self.fetch_ledger.update(await asyncio.to_thread(
+                    self.db_manager.get_fetch_ledger, [url_info['url'] for url_info in url_infos]
+                ))
+            for url_info in url_infos:
+                index = len(discovered_urls)
+                discovered_urls.append(url_info)
+                positions.append(index)
+                crawl_results.append(None)
+                products_by_index.append([])
+                crawl_queue.put_nowait((url_info['depth'], -url_info['score'], index, url_info))
+
+        async def crawl_worker():
+            while True:
+                _, _, index, url_info = await crawl_queue.get()
+                url = url_info['url']
+                checkpoint = self.checkpoints.get(url)
+                if checkpoint and checkpoint['status'] == 'complete':
+                    # Finished by a previous attempt of this job: keep its result in place
+                    crawl_results[index] = checkpoint['crawl_result']
+                    products_by_index[index] = checkpoint['products']
+                    self.resume_stats["urls_skipped"] += 1
+                    logger.info(f"⏭️ Skipping {url}, completed before the restart")
+                    try:
+                        if expander:
+                            await schedule_links(expander.restore(checkpoint['crawl_result'].get('expanded_links') or []))
+                    except Exception as e:
+                        logger.error(f"❌ Could not restore links expanded from {url}: {e}")
+                    finally:
+                        # The queue is joined, so a failed restore must not leave this item unfinished
+                        crawl_queue.task_done()
+                    continue
+                stages["crawl"].sample_depth()
+                started = time.perf_counter()
+                success = False
+                depth = url_info.get('depth', 0)
+                try:
+                    if checkpoint and os.path.isfile(checkpoint['crawl_result'].get('markdown_file') or ''):
+                        # Extracted before the restart and the markdown is still on disk: only the upload is left
+                        logger.info(f"\n[{index + 1}/{len(discovered_urls)}] 🔁 Resuming upload for {url}")
+                        result = dict(checkpoint['crawl_result'])
+                        self.resume_stats["uploads_resumed"] += 1
+                    else:
+                        url_domain = self.get_domain_name(url)
+                        if url_domain not in domain_semaphores:
+                            domain_semaphores[url_domain] = asyncio.Semaphore(self.max_concurrent_per_domain)
+                        async with domain_semaphores[url_domain]:
+                            # Be respectful to the server: pace requests with the adaptive per-domain limiter
+                            slot = await self.rate_limiter.acquire(url_domain, url)
+                            self.stage_timings.record("rate_limit_wait", slot["wait_ms"], url)
+                            if slot["wait_ms"] > 0:
+                                logger.info(f"⏱️ Waited {slot['wait_ms']:.0f}ms for a slot on {url_domain} ({slot['rate_rps']} rps)")
+                            logger.info(f"\n[{index + 1}/{len(discovered_urls)}] 🔄 Processing: {url}")
+                            result = await self.crawl_single_url(url, domain, need_links=bool(expander and expander.wants_links(depth)))
+                        decision = self.rate_limiter.record(
+                            url_domain, result.get('status_code'), result.get('crawl_duration_ms', 0), result.get('retry_after')
+                        )
+                        crawl_metric = self.crawl_metrics_by_url.get(url)
+                        if crawl_metric:
+                            crawl_metric.rate_limit = {**slot, "decision": decision.get("action"), "reason": decision.get("reason"), "new_rate_rps": decision.get("rate_rps")}
+                        if result.get('fetch_status'):
+                            self.fetch_status_counts[result['fetch_status']] += 1
+                    crawl_results[index] = result
+                    success = bool(result.get('success'))
+                    stages["crawl"].record((time.perf_counter() - started) * 1000, success)
+                    links = result.pop('links', None)
+                    if expander and success and links and expander.wants_links(depth):
+                        expanded = expander.harvest(url, links, depth)
+                        if expanded:
+                            logger.info(f"🔗 Queued {len(expanded)} new links from {url} at depth {depth + 1}")
+                            # Kept in the checkpoint so a resumed job can rebuild the expanded frontier
+                            result['expanded_links'] = expanded
+                            await schedule_links(expanded)
+                    ledger_products = result.pop('ledger_products', None)
+                    structured_products = result.pop('structured_products', None)
+                    reused_products = ledger_products if ledger_products is not None else structured_products
+                    if checkpoint and success:
+                        # Products extracted before the restart are reused so Gemini is not paid twice
+                        reused_products = checkpoint['products']
+                        self.resume_stats["extractions_reused"] += 1
+                    if reused_products is not None:
+                        # Unchanged page, complete structured data or checkpointed extraction: skip Gemini
+                        products_by_index[index] = reused_products
+                        if result.get('markdown_file'):
+                            await persist_queue.put((index, result))
+                            stages["persist"].sample_depth()
+                        else:
+                            await self.save_checkpoint(positions[index], result, reused_products, 'complete')
+                    elif success and result.get('content_length') and result.get('markdown_file'):
+                        match = None
+                        signature = None
+                        if near_duplicates:
+                            markdown = await asyncio.to_thread(read_page_markdown, result['markdown_file'], url)
+                            signature = await asyncio.to_thread(near_duplicates.signature, markdown)
+                        if signature is not None:
+                            self.near_duplicate_stats["pages_fingerprinted"] += 1
+                            scope = NearDuplicateIndex.scope(url)
+                            match = near_duplicates.find(signature, scope)
+                            if match is None:
+                                near_duplicates.add(signature, scope, index)
+                                extraction_futures[index] = asyncio.get_running_loop().create_future()
+                        if match:
+                            original, distance, similarity = match
+                            logger.info(f"🪞 {url} is a near-duplicate of {crawl_results[original]['url']} ({distance} bits apart, Jaccard {similarity}), skipping Gemini")
+                            inherit_tasks.append(asyncio.create_task(inherit_products(index, result, original)))
+                        else:
+                            await extract_queue.put((index, result))
+                            stages["extract"].sample_depth()
+                    else:
+                        logger.info(f"⚠️ Skipping product extraction for {url} (crawl failed or no content)")
+                except Exception as e:
+                    logger.error(f"❌ Crawl worker failed on {url}: {e}")
+                    crawl_results[index] = {'url': url, 'success': False, 'error': str(e)}
+                    stages["crawl"].record((time.perf_counter() - started) * 1000, False)
+                finally:
+                    crawl_queue.task_done()
+
+        async def inherit_products(index: int, result: Dict[str, Any], original: int):
+            products = await extraction_futures[original]
+            if products is None:
+                # The original page's extraction failed, so this page is extracted on its own
+                self.near_duplicate_stats["fallbacks"] += 1
+                await extract_queue.put((index, result))
+                stages["extract"].sample_depth()
+                return
+            products_by_index[index] = products
+            self.near_duplicate_stats["near_duplicates"] += 1
+            self.near_duplicate_stats["gemini_calls_avoided"] += 1
+            self.near_duplicate_stats["products_inherited"] += len(products)
+            crawl_metric = self.crawl_metrics_by_url.get(result['url'])
+            if crawl_metric:
+                crawl_metric.extraction_source = "near_duplicate"
+                crawl_metric.near_duplicate_of = crawl_results[original]['url']
+            await persist_queue.put((index, result))
+            stages["persist"].sample_depth()
+
+        async def extract_worker():
+            while True:
+                index, result = await extract_queue.get()
+                url = result['url']
+                started = time.perf_counter()
+                products = None
+                try:
+                    logger.info(f"🔍 Extracting products from {url}")
+                    markdown = await asyncio.to_thread(read_page_markdown, result['markdown_file'], url)
+                    products = await self.extract_products_from_content(markdown, url)
+                    products_by_index[index] = products
+                    logger.info(f"✅ Added {len(products)} products from {url}")
+                    stages["extract"].record((time.perf_counter() - started) * 1000)
+                    await self.save_checkpoint(positions[index], result, products, 'extracted')
+                except Exception as e:
+                    logger.error(f"❌ Extraction worker failed on {url}: {e}")
+                    stages["extract"].record((time.perf_counter() - started) * 1000, False)
+                # Not in a finally: on cancellation the persist workers are gone and a full queue would block forever
+                future = extraction_futures.get(index)
+                if future and not future.done():
+                    future.set_result(None if url in self.extraction_failures else products)
+                await persist_queue.put((index, result))
+                stages["persist"].sample_depth()
+                extract_queue.task_done()
+
+        async def persist_worker():
+            while True:
+                index, result = await persist_queue.get()
+                started = time.perf_counter()
+                try:
+                    with self.stage_timings.span("s3_upload", result['url']):
+                        await self.persist_page_artifacts(result)
+                    with self.stage_timings.span("db_write", result['url']):
+                        await self.update_fetch_ledger(result, products_by_index[index])
+                        await self.save_checkpoint(positions[index], result, products_by_index[index], 'complete')
+                    stages["persist"].record((time.perf_counter() - started) * 1000)
+                except Exception as e:
+                    logger.error(f"❌ Persistence worker failed on {result['url']}: {e}")
+                    stages["persist"].record((time.perf_counter() - started) * 1000, False)
+                finally:
+                    persist_queue.task_done()
+
+        async def monitor():
+            interval = float(os.getenv("PIPELINE_LOG_INTERVAL", "30"))
+            while True:
+                await asyncio.sleep(interval)
+                logger.info("📈 Pipeline: " + " | ".join(
+                    f"{name} depth={stage.queue.qsize()} done={stage.processed}" for name, stage in stages.items()
+                ))
+
+        workers = [asyncio.create_task(crawl_worker()) for _ in range(stages["crawl"].workers)]
+        workers += [asyncio.create_task(extract_worker()) for _ in range(self.extraction_workers)]
+        workers += [asyncio.create_task(persist_worker()) for _ in range(self.persist_workers)]
+        workers.append(asyncio.create_task(monitor()))
+        try:
+            for name, queue in (("crawl", crawl_queue), ("extract", extract_queue), ("persist", persist_queue)):
+                await queue.join()
+                if name == "crawl":
+                    # Near-duplicates wait on their originals' extraction and may fall back into the extract queue
+                    await asyncio.gather(*inherit_tasks)
+                stages[name].finished_at = time.perf_counter()
+        finally:
+            for task in workers + inherit_tasks:
+                task.cancel()
+            await asyncio.gather(*workers, *inherit_tasks, return_exceptions=True)
+
+        self.pipeline_stats = {name: stage.snapshot() for name, stage in stages.items()}
+        for name, stats in self.pipeline_stats.items():
+            logger.info(f"📈 Stage {name}: {stats}")
+        for index, products in enumerate(products_by_index):
+            self.all_products.extend(products)
+            if crawl_results[index] is not None:
+                crawl_results[index]['products_found'] = len(products)
+        if expander:
+            self.link_expansion_stats = expander.stats
+            logger.info(f"🔗 Link expansion: {expander.stats}")
+        discovery_order = {url_info['url']: i for i, url_info in enumerate(discovered_urls)}
+        self.crawl_metrics.sort(key=lambda metric: discovery_order.get(metric.url, len(discovered_urls)))
+        return crawl_results
 
     async def extract_products_from_content(self, content: str, url: str) -> List[Dict[str, Any]]:
         logger.info(f"🔍 Preparing for extraction on {url}, content length: {len(content) if content else 0}")
@@ -1051,6 +4605,21 @@ class EnhancedWebCrawler:
 
         logger.info(f"🔹 Markdown sample for {url}: {content[:300].replace(chr(10),' ')} ...")
 
+        if self.markdown_reduction:
+            with self.stage_timings.span("markdown_reduction", url):
+                content = self.reduce_markdown(content, url)
+
+        cache_entry = None
+        if self.extraction_cache:
+            with self.stage_timings.span("extraction_cache", url):
+                cache_entry = self.extraction_cache_entry(content)
+                cached = await asyncio.to_thread(
+                    self.db_manager.get_extraction_cache, cache_entry['cache_key'], self.extraction_cache_ttl_hours
+                )
+            if cached is not None:
+                return self.use_cached_extraction(cached, url)
+            self.total_token_usage.cache_misses += 1
+
         try:
             prompt = f"""Extract ALL products found in this e-commerce page content.
 - Products may be in <li>, <div>, <section>, or any type of card, block, tile, grid, or repeated element.
@@ -1070,29 +4639,15 @@ For every product, return ONLY a JSON array, with each object having:
 }}
 
 If no products found, return `[]`. Begin response with `[` and end with `]` JSON only.
+Navigation, footer and text far from prices may have been removed from the content; a line with only `...` marks a gap.
 
 CONTENT:
 {content[:50000]}
 """
-            response = await self.model.generate_content_async(prompt)
-            logger.info(f"✅ Received response from Gemini API")
-
-            # --- TOKEN USAGE EXTRACTION: FIX THIS BLOCK ---
-            input_tokens = output_tokens = 0
-            try:
-                # Most recent google-generativeai SDK:
-                # usage_metadata: prompt_token_count and candidates_token_count
-                if hasattr(response, "usage_metadata"):
-                    input_tokens = getattr(response.usage_metadata, "prompt_token_count", 0)
-                    output_tokens = getattr(response.usage_metadata, "candidates_token_count", 0)
-                # Some SDKs: candidates[0].usage
-                elif hasattr(response, "candidates") and hasattr(response.candidates[0], "usage"):
-                    usage = response.candidates[0].usage
-                    input_tokens = getattr(usage, "input_tokens", 0)
-                    output_tokens = getattr(usage, "output_tokens", 0)
-            except Exception as e:
-                logger.warning(f"⚠️ Could not extract token usage for {url}: {str(e)}")
-
+            with self.stage_timings.span("gemini", url):
+                response = await self.llm.generate_async(prompt)
+            logger.info(f"✅ Received response from Gemini API ({response.source}, {response.latency_ms}ms)")
+            input_tokens, output_tokens = response.input_tokens, response.output_tokens
             logger.info(f"💰 RAW token usage: input_tokens={input_tokens}, output_tokens={output_tokens}")
 
             pricing_info = self.calculate_pricing_tier_and_cost(input_tokens, output_tokens)
@@ -1104,8 +4659,10 @@ CONTENT:
                 timestamp=datetime.now().isoformat(),
                 pricing_tier=pricing_info["tier"]
             )
-            if self.crawl_metrics:
-                self.crawl_metrics[-1].token_usage = token_usage
+            crawl_metric = self.crawl_metrics_by_url.get(url)
+            if crawl_metric:
+                crawl_metric.token_usage = token_usage
+                crawl_metric.extraction_source = "gemini"
             self.total_token_usage.input_tokens += input_tokens
             self.total_token_usage.output_tokens += output_tokens
             self.total_token_usage.total_cost += pricing_info["total_cost"]
@@ -1125,16 +4682,85 @@ CONTENT:
                 products = json.loads(response_text)
                 if not isinstance(products, list):
                     products = []
+                if cache_entry:
+                    await asyncio.to_thread(self.db_manager.put_extraction_cache, {
+                        **cache_entry,
+                        "products": products,
+                        "input_tokens": input_tokens,
+                        "output_tokens": output_tokens,
+                        "cost_usd": pricing_info["total_cost"]
+                    })
             except Exception as e:
+                self.extraction_failures.add(url)
                 logger.warning(f"⚠️ Failed to parse Gemini response as JSON (error: {e}). First 200 chars: {response_text[:200]}")
             logger.info(f"✅ Extracted {len(products)} products from {url}")
             logger.info(f"💰 Token usage: {input_tokens} input, {output_tokens} output, ${pricing_info['total_cost']:.4f}")
             return products
 
         except Exception as e:
+            self.extraction_failures.add(url)
             logger.error(f"❌ Gemini extraction failed for {url}: {str(e)}")
             return []
 
+    def reduce_markdown(self, content: str, url: str) -> str:
+        """Reduced markdown for the prompt, with the reduction ratio recorded on the page's metric"""
+        reduced, stats = self.markdown_reducer.reduce(content)
+        ratio = round(1 - stats["reduced_chars"] / stats["original_chars"], 3) if stats["original_chars"] else 0.0
+        self.markdown_reduction_stats["pages"] += 1
+        self.markdown_reduction_stats["original_chars"] += stats["original_chars"]
+        self.markdown_reduction_stats["reduced_chars"] += stats["reduced_chars"]
+        crawl_metric = self.crawl_metrics_by_url.get(url)
+        if crawl_metric:
+            crawl_metric.markdown_chars = stats["original_chars"]
+            crawl_metric.reduced_markdown_chars = stats["reduced_chars"]
+            crawl_metric.markdown_reduction_ratio = ratio
+        logger.info(f"✂️ Reduced markdown for {url}: {stats['original_chars']} -> {stats['reduced_chars']} chars ({ratio:.1%} removed)")
+        return reduced
+
+    def markdown_reduction_summary(self) -> Dict[str, Any]:
+        original = self.markdown_reduction_stats["original_chars"]
+        reduced = self.markdown_reduction_stats["reduced_chars"]
+        return {
+            "enabled": self.markdown_reduction,
+            **self.markdown_reduction_stats,
+            "reduction_ratio": round(1 - reduced / original, 3) if original else 0.0
+        }
+
+    def extraction_cache_entry(self, content: str) -> Dict[str, str]:
+        """Cache key fields for the content Gemini would see, with whitespace runs collapsed"""
+        cleaned = re.sub(r'\s+', ' ', content[:50000]).strip()
+        content_sha256 = hashlib.sha256(cleaned.encode('utf-8')).hexdigest()
+        cache_key = hashlib.sha256(f"{EXTRACTION_PROMPT_VERSION}|{self.model_name}|{content_sha256}".encode('utf-8')).hexdigest()
+        return {
+            "cache_key": cache_key,
+            "content_sha256": content_sha256,
+            "prompt_version": EXTRACTION_PROMPT_VERSION,
+            "model_name": self.model_name
+        }
+
+    def use_cached_extraction(self, cached: Dict[str, Any], url: str) -> List[Dict[str, Any]]:
+        """Products of a cache hit, re-attributed to this URL, with the avoided cost at current prices"""
+        saved = self.calculate_pricing_tier_and_cost(cached['input_tokens'] or 0, cached['output_tokens'] or 0)["total_cost"]
+        self.total_token_usage.cache_hits += 1
+        self.total_token_usage.cost_saved += saved
+        crawl_metric = self.crawl_metrics_by_url.get(url)
+        if crawl_metric:
+            crawl_metric.extraction_source = "cache"
+        products = [{**product, "source_url": url} for product in cached['products'] or [] if isinstance(product, dict)]
+        logger.info(f"♻️ Extraction cache hit for {url}: {len(products)} products, ${saved:.4f} saved")
+        return products
+
+    def extraction_cache_summary(self) -> Dict[str, Any]:
+        lookups = self.total_token_usage.cache_hits + self.total_token_usage.cache_misses
+        return {
+            "enabled": self.extraction_cache,
+            "prompt_version": EXTRACTION_PROMPT_VERSION,
+            "hits": self.total_token_usage.cache_hits,
+            "misses": self.total_token_usage.cache_misses,
+            "hit_rate": round(self.total_token_usage.cache_hits / lookups, 3) if lookups else 0.0,
+            "cost_saved_usd": round(self.total_token_usage.cost_saved, 4)
+        }
+
     def deduplicate_products(self, products: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
         if not products:
             logger.info("ℹ️ No products to deduplicate")
@@ -1186,9 +4812,9 @@ CONTENT:
                 json.dump(output_data, f, indent=2, ensure_ascii=False)
             logger.info(f"✅ Saved JSON locally")
             
-            # Upload to S3
+            # Upload the file just written rather than serialising everything again in memory
             s3_key = f"{self.s3_base_path}/products.json"
-            s3_url = self.aws_service.upload_json_to_s3(output_data, s3_key)
+            s3_url = self.aws_service.upload_to_s3(str(json_file), s3_key, "application/json")
             if s3_url:
                 self.s3_urls['products_json'] = s3_url
                 logger.info(f"✅ Uploaded JSON to S3: {s3_url}")
@@ -1243,8 +4869,283 @@ CONTENT:
             logger.error(f"❌ Failed to log orchestration event: {e}")
             return False
 
-    async def run(self, root_url: str, job_id: str = None) -> Dict[str, Any]:
-        """Main execution pipeline with RDS integration"""
+    def export_stage_metrics(self, domain: str) -> Dict[str, Any]:
+        """Write the job's stage percentiles as EMF JSON lines and a Prometheus text file, locally and to S3"""
+        summary = self.stage_timings.summary()
+        if not summary:
+            return {}
+        suffix = f"_{self.worker_id}" if self.worker_id else ""
+        properties = {"JobId": self.job_id, **({"WorkerId": self.worker_id} if self.worker_id else {})}
+        labels = {"job_id": self.job_id, "domain": domain, **({"worker_id": self.worker_id} if self.worker_id else {})}
+        emf_lines = self.stage_timings.emf_lines(os.getenv("METRICS_NAMESPACE", "Bodhium/WebScraper"), {"Domain": domain}, properties)
+        try:
+            emf_file = self.output_dir / f"stage_metrics{suffix}.emf.jsonl"
+            with open(emf_file, 'w', encoding='utf-8') as f:
+                f.write("\n".join(emf_lines) + "\n")
+            prom_file = Path(os.getenv("METRICS_PROM_FILE") or self.output_dir / f"stage_metrics{suffix}.prom")
+            prom_file.parent.mkdir(parents=True, exist_ok=True)
+            # Written atomically so a node_exporter textfile collector never reads a partial file
+            tmp_file = prom_file.with_name(prom_file.name + ".tmp")
+            tmp_file.write_text(self.stage_timings.prometheus_text(labels), encoding='utf-8')
+            os.replace(tmp_file, prom_file)
+            if os.getenv("METRICS_EMF_LOG", "true").lower() == "true":
+                for line in emf_lines:
+                    emf_logger.info(line)
+            for local_file, content_type in ((emf_file, "application/x-ndjson"), (prom_file, "text/plain")):
+                url = self.aws_service.upload_to_s3(str(local_file), f"{self.s3_base_path}/metrics/{local_file.name}", content_type)
+                if url:
+                    self.s3_urls[f"metrics_{local_file.suffix.lstrip('.')}"] = url
+        except Exception as e:
+            logger.error(f"❌ Error exporting stage metrics: {e}")
+        slowest = self.stage_timings.slowest_stage(summary)
+        logger.info(f"⏱️ Stage timings: " + " | ".join(
+            f"{stage} p50={stats['p50_ms']} p95={stats['p95_ms']} p99={stats['p99_ms']}ms (n={stats['count']})" for stage, stats in summary.items()
+        ))
+        return {"slowest_stage": slowest, "stages": summary}
+
+    def frontier_lock_name(self, purpose: str) -> str:
+        """Advisory lock name for one frontier step of this job"""
+        return f"crawlfrontier:{purpose}:{self.db_manager.normalize_job_id(self.job_id)}"
+
+    async def seed_frontier(self, root_url: str) -> Dict[str, Any]:
+        """Discover the job's URLs into the frontier once; workers that start later wait on the lock and reuse it"""
+        lock_name = self.frontier_lock_name("seed")
+        lock_conn = await asyncio.to_thread(self.db_manager.acquire_advisory_lock, lock_name)
+        if lock_conn is None:
+            raise RuntimeError(f"Could not lock the frontier of job {self.job_id} for seeding")
+        try:
+            metadata = await asyncio.to_thread(self.db_manager.get_job_metadata, self.job_id)
+            if metadata.get('frontier'):
+                logger.info(f"🧭 Frontier of job {self.job_id} already seeded with {metadata['frontier'].get('urls', 0)} URLs")
+                return metadata['frontier']
+            logger.info(f"🧭 Worker {self.worker_id} is seeding the frontier of job {self.job_id}")
+            await asyncio.to_thread(self.update_job_status, "JOB_RUNNING")
+            frontier = {"seeded_by": self.worker_id, "seeded_at": datetime.now().isoformat(), "urls": 0}
+            catalog = await self.ingest_catalog(root_url) if self.catalog_ingestion else None
+            if catalog:
+                # The whole catalog is a single unit of work that is already done
+                await asyncio.to_thread(
+                    self.db_manager.save_checkpoint, self.job_id, root_url, 0, 'complete',
+                    {'url': root_url, 'success': True, 'catalog_platform': catalog['platform']}, catalog['products']
+                )
+                frontier["catalog"] = self.catalog_stats
+            else:
+                with self.stage_timings.span("discovery"):
+                    discovered_urls = await self.discover_all_urls(root_url)
+                await self.save_resume_state(discovered_urls)
+                frontier["urls"] = await asyncio.to_thread(self.db_manager.seed_frontier, self.job_id, discovered_urls)
+            await asyncio.to_thread(self.db_manager.update_job_metadata, self.job_id, {"frontier": frontier})
+            return frontier
+        finally:
+            await asyncio.to_thread(self.db_manager.release_advisory_lock, lock_conn, lock_name)
+
+    async def heartbeat_leases(self, urls: List[str], lease_seconds: int):
+        """Keep this worker's leases alive while their batch is being crawled"""
+        while True:
+            await asyncio.sleep(lease_seconds / 3)
+            held = await asyncio.to_thread(self.db_manager.heartbeat_frontier, self.job_id, self.worker_id, urls, lease_seconds)
+            logger.info(f"💓 Extended {held}/{len(urls)} frontier leases")
+
+    async def crawl_frontier(self, domain: str) -> Dict[str, int]:
+        """Lease batches of frontier URLs and crawl them until no pending or leased URL is left"""
+        batch_size = max(1, int(os.getenv("FRONTIER_BATCH_SIZE", str(self.max_concurrent_pages * 2))))
+        lease_seconds = max(30, int(os.getenv("FRONTIER_LEASE_SECONDS", "300")))
+        max_attempts = max(1, int(os.getenv("FRONTIER_MAX_ATTEMPTS", "3")))
+        poll_seconds = float(os.getenv("FRONTIER_POLL_SECONDS", "10"))
+        stats = {"batches": 0, "leased": 0, "done": 0, "failed": 0}
+        while True:
+            leased = await asyncio.to_thread(
+                self.db_manager.lease_frontier, self.job_id, self.worker_id, batch_size, lease_seconds, max_attempts
+            )
+            if not leased:
+                progress = await asyncio.to_thread(self.db_manager.get_frontier_progress, self.job_id)
+                if not progress.get('pending') and not progress.get('leased'):
+                    logger.info(f"🧭 Frontier drained: {progress}")
+                    return stats
+                # Other workers still hold leases; if one dies its URLs expire back into the frontier
+                logger.info(f"⏳ Frontier {progress}, waiting {poll_seconds}s on leases held by other workers")
+                await asyncio.sleep(poll_seconds)
+                continue
+            stats["batches"] += 1
+            stats["leased"] += len(leased)
+            urls = [row['url'] for row in leased]
+            logger.info(f"🧭 Worker {self.worker_id} leased {len(leased)} URLs (positions {leased[0]['url_index']}-{leased[-1]['url_index']})")
+            # A URL re-leased after its worker died may already be extracted or complete
+            self.checkpoints = await asyncio.to_thread(self.db_manager.get_checkpoints, self.job_id, urls)
+            heartbeat = asyncio.create_task(self.heartbeat_leases(urls, lease_seconds))
+            try:
+                results = await self.crawl_urls(
+                    [row['url_info'] for row in leased], domain, [row['url_index'] for row in leased]
+                )
+            finally:
+                heartbeat.cancel()
+                await asyncio.gather(heartbeat, return_exceptions=True)
+            outcomes = [(row['url'], 'done' if result and result.get('success') else 'failed') for row, result in zip(leased, results)]
+            await asyncio.to_thread(self.db_manager.complete_frontier, self.job_id, self.worker_id, outcomes)
+            for _, status in outcomes:
+                stats[status] += 1
+
+    async def reduce_frontier(self, domain: str) -> Optional[Dict[str, Any]]:
+        """Merge every worker's checkpointed products, then deduplicate and ingest them once per job"""
+        lock_name = self.frontier_lock_name("reduce")
+        lock_conn = await asyncio.to_thread(self.db_manager.acquire_advisory_lock, lock_name, False)
+        if lock_conn is None:
+            logger.info(f"🔒 Another worker is reducing job {self.job_id}")
+            return None
+        try:
+            metadata = await asyncio.to_thread(self.db_manager.get_job_metadata, self.job_id)
+            frontier = metadata.get('frontier') or {}
+            if frontier.get('reduced_at'):
+                logger.info(f"✅ Job {self.job_id} was already reduced by {frontier.get('reduced_by')}")
+                return None
+            progress = await asyncio.to_thread(self.db_manager.get_frontier_progress, self.job_id)
+            if progress.get('pending') or progress.get('leased'):
+                logger.info(f"⏳ Frontier not drained yet ({progress}), leaving the reduce to the last worker")
+                return None
+            logger.info(f"🧮 Worker {self.worker_id} is reducing job {self.job_id}")
+            checkpoints = await asyncio.to_thread(self.db_manager.get_checkpoints, self.job_id)
+            completed = sorted(
+                (checkpoint for checkpoint in checkpoints.values() if checkpoint['status'] == 'complete'),
+                key=lambda checkpoint: checkpoint['url_index']
+            )
+            # Same order as a single-process run: discovery order, then carried-forward products
+            self.all_products = [product for checkpoint in completed for product in checkpoint['products']]
+            resume_state = metadata.get('resume') or {}
+            self.skipped_unchanged_urls = resume_state.get('skipped_unchanged_urls') or []
+            await self.carry_forward_unchanged_products()
+            unique_products = self.deduplicate_products(self.all_products)
+            self.save_products_json(unique_products)
+            with self.stage_timings.span("db_ingestion"):
+                db_stats = await asyncio.to_thread(self.db_manager.ingest_products, self.job_id, unique_products)
+            logger.info(f"✅ Database ingestion completed: {db_stats}")
+            await asyncio.to_thread(self.update_job_status, "JOB_SUCCESS")
+            crawl_results = [
+                {**checkpoint['crawl_result'], 'products_found': len(checkpoint['products'])}
+                for checkpoint in completed if not checkpoint['crawl_result'].get('catalog_platform')
+            ]
+            if self.incremental_discovery:
+                crawled = {r['url'] for r in crawl_results if r.get('success')}
+                await asyncio.to_thread(self.db_manager.mark_urls_crawled, self.job_id, [
+                    (url_info.get('original_url', url_info['url']), url_info.get('lastmod'))
+                    for url_info in resume_state.get('discovered_urls') or [] if url_info['url'] in crawled
+                ])
+                await asyncio.to_thread(self.db_manager.update_domain_crawl_state, domain, self.job_id)
+            if self.url_prioritization:
+                await asyncio.to_thread(self.record_template_yield, domain, crawl_results)
+            reduced = {
+                "reduced_by": self.worker_id,
+                "reduced_at": datetime.now().isoformat(),
+                "urls_complete": len(completed),
+                "urls_failed": progress.get('failed', 0),
+                "total_products_found": len(self.all_products),
+                "unique_products": len(unique_products),
+                "database_stats": db_stats
+            }
+            await asyncio.to_thread(self.db_manager.update_job_metadata, self.job_id, {"frontier": {**frontier, **reduced}})
+            return reduced
+        finally:
+            await asyncio.to_thread(self.db_manager.release_advisory_lock, lock_conn, lock_name)
+
+    async def run_worker(self, root_url: str, job_id: str, worker_id: str) -> Dict[str, Any]:
+        """Crawl one job cooperatively with other workers through the Postgres frontier
+
+        The first worker discovers URLs into the frontier while the others wait on its
+        lock. Every worker then leases batches until the frontier is drained, and the
+        first worker to find it drained runs deduplication and ingestion.
+        """
+        logger.info(f"🚀 STARTING FRONTIER WORKER {worker_id} FOR: {root_url}")
+        overall_start = time.time()
+        self.worker_id = worker_id
+        if not self.checkpointing:
+            logger.warning("⚠️ Worker mode needs checkpoints to hand products to the reducer, enabling CRAWL_CHECKPOINTS")
+            self.checkpointing = True
+        try:
+            normalized_job_id = await asyncio.to_thread(self.setup_job_in_database, root_url, job_id)
+            domain = self.get_domain_name(root_url)
+            self.setup_domain_directories(domain)
+            frontier = await self.seed_frontier(root_url)
+            if self.fetch_tier.mode == "browser":
+                await self.browser_pool.start()
+            self.screenshot_uploader.start(self.image_dir, self.s3_base_path)
+            frontier_stats = await self.crawl_frontier(domain)
+            await self.screenshot_uploader.drain()
+            await self.browser_pool.close()
+            fetch_tier_stats = self.fetch_tier.get_stats()
+            for tier_domain, tier_stats in fetch_tier_stats["domains"].items():
+                if tier_stats["http_attempts"]:
+                    await asyncio.to_thread(self.db_manager.record_fetch_tier, tier_domain, tier_stats["http_attempts"], tier_stats["escalations"])
+            reduced = await self.reduce_frontier(domain)
+            if reduced and self.extraction_cache:
+                await asyncio.to_thread(self.db_manager.evict_extraction_cache, self.extraction_cache_ttl_hours, self.extraction_cache_max_entries)
+            stage_metrics = self.export_stage_metrics(domain)
+            result = {
+                "root_url": root_url,
+                "domain": domain,
+                "job_id": self.job_id,
+                "normalized_job_id": normalized_job_id,
+                "worker_id": worker_id,
+                "reducer": bool(reduced),
+                "discovered_urls": frontier.get("urls", 0),
+                "successful_crawls": frontier_stats["done"],
+                "failed_crawls": frontier_stats["failed"],
+                "total_products_found": reduced["total_products_found"] if reduced else len(self.all_products),
+                "unique_products": reduced["unique_products"] if reduced else 0,
+                "processing_time_seconds": round(time.time() - overall_start, 3),
+                "timestamp": time.strftime("%Y-%m-%d %H:%M:%S"),
+                "status": "success",
+                "s3_base_path": self.s3_base_path,
+                "s3_urls": self.s3_urls,
+                "database_stats": reduced["database_stats"] if reduced else {},
+                "frontier": frontier_stats,
+                "browser_pool": self.browser_pool.get_stats(),
+                "pipeline_stats": self.pipeline_stats,
+                "stage_timings": stage_metrics,
+                "fetch_tier": fetch_tier_stats,
+                "resume": self.resume_stats,
+                "near_duplicates": self.near_duplicate_summary(),
+                "token_usage": {
+                    "total_input_tokens": self.total_token_usage.input_tokens,
+                    "total_output_tokens": self.total_token_usage.output_tokens,
+                    "total_cost_usd": round(self.total_token_usage.total_cost, 4),
+                    "model_name": self.model_name,
+                    "extraction_cache": self.extraction_cache_summary(),
+                    "markdown_reduction": self.markdown_reduction_summary()
+                }
+            }
+            logger.info(f"✅ Worker {worker_id} done: {frontier_stats}, reducer: {bool(reduced)}, slowest stage: {stage_metrics.get('slowest_stage')}")
+            self.log_orchestration_event("WorkerCompleted", result)
+            return result
+        except Exception as e:
+            # The job is not failed here: this worker's leases expire and the other workers pick them up
+            logger.error(f"❌ Worker {worker_id} failed: {str(e)}")
+            self.log_orchestration_event("WorkerFailed", {
+                "root_url": root_url,
+                "worker_id": worker_id,
+                "error": str(e),
+                "processing_time_seconds": round(time.time() - overall_start, 3)
+            })
+            return {
+                "root_url": root_url,
+                "domain": self.get_domain_name(root_url),
+                "job_id": self.job_id,
+                "worker_id": worker_id,
+                "error": str(e),
+                "status": "failed",
+                "timestamp": time.strftime("%Y-%m-%d %H:%M:%S")
+            }
+        finally:
+            await self.screenshot_uploader.drain()
+            await self.browser_pool.close()
+            await self.http_client.aclose()
+            logger.info("🔄 Cleaning up database connections")
+            self.db_manager.close()
+
+    async def run(self, root_url: str, job_id: str = None, resume: bool = False) -> Dict[str, Any]:
+        """Main execution pipeline with RDS integration
+
+        With resume=True the URL list and per-URL checkpoints of a previous attempt
+        of the same job are reused, so only unfinished pages are crawled again.
+        """
         logger.info(f"🚀 STARTING CRAWL PIPELINE FOR: {root_url}")
         overall_start = time.time()
         
@@ -1278,50 +5179,59 @@ CONTENT:
                 "s3_base_path": self.s3_base_path
             })
             
-            # Step 2: Discover URLs
-            logger.info(f"🔍 STEP 2: Discovering URLs from {root_url}")
-            discovered_urls = await self.discover_all_urls(root_url)
+            resumed_urls = None
+            if resume:
+                logger.info(f"🔁 Resume requested, loading checkpoints of job {self.job_id}")
+                resumed_urls = await self.load_resume_state()
             
-            if not discovered_urls:
-                error_msg = "No URLs could be discovered"
-                logger.error(f"❌ {error_msg}")
-                self.update_job_status("JOB_FAILED", error_msg)
-                return {
-                    "root_url": root_url,
-                    "domain": domain,
-                    "error": error_msg,
-                    "status": "failed",
-                    "timestamp": time.strftime("%Y-%m-%d %H:%M:%S")
-                }
+            # Step 2: Bulk catalog ingestion for Shopify/WooCommerce storefronts
+            catalog = None
+            if self.catalog_ingestion and resumed_urls is None:
+                logger.info(f"🛒 STEP 2: Checking {root_url} for a native catalog endpoint")
+                catalog = await self.ingest_catalog(root_url)
+            if catalog:
+                logger.info(f"⏭️ Catalog endpoint returned {len(catalog['products'])} products, skipping discovery and crawl")
+                discovered_urls, crawl_results = [], []
+            else:
+                if resumed_urls is not None:
+                    logger.info(f"⏭️ STEP 2b: Reusing {len(resumed_urls)} URLs discovered by the previous attempt")
+                    discovered_urls = resumed_urls
+                    self.url_canonicalizer = UrlCanonicalizer(root_url)
+                else:
+                    # Step 2b: Discover URLs
+                    logger.info(f"🔍 STEP 2b: Discovering URLs from {root_url}")
+                    with self.stage_timings.span("discovery"):
+                        discovered_urls = await self.discover_all_urls(root_url)
+                    await self.save_resume_state(discovered_urls)
             
-            # Step 3: Display URL tree
-            logger.info(f"📊 STEP 3: Displaying URL tree")
-            self.display_url_tree(discovered_urls, domain)
+                if not discovered_urls and not self.skipped_unchanged_urls:
+                    error_msg = "No URLs could be discovered"
+                    logger.error(f"❌ {error_msg}")
+                    self.update_job_status("JOB_FAILED", error_msg)
+                    return {
+                        "root_url": root_url,
+                        "domain": domain,
+                        "error": error_msg,
+                        "status": "failed",
+                        "timestamp": time.strftime("%Y-%m-%d %H:%M:%S")
+                    }
             
-            # Step 4: Crawl URLs
-            logger.info(f"\n🕸️ STEP 4: Starting to crawl {len(discovered_urls)} URLs...")
+                # Step 3: Display URL tree
+                logger.info(f"📊 STEP 3: Displaying URL tree")
+                self.display_url_tree(discovered_urls, domain)
             
-            crawl_results = []
-            for i, url_info in enumerate(discovered_urls, 1):
-                url = url_info['url']
-                logger.info(f"\n[{i}/{len(discovered_urls)}] 🔄 Processing: {url}")
-                
-                result = await self.crawl_single_url(url, domain)
-                crawl_results.append(result)
-                
-                # Extract products if crawl was successful
-                if result.get('success') and result.get('markdown_content'):
-                    logger.info(f"🔍 Extracting products from {url}")
-                    products = await self.extract_products_from_content(
-                        result['markdown_content'], url
-                    )
-                    self.all_products.extend(products)
-                    logger.info(f"✅ Added {len(products)} products from {url}")
-                else:
-                    logger.info(f"⚠️ Skipping product extraction for {url} (crawl failed or no content)")
-                
-                logger.info(f"⏱️ Waiting 1 second before next URL...")
-                await asyncio.sleep(1)  # Be respectful to the server
+                # Step 4: Crawl URLs
+                logger.info(f"\n🕸️ STEP 4: Starting to crawl {len(discovered_urls)} URLs...")
+            
+                if self.fetch_tier.mode == "browser":
+                    await self.browser_pool.start()
+                # Otherwise the pool launches on the first page that escalates to the browser
+                self.screenshot_uploader.start(self.image_dir, self.s3_base_path)
+                crawl_results = await self.crawl_urls(discovered_urls, domain)
+                await self.screenshot_uploader.drain()
+            await self.browser_pool.close()
+            browser_pool_stats = self.browser_pool.get_stats()
+            await self.carry_forward_unchanged_products()
             
             # Step 5: Process products
             logger.info(f"\n🔄 STEP 5: Processing {len(self.all_products)} total products...")
@@ -1333,13 +5243,31 @@ CONTENT:
             
             # Step 7: Ingest products into database
             logger.info(f"\n🗄️ STEP 7: Ingesting products into database")
-            db_stats = self.db_manager.ingest_products(self.job_id, unique_products)
+            with self.stage_timings.span("db_ingestion"):
+                db_stats = self.db_manager.ingest_products(self.job_id, unique_products)
             logger.info(f"✅ Database ingestion completed: {db_stats}")
             
             # Update job status to success
             self.update_job_status("JOB_SUCCESS")
+            if self.extraction_cache:
+                self.db_manager.evict_extraction_cache(self.extraction_cache_ttl_hours, self.extraction_cache_max_entries)
+            if self.incremental_discovery:
+                crawled = {r['url'] for r in crawl_results if r.get('success')}
+                # Sitemap state is keyed by the URL as listed, before canonicalisation
+                self.db_manager.mark_urls_crawled(self.job_id, [
+                    (url_info.get('original_url', url_info['url']), url_info.get('lastmod'))
+                    for url_info in discovered_urls if url_info['url'] in crawled
+                ])
+                self.db_manager.update_domain_crawl_state(domain, self.job_id)
+            if self.url_prioritization:
+                self.record_template_yield(domain, crawl_results)
+            fetch_tier_stats = self.fetch_tier.get_stats()
+            for tier_domain, tier_stats in fetch_tier_stats["domains"].items():
+                if tier_stats["http_attempts"]:
+                    self.db_manager.record_fetch_tier(tier_domain, tier_stats["http_attempts"], tier_stats["escalations"])
             
             # Prepare final result
+            stage_metrics = self.export_stage_metrics(domain)
             total_time = round(time.time() - overall_start, 3)
             successful_crawls = sum(1 for r in crawl_results if r.get('success'))
             
@@ -1360,12 +5288,37 @@ CONTENT:
                 "s3_urls": self.s3_urls,
                 "local_output_directory": str(self.output_dir),
                 "database_stats": db_stats,
+                "browser_pool": browser_pool_stats,
+                "pipeline_stats": self.pipeline_stats,
+                "stage_timings": stage_metrics,
+                "rate_limiter": self.rate_limiter.get_stats(),
+                "fetch_tier": fetch_tier_stats,
+                "catalog_ingestion": self.catalog_stats,
+                "screenshots": {**self.screenshot_policy.get_stats(), **self.screenshot_uploader.get_stats()},
+                "request_blocking": self.request_interceptor.get_stats(),
+                "incremental_discovery": self.incremental_stats,
+                "url_prioritization": self.estimate_prioritization_savings() if self.url_prioritization else {},
+                "resume": self.resume_stats,
+                "near_duplicates": self.near_duplicate_summary(),
+                "discovery_cache": self.discovery_cache.stats,
+                "url_canonicalization": self.canonicalization_stats,
+                "link_expansion": self.link_expansion_stats,
+                "conditional_recrawl": {
+                    "enabled": self.conditional_recrawl,
+                    **self.fetch_status_counts,
+                    "renders_skipped": self.fetch_status_counts["not_modified"],
+                    "gemini_calls_skipped": self.fetch_status_counts["not_modified"] + self.fetch_status_counts["content_unchanged"]
+                },
                 "token_usage": {
                     "total_input_tokens": self.total_token_usage.input_tokens,
                     "total_output_tokens": self.total_token_usage.output_tokens,
                     "total_cost_usd": round(self.total_token_usage.total_cost, 4),
                     "model_name": self.model_name,
-                    "average_cost_per_url": round(self.total_token_usage.total_cost / max(successful_crawls, 1), 4)
+                    "average_cost_per_url": round(self.total_token_usage.total_cost / max(successful_crawls, 1), 4),
+                    "structured_data": self.structured_data_summary(),
+                    "extraction_cache": self.extraction_cache_summary(),
+                    "markdown_reduction": self.markdown_reduction_summary(),
+                    "llm_backend": self.llm.stats
                 }
             }
             
@@ -1381,6 +5334,7 @@ CONTENT:
                 "unique_products": len(unique_products),
                 "processing_time_seconds": total_time,
                 "token_cost_usd": round(self.total_token_usage.total_cost, 4),
+                "token_cost_saved_by_cache_usd": round(self.total_token_usage.cost_saved, 4),
                 "s3_base_path": self.s3_base_path,
                 "database_stats": db_stats
             })
@@ -1400,8 +5354,32 @@ CONTENT:
             logger.info(f"Total products found: {len(self.all_products)}")
             logger.info(f"Unique products: {len(unique_products)}")
             logger.info(f"Database ingestion: {db_stats}")
+            logger.info(f"Served over plain HTTP: {sum(d['http_served'] for d in fetch_tier_stats['domains'].values())}, escalated to browser: {sum(d['escalations'] for d in fetch_tier_stats['domains'].values())}")
+            logger.info(f"Browser launches: {browser_pool_stats['browsers_launched']} (saved {browser_pool_stats['launches_saved']}), avg page setup: {browser_pool_stats['avg_page_setup_ms']}ms")
+            if self.url_prioritization:
+                logger.info(f"Pages skipped by prioritisation: {result['url_prioritization']['pages_skipped']} of {result['url_prioritization']['baseline_pages']} (~{result['url_prioritization']['estimated_tokens_saved']} tokens saved), "
+                            f"{result['url_prioritization']['baseline_pages_replaced']} replaced by higher-yield pages, {result['url_prioritization']['extra_head_requests']} extra head requests in discovery")
+            logger.info(f"Unchanged pages reused: {self.fetch_status_counts['not_modified']} not modified, {self.fetch_status_counts['content_unchanged']} identical content")
+            if self.discovery_cache.stats:
+                logger.info(f"Discovery cache: {self.discovery_cache.stats['status']}")
+            if self.canonicalization_stats:
+                logger.info(f"URL aliases collapsed: {self.canonicalization_stats['collapsed']} ({self.canonicalization_stats['collapsed_by_canonical_tag']} via canonical tags), off-site URLs dropped: {self.canonicalization_stats['off_site']}")
+            if self.link_expansion_stats:
+                logger.info(f"Pages added by link expansion: {self.link_expansion_stats['queued']} (max depth {self.link_expansion_stats['max_depth_reached']})")
+            if self.near_duplicate_detection:
+                logger.info(f"Near-duplicate pages: {self.near_duplicate_stats['near_duplicates']} inherited products, {self.near_duplicate_stats['gemini_calls_avoided']} Gemini calls avoided (~${result['near_duplicates']['estimated_cost_saved_usd']})")
+            if self.resume_stats["resumed"]:
+                logger.info(f"Resumed from checkpoints: {self.resume_stats['urls_skipped']} URLs skipped, {self.resume_stats['extractions_reused']} extractions reused, {self.resume_stats['uploads_resumed']} uploads resumed")
             logger.info(f"Total time: {total_time}s")
+            if stage_metrics:
+                slowest = stage_metrics['stages'][stage_metrics['slowest_stage']]
+                logger.info(f"Slowest stage: {stage_metrics['slowest_stage']} ({round(slowest['total_ms'] / 1000, 1)}s total over {slowest['count']} spans, p50 {slowest['p50_ms']}ms, p95 {slowest['p95_ms']}ms, p99 {slowest['p99_ms']}ms)")
             logger.info(f"Total token cost: ${self.total_token_usage.total_cost:.4f}")
+            if self.extraction_cache:
+                logger.info(f"Extraction cache: {self.total_token_usage.cache_hits} hits, {self.total_token_usage.cache_misses} misses, ${self.total_token_usage.cost_saved:.4f} saved")
+            if self.markdown_reduction:
+                logger.info(f"Markdown reduction: {result['token_usage']['markdown_reduction']['reduction_ratio']:.1%} of {self.markdown_reduction_stats['original_chars']} chars removed across {self.markdown_reduction_stats['pages']} pages")
+            logger.info(f"Structured data: Gemini skipped on {self.structured_data_stats['gemini_skipped']}/{self.structured_data_stats['pages_checked']} pages")
             logger.info(f"Local backup: {self.output_dir}")
             logger.info(f"S3 location: {self.s3_base_path}")
             logger.info(f"DynamoDB logged: Yes")
@@ -1434,7 +5412,10 @@ CONTENT:
             return error_result
         
         finally:
-            # Clean up database connections
+            # Clean up browsers, HTTP client and database connections
+            await self.screenshot_uploader.drain()
+            await self.browser_pool.close()
+            await self.http_client.aclose()
             logger.info("🔄 Cleaning up database connections")
             self.db_manager.close()
 
@@ -1446,6 +5427,18 @@ async def main():
     parser.add_argument('--job-id', type=str, help='Job ID for tracking')
     parser.add_argument('--output-dir', type=str, default=os.getenv('OUTPUT_DIR', '/tmp/crawl_output'), 
                         help='Output directory for local files')
+    parser.add_argument('--resume', action='store_true',
+                        help='Resume a previous attempt of the same job from its checkpoints')
+    parser.add_argument('--worker', action='store_true',
+                        help='Crawl the job cooperatively with other workers through the Postgres frontier')
+    parser.add_argument('--refresh-discovery', action='store_true',
+                        help='Ignore cached URL discovery for the domain and rediscover it')
+    # AWS Batch retries of the same job resume automatically
+    resume = os.getenv("RESUME", "false").lower() == "true" or int(os.getenv("AWS_BATCH_JOB_ATTEMPT", "1")) > 1
+    # Children of an AWS Batch array job are frontier workers
+    array_index = os.getenv("AWS_BATCH_JOB_ARRAY_INDEX")
+    worker_mode = os.getenv("CRAWL_WORKER", "false").lower() == "true" or array_index is not None
+    refresh_discovery = False
     
     # Check if we're being invoked by Lambda (API Gateway)
     event_data = {}
@@ -1473,7 +5466,10 @@ async def main():
                 url = args.url
                 job_id = args.job_id
                 output_dir = args.output_dir
-                logger.info(f"📋 Parsed arguments - URL: {url}, Job ID: {job_id}, Output dir: {output_dir}")
+                resume = resume or args.resume
+                worker_mode = worker_mode or args.worker
+                refresh_discovery = args.refresh_discovery
+                logger.info(f"📋 Parsed arguments - URL: {url}, Job ID: {job_id}, Output dir: {output_dir}, Resume: {resume}")
             except SystemExit:
                 # If argument parsing fails, use default values
                 logger.warning("⚠️ Argument parsing failed, using default values")
@@ -1532,6 +5528,16 @@ async def main():
         # Get output directory from event or use default
         output_dir = event_data.get('output_dir', os.getenv('OUTPUT_DIR', '/tmp/crawl_output'))
         logger.info(f"📁 Output directory: {output_dir}")
+        resume = resume or str(event_data.get('resume', '')).lower() == "true"
+        worker_mode = worker_mode or str(event_data.get('worker', '')).lower() == "true"
+        refresh_discovery = str(event_data.get('refresh_discovery', '')).lower() == "true"
+    
+    # Workers must share one job id: prefer the Batch job id over a generated one
+    if worker_mode and not job_id:
+        job_id = os.getenv("AWS_BATCH_JOB_ID")
+    # Array children get AWS_BATCH_JOB_ID "<parent>:<index>"; all of them work on the parent's job
+    if array_index is not None and job_id and job_id.endswith(f":{array_index}"):
+        job_id = job_id.rsplit(":", 1)[0]
     
     # Generate job_id if not provided
     if not job_id:
@@ -1539,7 +5545,7 @@ async def main():
         logger.info(f"🆔 Generated job ID: {job_id}")
     
     # Debug logging
-    logger.info(f"📋 Final parameters - URL: {url}, Job ID: {job_id}, Output dir: {output_dir}")
+    logger.info(f"📋 Final parameters - URL: {url}, Job ID: {job_id}, Output dir: {output_dir}, Resume: {resume}, Worker: {worker_mode}")
     
     if not url:
         logger.error("❌ No URL provided. Exiting.")
@@ -1562,10 +5568,17 @@ async def main():
             output_dir=output_dir,
             job_id=job_id
         )
+        if refresh_discovery:
+            crawler.discovery_cache.force_refresh = True
         
         # Run the full pipeline
-        logger.info(f"🚀 Running crawler pipeline")
-        result = await crawler.run(url, job_id)
+        if worker_mode:
+            worker_id = os.getenv("WORKER_ID") or f"{socket.gethostname()}-{os.getpid()}-{array_index or 0}"
+            logger.info(f"🚀 Running crawler as frontier worker {worker_id}")
+            result = await crawler.run_worker(url, job_id, worker_id)
+        else:
+            logger.info(f"🚀 Running crawler pipeline")
+            result = await crawler.run(url, job_id, resume=resume)
         
         # Output final status for batch job
         if result["status"] == "success":
@@ -0,0 +1,651 @@
+"""End-to-end benchmark of the crawl pipeline against a local fixture storefront
+
+Serves a generated shop (robots.txt, a sitemap index with a gzipped child,
+paginated collections, product pages with and without JSON-LD) on localhost and
+runs EnhancedWebCrawler.run() against it once per concurrency setting. S3 and
+DynamoDB are replaced by a local directory and an in-memory table, Secrets
+Manager is bypassed and Gemini is replaced by a fake model that answers with the
+fixture products named in the prompt after a configurable latency. Postgres is
+real: point the DB_* variables at a local instance.
+
+With --llm record/replay the crawler's own LLM backend is used instead of the
+fake (see llm_backend.py), so recorded Gemini responses can be replayed with
+their real latency. Prompts contain page URLs, so pass the same --port to the
+recording and the replay runs.
+
+    docker run -d --name bench-postgres -e POSTGRES_PASSWORD=postgres -p 5432:5432 postgres:16
+    export DB_HOST=localhost DB_NAME=postgres DB_USER=postgres DB_PASSWORD=postgres
+    python benchmark.py --concurrency 1,4,8 --products 300 --report benchmark_report.json
+"""
+import argparse
+import asyncio
+import gzip
+import hashlib
+import io
+import json
+import logging
+import os
+import platform
+import random
+import re
+import shutil
+import subprocess
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from html import escape
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from types import SimpleNamespace
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import parse_qs, urlsplit
+
+from botocore.exceptions import ClientError
+
+import app
+from llm_backend import LiveBackend
+
+logger = logging.getLogger("benchmark")
+
+
+class FixtureShop:
+    """Deterministic storefront content: products, paginated collections, static pages and sitemaps"""
+
+    CATEGORIES = ["skincare", "haircare", "body", "fragrance", "gifts", "bakery"]
+    ADJECTIVES = ["Aurora", "Velvet", "Citrus", "Midnight", "Coastal", "Golden", "Herbal", "Lunar", "Saffron", "Willow"]
+    NOUNS = {
+        "skincare": ["Hydrating Serum", "Night Cream", "Clay Mask", "Toner"],
+        "haircare": ["Repair Shampoo", "Leave-In Conditioner", "Scalp Oil", "Hair Mask"],
+        "body": ["Body Lotion", "Sugar Scrub", "Shower Gel", "Hand Cream"],
+        "fragrance": ["Eau de Parfum", "Body Mist", "Solid Perfume", "Scented Candle"],
+        "gifts": ["Discovery Set", "Travel Kit", "Gift Box", "Ritual Bundle"],
+        # Names containing words that also mark cookie banners, login links and legal text
+        "bakery": ["Chocolate Chip Cookie", "Cookie Gift Tin", "Powered By Oats Bar", "Sign In Guest Cake"],
+    }
+    # The bakery uses a second theme: title and price on their own lines, euro prices written "4,00 €"
+    EURO_CATEGORIES = {"bakery"}
+    PAGES = ["about", "shipping-policy", "returns", "contact", "faq"]
+
+    def __init__(self, products: int = 200, page_size: int = 24, jsonld_ratio: float = 0.7, seed: int = 7):
+        rng = random.Random(seed)
+        self.page_size = max(1, page_size)
+        self.updated = datetime(2024, 1, 1)
+        width = len(str(products))
+        self.products = []
+        for i in range(products):
+            category = self.CATEGORIES[i % len(self.CATEGORIES)]
+            name = f"{rng.choice(self.ADJECTIVES)} {rng.choice(self.NOUNS[category])} {i + 1:0{width}d}"
+            price = round(rng.uniform(8, 120), 2)
+            self.products.append({
+                "slug": re.sub(r'[^a-z0-9]+', '-', name.lower()).strip('-'),
+                "name": name,
+                "category": category,
+                "price": price,
+                "currency": "EUR" if category in self.EURO_CATEGORIES else "USD",
+                "compare_at": round(price * 1.25, 2) if rng.random() < 0.3 else None,
+                "rating": round(rng.uniform(3.5, 5.0), 1),
+                "reviews": rng.randint(0, 900),
+                "description": f"{name} is made in small batches with cold-pressed botanicals and no synthetic fragrance.",
+                "json_ld": rng.random() < jsonld_ratio,
+                # Related products put extra prices on the page, so structured data alone is not trusted there
+                "related": rng.random() < 0.3,
+                "lastmod": (self.updated + timedelta(days=i % 90)).strftime("%Y-%m-%d"),
+            })
+        self.by_slug = {product["slug"]: product for product in self.products}
+
+    def collection(self, category: str) -> List[Dict[str, Any]]:
+        return self.products if category == "all" else [p for p in self.products if p["category"] == category]
+
+    def url_count(self) -> int:
+        """Pages listed in the sitemaps: home, collections, static pages and products"""
+        return 1 + len(self.CATEGORIES) + 1 + len(self.PAGES) + len(self.products)
+
+    def _layout(self, base_url: str, title: str, body: str, head: str = "") -> str:
+        nav = "".join(f'<li><a href="{base_url}/collections/{c}">{c.title()}</a></li>' for c in ["all"] + self.CATEGORIES)
+        footer = "".join(f'<li><a href="{base_url}/pages/{p}">{p.replace("-", " ").title()}</a></li>' for p in self.PAGES)
+        return f"""<!DOCTYPE html>
+<html lang="en"><head><meta charset="utf-8"><title>{escape(title)} | Fixture Botanics</title>
+<meta name="viewport" content="width=device-width, initial-scale=1">{head}</head>
+<body>
+<div class="announcement-bar">Free shipping on orders over $50. Use code WELCOME10 for 10% off your first order.</div>
+<header class="site-header"><a href="{base_url}/" class="logo">Fixture Botanics</a>
+<nav class="main-nav"><ul>{nav}</ul></nav>
+<form action="{base_url}/search" class="search"><input type="search" name="q" placeholder="Search our store"></form></header>
+<main id="MainContent">{body}</main>
+<footer class="site-footer">
+<div class="newsletter"><h2>Join our newsletter</h2><p>Be the first to hear about new launches, seasonal rituals and members-only offers. Unsubscribe at any time.</p></div>
+<ul class="footer-links">{footer}</ul>
+<p>Fixture Botanics is a demonstration storefront used to benchmark the crawler. All products are fictional.</p>
+<p>&copy; 2024 Fixture Botanics. All rights reserved.</p></footer>
+<div class="cookie-banner">We use cookies to improve your experience, analyse traffic and personalise content. By continuing to browse you agree to our use of cookies.</div>
+</body></html>"""
+
+    def _money(self, value: float, currency: str = "USD") -> str:
+        return f"{value:.2f} €".replace(".", ",") if currency == "EUR" else f"${value:.2f}"
+
+    def _card(self, base_url: str, product: Dict[str, Any]) -> str:
+        compare = f' <s class="compare-at">{self._money(product["compare_at"], product["currency"])}</s>' if product["compare_at"] else ""
+        if product["category"] in self.EURO_CATEGORIES:
+            url = f'{base_url}/products/{product["slug"]}'
+            return (f'<div class="grid-item"><a href="{url}"><img src="{base_url}/images/{product["slug"]}.jpg" alt="{escape(product["name"])}"></a>'
+                    f'<h3><a href="{url}">{escape(product["name"])}</a></h3>'
+                    f'<p>Baked fresh every morning in our kitchen from organic flour and butter.</p>'
+                    f'<div class="price">{self._money(product["price"], product["currency"])}{compare}</div></div>')
+        return (f'<div class="product-card"><a href="{base_url}/products/{product["slug"]}">'
+                f'<img src="{base_url}/images/{product["slug"]}.jpg" alt="{escape(product["name"])}">'
+                f'<h3 class="product-card__title">{escape(product["name"])}</h3></a>'
+                f'<span class="price">{self._money(product["price"])}</span>{compare}'
+                f'<span class="rating">{product["rating"]} stars ({product["reviews"]} reviews)</span></div>')
+
+    def home(self, base_url: str) -> str:
+        cards = "".join(self._card(base_url, p) for p in self.products[:8])
+        collections = "".join(f'<li><a href="{base_url}/collections/{c}">Shop {c.title()}</a></li>' for c in self.CATEGORIES)
+        body = f'<h1>Botanical care for every day</h1><ul class="collections">{collections}</ul><h2>Bestsellers</h2><div class="product-grid">{cards}</div>'
+        return self._layout(base_url, "Home", body)
+
+    def collection_page(self, base_url: str, category: str, page: int) -> Optional[str]:
+        products = self.collection(category)
+        pages = max(1, -(-len(products) // self.page_size))
+        if not products or page < 1 or page > pages:
+            return None
+        cards = "".join(self._card(base_url, p) for p in products[(page - 1) * self.page_size:page * self.page_size])
+        current = ' aria-current="page"'
+        pagination = "".join(
+            f'<a href="{base_url}/collections/{category}?page={n}"{current if n == page else ""}>{n}</a>'
+            for n in range(1, pages + 1)
+        )
+        if page < pages:
+            pagination += f'<a rel="next" href="{base_url}/collections/{category}?page={page + 1}">Next</a>'
+        body = (f'<h1>{category.title()}</h1><p>{len(products)} products</p>'
+                f'<div class="product-grid">{cards}</div><nav class="pagination">{pagination}</nav>')
+        return self._layout(base_url, category.title(), body)
+
+    def product_page(self, base_url: str, slug: str) -> Optional[str]:
+        product = self.by_slug.get(slug)
+        if not product:
+            return None
+        url = f"{base_url}/products/{slug}"
+        head = ""
+        if product["json_ld"]:
+            offers = {"@type": "Offer", "price": f"{product['price']:.2f}", "priceCurrency": product["currency"],
+                      "availability": "https://schema.org/InStock", "url": url}
+            if product["compare_at"]:
+                offers["priceSpecification"] = {"@type": "UnitPriceSpecification", "priceType": "https://schema.org/StrikethroughPrice",
+                                                "price": f"{product['compare_at']:.2f}", "priceCurrency": product["currency"]}
+            json_ld = {
+                "@context": "https://schema.org", "@type": "Product", "name": product["name"],
+                "description": product["description"], "image": f"{base_url}/images/{slug}.jpg", "sku": slug.upper(),
+                "offers": offers,
+                "aggregateRating": {"@type": "AggregateRating", "ratingValue": product["rating"], "reviewCount": product["reviews"]},
+            }
+            head = f'<script type="application/ld+json">{json.dumps(json_ld)}</script>'
+        compare = f' <s class="compare-at">{self._money(product["compare_at"], product["currency"])}</s>' if product["compare_at"] else ""
+        related = ""
+        if product["related"]:
+            others = [p for p in self.collection(product["category"]) if p["slug"] != slug][:4]
+            related = '<h2>You may also like</h2><div class="product-grid">' + "".join(self._card(base_url, p) for p in others) + '</div>'
+        body = (f'<div class="product"><img src="{base_url}/images/{slug}.jpg" alt="{escape(product["name"])}">'
+                f'<h1>{escape(product["name"])}</h1><span class="price">{self._money(product["price"], product["currency"])}</span>{compare}'
+                f'<p class="rating">{product["rating"]} out of 5 from {product["reviews"]} reviews</p>'
+                f'<p>{escape(product["description"])}</p>'
+                f'<h2>How to use</h2><p>Apply a small amount morning and evening. Patch test before first use and store away from direct sunlight.</p>'
+                f'<h2>Ingredients</h2><p>Aqua, glycerin, squalane, niacinamide, sodium hyaluronate, tocopherol, rosemary leaf extract.</p>'
+                f'<button>Add to cart</button></div>{related}')
+        return self._layout(base_url, product["name"], body, head)
+
+    def static_page(self, base_url: str, page: str) -> Optional[str]:
+        if page not in self.PAGES:
+            return None
+        title = page.replace("-", " ").title()
+        paragraphs = "".join(f"<p>{title} information for Fixture Botanics customers, section {n}. We reply to every message within two business days.</p>" for n in range(1, 6))
+        return self._layout(base_url, title, f"<h1>{title}</h1>{paragraphs}")
+
+    def robots(self, base_url: str) -> str:
+        return f"User-agent: *\nDisallow: /cart\nDisallow: /checkout\n\nSitemap: {base_url}/sitemap.xml\n"
+
+    def _urlset(self, entries: List[Tuple[str, str]]) -> str:
+        urls = "".join(f"<url><loc>{escape(loc)}</loc><lastmod>{lastmod}</lastmod></url>" for loc, lastmod in entries)
+        return f'<?xml version="1.0" encoding="UTF-8"?><urlset xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">{urls}</urlset>'
+
+    def sitemap_index(self, base_url: str) -> str:
+        children = ["sitemap_pages_1.xml", "sitemap_collections_1.xml", "sitemap_products_1.xml.gz"]
+        sitemaps = "".join(f"<sitemap><loc>{base_url}/{child}</loc></sitemap>" for child in children)
+        return f'<?xml version="1.0" encoding="UTF-8"?><sitemapindex xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">{sitemaps}</sitemapindex>'
+
+    def sitemap(self, base_url: str, name: str) -> Optional[str]:
+        lastmod = self.updated.strftime("%Y-%m-%d")
+        if name == "sitemap_pages_1.xml":
+            return self._urlset([(f"{base_url}/", lastmod)] + [(f"{base_url}/pages/{p}", lastmod) for p in self.PAGES])
+        if name == "sitemap_collections_1.xml":
+            return self._urlset([(f"{base_url}/collections/{c}", lastmod) for c in ["all"] + self.CATEGORIES])
+        if name == "sitemap_products_1.xml.gz":
+            return self._urlset([(f"{base_url}/products/{p['slug']}", p["lastmod"]) for p in self.products])
+        return None
+
+    def render(self, base_url: str, path: str, query: Dict[str, List[str]]) -> Tuple[int, str, bytes]:
+        """(status, content type, body) for a request path"""
+        html = "text/html; charset=utf-8"
+        if path == "/robots.txt":
+            return 200, "text/plain; charset=utf-8", self.robots(base_url).encode()
+        if path == "/sitemap.xml":
+            return 200, "application/xml", self.sitemap_index(base_url).encode()
+        if path.startswith("/sitemap_"):
+            body = self.sitemap(base_url, path[1:])
+            if body is None:
+                return 404, "text/plain", b"Not found"
+            if path.endswith(".gz"):
+                return 200, "application/x-gzip", gzip.compress(body.encode(), mtime=0)
+            return 200, "application/xml", body.encode()
+        if path == "/":
+            return 200, html, self.home(base_url).encode()
+        page = None
+        if path.startswith("/collections/"):
+            try:
+                number = int(query.get("page", ["1"])[0])
+            except ValueError:
+                number = 0
+            page = self.collection_page(base_url, path.split("/")[2], number)
+        elif path.startswith("/products/"):
+            page = self.product_page(base_url, path.split("/")[2])
+        elif path.startswith("/pages/"):
+            page = self.static_page(base_url, path.split("/")[2])
+        if page is None:
+            return 404, html, self._layout(base_url, "Not found", "<h1>Page not found</h1>").encode()
+        return 200, html, page.encode()
+
+
+class FixtureServer:
+    """Serves a FixtureShop on 127.0.0.1 from a background thread, with optional per-request latency"""
+
+    def __init__(self, shop: FixtureShop, latency_ms: float = 0, port: int = 0):
+        self.shop = shop
+        self.latency = latency_ms / 1000
+        self.port = port
+        self.requests = 0
+        self.lock = threading.Lock()
+        self.httpd = None
+        self.thread = None
+
+    @property
+    def base_url(self) -> str:
+        return f"http://127.0.0.1:{self.httpd.server_address[1]}"
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def _respond(self, include_body: bool):
+                with server.lock:
+                    server.requests += 1
+                if server.latency:
+                    time.sleep(server.latency)
+                parts = urlsplit(self.path)
+                status, content_type, body = server.shop.render(server.base_url, parts.path, parse_qs(parts.query))
+                etag = '"' + hashlib.sha1(body).hexdigest()[:16] + '"'
+                if status == 200 and self.headers.get("If-None-Match") == etag:
+                    self.send_response(304)
+                    self.send_header("ETag", etag)
+                    self.send_header("Content-Length", "0")
+                    self.end_headers()
+                    return
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.send_header("ETag", etag)
+                self.send_header("Last-Modified", "Mon, 01 Jan 2024 00:00:00 GMT")
+                self.end_headers()
+                if include_body:
+                    self.wfile.write(body)
+
+            def do_GET(self):
+                self._respond(True)
+
+            def do_HEAD(self):
+                self._respond(False)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def start(self) -> "FixtureServer":
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", self.port), self._handler())
+        self.httpd.daemon_threads = True
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self.thread.start()
+        logger.info(f"🛍️ Fixture shop with {len(self.shop.products)} products serving at {self.base_url}")
+        return self
+
+    def stop(self):
+        if self.httpd:
+            self.httpd.shutdown()
+            self.httpd.server_close()
+            self.httpd = None
+
+
+class LocalS3Client:
+    """The subset of the boto3 S3 client used by AWSService, backed by a local directory"""
+
+    def __init__(self, root: Path, latency_ms: float = 0):
+        self.root = root
+        self.latency = latency_ms / 1000
+        self.puts = 0
+        self.bytes_written = 0
+        self.lock = threading.Lock()
+
+    def _path(self, bucket: str, key: str) -> Path:
+        return self.root / bucket / key
+
+    def _write(self, bucket: str, key: str, data: bytes):
+        if self.latency:
+            time.sleep(self.latency)
+        path = self._path(bucket, key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(data)
+        with self.lock:
+            self.puts += 1
+            self.bytes_written += len(data)
+
+    def head_bucket(self, Bucket: str):
+        return {}
+
+    def upload_file(self, Filename: str, Bucket: str, Key: str, ExtraArgs: Optional[dict] = None):
+        self._write(Bucket, Key, Path(Filename).read_bytes())
+
+    def put_object(self, Bucket: str, Key: str, Body: bytes, **kwargs):
+        self._write(Bucket, Key, Body)
+        return {}
+
+    def get_object(self, Bucket: str, Key: str):
+        path = self._path(Bucket, Key)
+        if not path.exists():
+            raise ClientError({"Error": {"Code": "NoSuchKey", "Message": Key}}, "GetObject")
+        return {"Body": io.BytesIO(path.read_bytes())}
+
+
+class LocalTable:
+    """In-memory stand-in for the DynamoDB orchestration log table"""
+
+    def __init__(self):
+        self.items = []
+
+    def put_item(self, Item: dict):
+        self.items.append(Item)
+        return {"ResponseMetadata": {"HTTPStatusCode": 200}}
+
+    def get_item(self, Key: dict):
+        return {}
+
+
+class LocalAWSService(app.AWSService):
+    """AWSService whose S3 and DynamoDB clients are local fakes; upload and download logic is unchanged"""
+
+    s3_root = Path("/tmp/bodhium_benchmark/s3")
+    s3_latency_ms = 0.0
+
+    def __init__(self):
+        self.aws_region = "us-east-1"
+        self.s3_bucket = "benchmark-bucket"
+        self.dynamodb_table = "benchmark-orchestration-logs"
+        self.s3_client = LocalS3Client(self.s3_root, self.s3_latency_ms)
+        self.table = LocalTable()
+
+
+class FakeGeminiModel:
+    """Replaces genai.GenerativeModel: returns the fixture products named in the prompt content
+
+    Token counts are estimated at four characters per token so the crawler's
+    cost accounting runs as it would against the real API.
+    """
+
+    def __init__(self, shop: FixtureShop, latency_ms: float = 800, jitter: float = 0.25, seed: int = 7):
+        self.products = {product["name"]: product for product in shop.products}
+        names = sorted(self.products, key=len, reverse=True)
+        self.pattern = re.compile(r'(' + '|'.join(re.escape(name) for name in names) + r')(?!\d)')
+        self.latency = latency_ms / 1000
+        self.jitter = jitter
+        self.rng = random.Random(seed)
+        self.calls = 0
+
+    async def generate_content_async(self, prompt: str):
+        self.calls += 1
+        content = prompt.split("CONTENT:\n", 1)[-1]
+        url_match = re.search(r'"source_url": "([^"]*)"', prompt)
+        products = []
+        for name in dict.fromkeys(self.pattern.findall(content)):
+            product = self.products[name]
+            price = app.format_price(f"{product['price']:.2f}", product["currency"])
+            products.append({
+                "productname": name,
+                "description": product["description"],
+                "current_price": price,
+                "original_price": app.format_price(f"{product['compare_at']:.2f}", product["currency"]) if product["compare_at"] else price,
+                "rating": str(product["rating"]),
+                "review": str(product["reviews"]),
+                "image_url": "N/A",
+                "source_url": url_match.group(1) if url_match else "N/A",
+            })
+        text = json.dumps(products)
+        if self.latency:
+            await asyncio.sleep(self.latency * self.rng.uniform(1 - self.jitter, 1 + self.jitter))
+        return SimpleNamespace(
+            text=text,
+            usage_metadata=SimpleNamespace(prompt_token_count=len(prompt) // 4, candidates_token_count=len(text) // 4)
+        )
+
+
+@contextmanager
+def local_services(s3_root: Path, s3_latency_ms: float, fake_llm: bool = True):
+    """Route the crawler's AWS clients, and the Gemini key lookup when the model is faked, to local fakes"""
+    original_aws, original_secret = app.AWSService, app.get_secret
+    LocalAWSService.s3_root = s3_root
+    LocalAWSService.s3_latency_ms = s3_latency_ms
+    app.AWSService = LocalAWSService
+    if fake_llm:
+        app.get_secret = lambda *args, **kwargs: "benchmark-key"
+    try:
+        yield
+    finally:
+        app.AWSService, app.get_secret = original_aws, original_secret
+
+
+def parse_concurrency(value: str) -> List[Dict[str, int]]:
+    """"1,4,8" or "4:2,8:4" (pages:extraction workers) into run settings"""
+    settings = []
+    for part in value.split(","):
+        part = part.strip()
+        if not part:
+            continue
+        pages, _, workers = part.partition(":")
+        pages = max(1, int(pages))
+        settings.append({"pages": pages, "extraction_workers": max(1, int(workers)) if workers else pages})
+    if not settings:
+        raise argparse.ArgumentTypeError("at least one concurrency setting is required")
+    return settings
+
+
+def run_environment(setting: Dict[str, int], args: argparse.Namespace, shop: FixtureShop, cache_dir: Path) -> Dict[str, str]:
+    """Crawler configuration for one run; features that depend on earlier jobs are off so runs are comparable"""
+    return {
+        "MAX_CONCURRENT_PAGES": str(setting["pages"]),
+        "MAX_CONCURRENT_PER_DOMAIN": str(setting["pages"]),
+        "EXTRACTION_WORKERS": str(setting["extraction_workers"]),
+        "PERSIST_WORKERS": str(args.persist_workers),
+        "MAX_URLS": str(args.max_urls or shop.url_count()),
+        "FETCH_TIER_MODE": args.fetch_tier,
+        "RATE_LIMIT_INITIAL_RPS": str(args.rate_limit_rps),
+        "RATE_LIMIT_MAX_RPS": str(args.rate_limit_rps),
+        "RATE_LIMIT_BURST": str(max(setting["pages"], 1)),
+        "CATALOG_INGESTION": "false",
+        "DISCOVERY_CACHE": "false",
+        "DISCOVERY_CACHE_DIR": str(cache_dir),
+        "CONDITIONAL_RECRAWL": "false",
+        "EXTRACTION_CACHE": "false",
+        "MARKDOWN_REDUCTION": args.markdown_reduction,
+        "INCREMENTAL_DISCOVERY": "false",
+        "URL_PRIORITIZATION": "false",
+        "METRICS_EMF_LOG": "false",
+        "LLM_BACKEND_MODE": "live" if args.llm == "fake" else args.llm,
+    }
+
+
+def summarize_run(label: str, environment: Dict[str, str], result: Dict[str, Any], wall_seconds: float,
+                  crawler: "app.EnhancedWebCrawler", shop: FixtureShop) -> Dict[str, Any]:
+    pages = result.get("successful_crawls", 0)
+    tokens = result.get("token_usage", {})
+    input_tokens = tokens.get("total_input_tokens", 0)
+    output_tokens = tokens.get("total_output_tokens", 0)
+    cost = crawler.total_token_usage.total_cost
+    unique_products = crawler.deduplicate_products(crawler.all_products)
+    found = {product.get("productname", "").strip().lower() for product in unique_products}
+    missing = [product["name"] for product in shop.products if product["name"].lower() not in found]
+    stage_timings = result.get("stage_timings") or {}
+    return {
+        "label": label,
+        "environment": environment,
+        "status": result.get("status"),
+        "error": result.get("error"),
+        "wall_seconds": round(wall_seconds, 3),
+        "pages_discovered": result.get("discovered_urls", 0),
+        "pages_crawled": pages,
+        "pages_failed": result.get("failed_crawls", 0),
+        "pages_per_second": round(pages / wall_seconds, 3) if wall_seconds else 0.0,
+        "gemini_calls": crawler.llm.stats["calls"],
+        "llm_backend": crawler.llm.stats,
+        "input_tokens": input_tokens,
+        "output_tokens": output_tokens,
+        "tokens_per_page": round((input_tokens + output_tokens) / max(pages, 1), 1),
+        "cost_usd": round(cost, 6),
+        "cost_per_product_usd": round(cost / max(len(unique_products), 1), 8),
+        "unique_products": len(unique_products),
+        "expected_products": len(shop.products),
+        "recall": round((len(shop.products) - len(missing)) / max(len(shop.products), 1), 4),
+        "missing_products": missing[:20],
+        "slowest_stage": stage_timings.get("slowest_stage"),
+        "stage_timings": stage_timings.get("stages", {}),
+        "pipeline_stats": result.get("pipeline_stats", {}),
+        "fetch_tier": result.get("fetch_tier", {}),
+        "structured_data": tokens.get("structured_data", {}),
+        "markdown_reduction": tokens.get("markdown_reduction", {}),
+        "near_duplicates": result.get("near_duplicates", {}),
+    }
+
+
+async def run_once(setting: Dict[str, int], args: argparse.Namespace, shop: FixtureShop, base_url: str, work_dir: Path) -> Dict[str, Any]:
+    label = f"pages={setting['pages']} extraction={setting['extraction_workers']}"
+    run_dir = work_dir / f"p{setting['pages']}-e{setting['extraction_workers']}"
+    environment = run_environment(setting, args, shop, run_dir / "discovery_cache")
+    saved = {key: os.environ.get(key) for key in environment}
+    os.environ.update(environment)
+    try:
+        logger.info(f"🏁 Benchmark run {label}")
+        crawler = app.EnhancedWebCrawler(args.model, str(run_dir / "output"), job_id=f"benchmark-{int(time.time() * 1000)}")
+        if args.llm == "fake":
+            crawler.llm = LiveBackend(FakeGeminiModel(shop, args.gemini_latency_ms, seed=args.seed), args.model)
+        start = time.perf_counter()
+        result = await crawler.run(base_url, job_id=crawler.job_id)
+        wall_seconds = time.perf_counter() - start
+    finally:
+        for key, value in saved.items():
+            if value is None:
+                os.environ.pop(key, None)
+            else:
+                os.environ[key] = value
+    summary = summarize_run(label, environment, result, wall_seconds, crawler, shop)
+    logger.info(f"📊 {label}: {summary['pages_per_second']} pages/s, {summary['tokens_per_page']} tokens/page, "
+                f"recall {summary['recall']:.1%}, slowest stage {summary['slowest_stage']}")
+    return summary
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True,
+                              cwd=Path(__file__).parent).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+async def run_benchmark(args: argparse.Namespace) -> Dict[str, Any]:
+    shop = FixtureShop(args.products, args.page_size, args.jsonld_ratio, args.seed)
+    work_dir = Path(args.work_dir)
+    if work_dir.exists():
+        shutil.rmtree(work_dir)
+    work_dir.mkdir(parents=True)
+    server = FixtureServer(shop, args.server_latency_ms, args.port).start()
+    runs = []
+    try:
+        with local_services(work_dir / "s3", args.s3_latency_ms, args.llm == "fake"):
+            for setting in args.concurrency:
+                runs.append(await run_once(setting, args, shop, server.base_url, work_dir))
+    finally:
+        server.stop()
+    completed = [run for run in runs if run["status"] == "success"]
+    return {
+        "generated_at": datetime.now().isoformat(),
+        "git_commit": git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "fixture": {
+            "products": len(shop.products),
+            "page_size": shop.page_size,
+            "json_ld_products": sum(1 for p in shop.products if p["json_ld"]),
+            "sitemap_urls": shop.url_count(),
+            "server_latency_ms": args.server_latency_ms,
+            "requests_served": server.requests,
+        },
+        "fakes": {"llm": args.llm, "gemini_latency_ms": args.gemini_latency_ms, "s3_latency_ms": args.s3_latency_ms, "model": args.model},
+        "fastest": max(completed, key=lambda run: run["pages_per_second"])["label"] if completed else None,
+        "runs": runs,
+    }
+
+
+def print_table(report: Dict[str, Any]):
+    header = f"{'setting':<26}{'pages/s':>9}{'wall s':>9}{'tokens/pg':>11}{'$/product':>12}{'recall':>8}  slowest stage"
+    print(header)
+    print("-" * len(header))
+    for run in report["runs"]:
+        print(f"{run['label']:<26}{run['pages_per_second']:>9}{run['wall_seconds']:>9}{run['tokens_per_page']:>11}"
+              f"{run['cost_per_product_usd']:>12.6f}{run['recall']:>8.1%}  {run['slowest_stage'] or run['error']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='End-to-end crawler benchmark against a local fixture storefront')
+    parser.add_argument('--concurrency', type=parse_concurrency, default=parse_concurrency("1,4,8"),
+                        help='Comma separated MAX_CONCURRENT_PAGES values, optionally pages:extraction_workers (default: 1,4,8)')
+    parser.add_argument('--products', type=int, default=200, help='Number of fixture products')
+    parser.add_argument('--page-size', type=int, default=24, help='Products per collection page')
+    parser.add_argument('--jsonld-ratio', type=float, default=0.7, help='Share of product pages carrying JSON-LD')
+    parser.add_argument('--port', type=int, default=0, help='Fixture server port (default: any free port)')
+    parser.add_argument('--server-latency-ms', type=float, default=50, help='Delay added to every fixture response')
+    parser.add_argument('--llm', choices=['fake', 'live', 'record', 'replay'], default='fake',
+                        help='fake answers from the fixture catalogue; the others set LLM_BACKEND_MODE')
+    parser.add_argument('--gemini-latency-ms', type=float, default=800, help='Mean latency of the fake Gemini model')
+    parser.add_argument('--s3-latency-ms', type=float, default=20, help='Delay added to every fake S3 upload')
+    parser.add_argument('--persist-workers', type=int, default=2, help='PERSIST_WORKERS for every run')
+    parser.add_argument('--fetch-tier', choices=['http', 'auto', 'browser'], default='http',
+                        help='FETCH_TIER_MODE; auto and browser need Playwright browsers installed')
+    parser.add_argument('--markdown-reduction', choices=['true', 'false'], default='true',
+                        help='MARKDOWN_REDUCTION; run once with each to compare tokens/page and recall')
+    parser.add_argument('--rate-limit-rps', type=float, default=1000, help='Per-domain rate limit, high so concurrency is the bottleneck')
+    parser.add_argument('--max-urls', type=int, default=0, help='MAX_URLS (default: every URL in the fixture sitemaps)')
+    parser.add_argument('--model', type=str, default='gemini-1.5-flash', help='Model name used for pricing')
+    parser.add_argument('--seed', type=int, default=7, help='Seed for fixture content and fake latencies')
+    parser.add_argument('--work-dir', type=str, default='/tmp/bodhium_benchmark', help='Scratch directory, cleared on start')
+    parser.add_argument('--report', type=str, default='benchmark_report.json', help='Where to write the JSON report')
+    args = parser.parse_args()
+
+    os.environ.setdefault("DB_CREDENTIALS_SOURCE", "env")
+    os.environ.setdefault("DB_SSLMODE", "disable")
+
+    report = asyncio.run(run_benchmark(args))
+    with open(args.report, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2, ensure_ascii=False)
+    print_table(report)
+    logger.info(f"💾 Benchmark report written to {args.report}")
+
+
+if __name__ == "__main__":
+    main()
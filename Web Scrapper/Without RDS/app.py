@@ -5,11 +5,12 @@ import time
 import re
 import sys
 import argparse
-from typing import List, Dict, Any, Set, Optional
+import contextvars
+from typing import List, Dict, Any, Set, Optional, Callable
 from pydantic import BaseModel
 from dotenv import load_dotenv
 import google.generativeai as genai
-from crawl4ai import AsyncWebCrawler, CrawlerRunConfig, CacheMode, AsyncUrlSeeder, SeedingConfig
+from crawl4ai import AsyncWebCrawler, BrowserConfig, CrawlerRunConfig, CacheMode, AsyncUrlSeeder, SeedingConfig
 import logging
 from urllib.parse import urlparse, urljoin
 from base64 import b64decode
@@ -19,7 +20,6 @@ import hashlib
 from datetime import datetime
 import boto3
 from botocore.exceptions import ClientError, NoCredentialsError
-import io
 import uuid
 
 # Set up logging
@@ -80,6 +80,7 @@ class CrawlMetrics(BaseModel):
     success: bool
     error_message: Optional[str] = None
     token_usage: Optional[TokenUsage] = None
+    page_setup_ms: Optional[float] = None
 
 class AWSService:
     """AWS service handler for S3 and DynamoDB operations"""
@@ -163,6 +164,188 @@ class AWSService:
             logger.error(f"❌ Failed to upload JSON to S3: {e}")
             return ""
 
+# Per-page state shared between a crawl task and the browser hooks that run inside
+# crawler.arun(). Each task sets its own dict, so hooks always see the page they belong to.
+_page_context: contextvars.ContextVar = contextvars.ContextVar("page_context", default=None)
+
+def page_markdown_header(url: str) -> str:
+    return f"# Content from {url}\n\n**URL:** [{url}]({url})\n\n---\n\n"
+
+def read_page_markdown(markdown_file: str, url: str) -> str:
+    """Read a page's markdown back from the file crawl_single_url wrote, without the header it added"""
+    with open(markdown_file, 'r', encoding='utf-8') as f:
+        content = f.read()
+    header = page_markdown_header(url)
+    return content[len(header):] if content.startswith(header) else content
+
+class BrowserPool:
+    """Job-scoped pool of long-lived browsers that hand out an isolated page per URL"""
+
+    BROWSER_FAILURE_MARKERS = (
+        "has been closed",
+        "browser closed",
+        "connection closed",
+        "target crashed",
+    )
+
+    def __init__(self, browser_config: BrowserConfig, size: int = 1, pages_per_browser: int = 1, max_pages_per_browser: int = 0):
+        logger.info(f"🌐 Initializing BrowserPool: size={size}, pages_per_browser={pages_per_browser}, recycle_after={max_pages_per_browser or 'never'}")
+        self.browser_config = browser_config
+        self.size = max(1, size)
+        self.pages_per_browser = max(1, pages_per_browser)
+        self.max_pages_per_browser = max(0, max_pages_per_browser)
+        self.browsers: List[Dict[str, Any]] = []
+        self.hooks: Dict[str, List[Callable]] = {}
+        self.condition = None
+        self.started = False
+        self.start_lock = asyncio.Lock()
+        self.pending_launches = 0
+        self.browsers_launched = 0
+        self.pages_served = 0
+        self.browser_launch_ms: List[float] = []
+        self.page_setup_ms: List[float] = []
+
+    def add_hook(self, hook_type: str, hook: Callable):
+        """Register an extra crawl4ai hook; hooks of the same type run in registration order"""
+        self.hooks.setdefault(hook_type, []).append(hook)
+        for entry in self.browsers:
+            self._install_hooks(entry["crawler"])
+
+    async def start(self):
+        async with self.start_lock:
+            if self.started:
+                return
+            logger.info(f"🚀 Starting browser pool with {self.size} browser(s)")
+            self.condition = asyncio.Condition()
+            for _ in range(self.size):
+                self.browsers.append(await self._launch_browser())
+            self.started = True
+            logger.info(f"✅ Browser pool ready")
+
+    async def close(self):
+        if not self.started:
+            return
+        logger.info(f"🔄 Closing browser pool ({len(self.browsers)} browser(s))")
+        for entry in self.browsers:
+            await self._close_browser(entry)
+        self.browsers = []
+        self.started = False
+        logger.info(f"✅ Browser pool closed: {self.get_stats()}")
+
+    async def _launch_browser(self) -> Dict[str, Any]:
+        launch_start = time.perf_counter()
+        crawler = AsyncWebCrawler(config=self.browser_config)
+        self._install_hooks(crawler)
+        await crawler.start()
+        launch_ms = (time.perf_counter() - launch_start) * 1000
+        self.browsers_launched += 1
+        self.browser_launch_ms.append(launch_ms)
+        logger.info(f"🚀 Launched browser #{self.browsers_launched} in {launch_ms:.0f}ms")
+        return {"crawler": crawler, "active": 0, "pages_served": 0, "retiring": False}
+
+    async def _close_browser(self, entry: Dict[str, Any]):
+        try:
+            await entry["crawler"].close()
+        except Exception as e:
+            logger.warning(f"⚠️ Failed to close browser cleanly: {e}")
+
+    def _install_hooks(self, crawler: AsyncWebCrawler):
+        crawler.crawler_strategy.set_hook("on_page_context_created", self._on_page_context_created)
+        for hook_type in self.hooks:
+            if hook_type != "on_page_context_created":
+                crawler.crawler_strategy.set_hook(hook_type, self._make_hook_chain(hook_type))
+
+    def _make_hook_chain(self, hook_type: str) -> Callable:
+        async def run_hooks(*args, **kwargs):
+            for hook in self.hooks.get(hook_type, []):
+                result = hook(*args, **kwargs)
+                if asyncio.iscoroutine(result):
+                    await result
+            return args[0] if args else kwargs.get("page")
+        return run_hooks
+
+    async def _on_page_context_created(self, page, **kwargs):
+        page_ctx = _page_context.get()
+        if page_ctx is not None and page_ctx.get("arun_started") is not None:
+            setup_ms = (time.perf_counter() - page_ctx["arun_started"]) * 1000
+            page_ctx["page_setup_ms"] = setup_ms
+            self.page_setup_ms.append(setup_ms)
+        return await self._make_hook_chain("on_page_context_created")(page, **kwargs)
+
+    async def _acquire(self) -> Dict[str, Any]:
+        async with self.condition:
+            while True:
+                candidates = [b for b in self.browsers if not b["retiring"] and b["active"] < self.pages_per_browser]
+                if candidates:
+                    entry = min(candidates, key=lambda b: b["active"])
+                    entry["active"] += 1
+                    return entry
+                if not self.browsers and self.pending_launches == 0:
+                    raise RuntimeError("Browser pool has no live browsers")
+                await self.condition.wait()
+
+    async def _release(self, entry: Dict[str, Any], broken: bool = False):
+        async with self.condition:
+            entry["active"] -= 1
+            entry["pages_served"] += 1
+            if broken or (self.max_pages_per_browser and entry["pages_served"] >= self.max_pages_per_browser):
+                entry["retiring"] = True
+            replace = entry["retiring"] and entry["active"] == 0 and entry in self.browsers
+            if replace:
+                self.browsers.remove(entry)
+                self.pending_launches += 1
+            self.condition.notify_all()
+        if not replace:
+            return
+        reason = "browser failure" if broken else f"{entry['pages_served']} pages served"
+        logger.info(f"♻️ Recycling browser ({reason})")
+        await self._close_browser(entry)
+        new_entry = None
+        try:
+            new_entry = await self._launch_browser()
+        except Exception as e:
+            logger.error(f"❌ Failed to relaunch browser: {e}")
+        async with self.condition:
+            self.pending_launches -= 1
+            if new_entry:
+                self.browsers.append(new_entry)
+            self.condition.notify_all()
+
+    def _is_browser_failure(self, error: Exception) -> bool:
+        message = str(error).lower()
+        return any(marker in message for marker in self.BROWSER_FAILURE_MARKERS)
+
+    async def arun(self, url: str, config: CrawlerRunConfig):
+        """Render a URL in a fresh page of a pooled browser"""
+        if not self.started:
+            await self.start()
+        entry = await self._acquire()
+        page_ctx = _page_context.get()
+        if page_ctx is None:
+            page_ctx = {"url": url}
+            _page_context.set(page_ctx)
+        page_ctx["arun_started"] = time.perf_counter()
+        broken = False
+        try:
+            result = await entry["crawler"].arun(url=url, config=config)
+            self.pages_served += 1
+            return result
+        except Exception as e:
+            broken = self._is_browser_failure(e)
+            raise
+        finally:
+            await self._release(entry, broken)
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "browsers_launched": self.browsers_launched,
+            "pages_served": self.pages_served,
+            "launches_saved": max(self.pages_served - self.browsers_launched, 0),
+            "avg_browser_launch_ms": round(sum(self.browser_launch_ms) / max(len(self.browser_launch_ms), 1), 1),
+            "avg_page_setup_ms": round(sum(self.page_setup_ms) / max(len(self.page_setup_ms), 1), 1),
+            "max_page_setup_ms": round(max(self.page_setup_ms, default=0.0), 1)
+        }
+
 class EnhancedWebCrawler:
     def __init__(self, model_name: str, output_dir: str):
         logger.info(f"🤖 Initializing EnhancedWebCrawler with model: {model_name}")
@@ -221,6 +404,14 @@ class EnhancedWebCrawler:
             )
         )
         logger.info(f"✅ Gemini model {self.model_name} initialized successfully")
+
+        logger.info("🌐 Configuring job-scoped browser pool")
+        self.browser_pool = BrowserPool(
+            BrowserConfig(browser_type="chromium", headless=True, verbose=False),
+            size=int(os.getenv("BROWSER_POOL_SIZE", "1")),
+            pages_per_browser=int(os.getenv("BROWSER_PAGES_PER_BROWSER", "1")),
+            max_pages_per_browser=int(os.getenv("BROWSER_MAX_PAGES", "100"))
+        )
         self.all_products = []
         self.processed_urls = set()
         self.crawl_metrics = []
@@ -499,9 +690,14 @@ class EnhancedWebCrawler:
                 remove_overlay_elements=True
             )
             logger.info(f"🔄 Starting crawler for URL: {url}")
-            async with AsyncWebCrawler(verbose=False) as crawler:
-                logger.info(f"⏳ Crawler running on {url} (this may take a while)")
-                result = await crawler.arun(url=url, config=config)
+            # Render in a fresh page of the job's pooled browser instead of launching Chromium per URL
+            page_ctx = {"url": url, "domain": domain}
+            _page_context.set(page_ctx)
+            logger.info(f"⏳ Crawler running on {url} (this may take a while)")
+            result = await self.browser_pool.arun(url, config)
+            page_setup_ms = page_ctx.get("page_setup_ms")
+            if page_setup_ms is not None:
+                logger.info(f"⏱️ Page setup took {page_setup_ms:.0f}ms on pooled browser")
             crawl_end_time = datetime.now()
             crawl_duration = (crawl_end_time - crawl_start_time).total_seconds() * 1000
 
@@ -514,13 +710,14 @@ class EnhancedWebCrawler:
                     crawl_duration_ms=int(crawl_duration),
                     content_length=0,
                     success=False,
-                    error_message="No content returned"
+                    error_message="No content returned",
+                    page_setup_ms=page_setup_ms
                 )
                 self.crawl_metrics.append(crawl_metric)
                 return {'url': url, 'filename': filename, 'success': False, 'content_length': 0}
 
-            # Save and log content
-            markdown_content = f"# Content from {url}\n\n**URL:** [{url}]({url})\n\n---\n\n{result.markdown}"
+            # Save and log content; from here on the page body only lives on disk and in S3
+            markdown_content = page_markdown_header(url) + result.markdown
             markdown_file = self.markdown_dir / f"{filename}.md"
             with open(markdown_file, 'w', encoding='utf-8') as f:
                 f.write(markdown_content)
@@ -528,8 +725,8 @@ class EnhancedWebCrawler:
             logger.info(f"🔎 Markdown _snippet_ for {url}: {markdown_content[:200].replace(chr(10),' ')} ...")
 
             s3_markdown_key = f"{self.s3_base_path}/markdown/{filename}.md"
-            s3_markdown_url = self.aws_service.upload_string_to_s3(
-                markdown_content, s3_markdown_key, "text/markdown"
+            s3_markdown_url = self.aws_service.upload_to_s3(
+                str(markdown_file), s3_markdown_key, "text/markdown"
             )
             screenshot_file = ""
             s3_screenshot_url = ""
@@ -557,7 +754,8 @@ class EnhancedWebCrawler:
                 crawl_end_time=crawl_end_time.isoformat(),
                 crawl_duration_ms=int(crawl_duration),
                 content_length=len(result.markdown),
-                success=True
+                success=True,
+                page_setup_ms=page_setup_ms
             )
             self.crawl_metrics.append(crawl_metric)
             return {
@@ -569,7 +767,6 @@ class EnhancedWebCrawler:
                 'screenshot_file': str(screenshot_file) if screenshot_file else "",
                 's3_markdown_url': s3_markdown_url,
                 's3_screenshot_url': s3_screenshot_url,
-                'markdown_content': result.markdown,
                 'crawl_duration_ms': int(crawl_duration)
             }
         except Exception as e:
@@ -707,22 +904,15 @@ CONTENT:
         csv_file = self.csv_dir / csv_filename
         logger.info(f"📊 Saving {len(products)} products to CSV: {csv_filename}")
         try:
-            csv_content = io.StringIO()
-            if products:
-                fieldnames = list(products[0].keys())
-                writer = csv.DictWriter(csv_content, fieldnames=fieldnames)
+            fieldnames = list(products[0].keys()) if products else list(ProductInfo.model_fields.keys())
+            # Rows go straight to disk and the file is uploaded, so no full copy of the CSV is held in memory
+            with open(csv_file, 'w', encoding='utf-8', newline='') as f:
+                writer = csv.DictWriter(f, fieldnames=fieldnames)
                 writer.writeheader()
                 writer.writerows(products)
-            else:
-                fieldnames = list(ProductInfo.model_fields.keys())
-                writer = csv.DictWriter(csv_content, fieldnames=fieldnames)
-                writer.writeheader()
-            csv_string = csv_content.getvalue()
-            with open(csv_file, 'w', encoding='utf-8') as f:
-                f.write(csv_string)
             logger.info(f"✅ Saved CSV locally to: {csv_file}")
             s3_key = f"{self.s3_base_path}/csv/{csv_filename}"
-            s3_url = self.aws_service.upload_string_to_s3(csv_string, s3_key, "text/csv")
+            s3_url = self.aws_service.upload_to_s3(str(csv_file), s3_key, "text/csv")
             if s3_url:
                 self.s3_urls[f'csv_{filename_suffix}'] = s3_url
             logger.info(f"✅ Saved {len(products)} products to CSV locally and S3")
@@ -805,7 +995,8 @@ CONTENT:
                 json.dump(output_data, f, indent=2, ensure_ascii=False)
             logger.info(f"✅ Saved JSON locally")
             s3_key = f"{self.s3_base_path}/json/{json_filename}"
-            s3_url = self.aws_service.upload_json_to_s3(output_data, s3_key)
+            # json.dump above wrote the file in chunks; upload it instead of re-serialising output_data
+            s3_url = self.aws_service.upload_to_s3(str(json_file), s3_key, "application/json")
             if s3_url:
                 self.s3_urls['json_results'] = s3_url
             logger.info(f"✅ Uploaded JSON to S3: {s3_url}")
@@ -951,6 +1142,7 @@ CONTENT:
             # Step 4: Crawl each URL
             logger.info(f"\n🕸️ STEP 4: Starting to crawl {len(discovered_urls)} URLs...")
             
+            await self.browser_pool.start()
             crawl_results = []
             for i, url_info in enumerate(discovered_urls, 1):
                 url = url_info['url']
@@ -960,10 +1152,10 @@ CONTENT:
                 crawl_results.append(result)
                 
                 # Extract products if crawl was successful
-                if result.get('success') and result.get('markdown_content'):
+                if result.get('success') and result.get('content_length'):
                     logger.info(f"🔍 Extracting products from {url}")
                     products = await self.extract_products_from_content(
-                        result['markdown_content'], url
+                        read_page_markdown(result['markdown_file'], url), url
                     )
                     self.all_products.extend(products)
                     logger.info(f"✅ Added {len(products)} products from {url}")
@@ -973,6 +1165,9 @@ CONTENT:
                 logger.info(f"⏱️ Waiting 1 second before next URL...")
                 await asyncio.sleep(1)  # Be respectful to the server
             
+            await self.browser_pool.close()
+            browser_pool_stats = self.browser_pool.get_stats()
+            
             # Step 5: Process products
             logger.info(f"\n🔄 STEP 5: Processing {len(self.all_products)} total products...")
             unique_products = self.deduplicate_products(self.all_products)
@@ -1006,6 +1201,7 @@ CONTENT:
                 "s3_base_path": self.s3_base_path,
                 "s3_urls": self.s3_urls,
                 "local_output_directory": str(self.output_dir),
+                "browser_pool": browser_pool_stats,
                 "token_usage": {
                     "total_input_tokens": self.total_token_usage.input_tokens,
                     "total_output_tokens": self.total_token_usage.output_tokens,
@@ -1044,6 +1240,7 @@ CONTENT:
             logger.info(f"   Failed crawls: {len(discovered_urls) - successful_crawls}")
             logger.info(f"   Total products found: {len(self.all_products)}")
             logger.info(f"   Unique products: {len(unique_products)}")
+            logger.info(f"   Browser launches: {browser_pool_stats['browsers_launched']} (saved {browser_pool_stats['launches_saved']}), avg page setup: {browser_pool_stats['avg_page_setup_ms']}ms")
             logger.info(f"   Total time: {total_time}s")
             logger.info(f"   Total token cost: \\${self.total_token_usage.total_cost:.4f}")
             logger.info(f"   Local backup: {self.output_dir}")
@@ -1073,6 +1270,9 @@ CONTENT:
             
             self.log_session_to_dynamodb(error_result)
             return error_result
+        
+        finally:
+            await self.browser_pool.close()
 
 async def main():
     """Main function for batch processing"""
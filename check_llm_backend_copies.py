@@ -0,0 +1,52 @@
+"""Check that every copy of llm_backend.py matches the web scraper's
+
+The web scraper, the query generator and the Perplexity/ChatGPT formatter are
+built from their own directories, so each ships its own llm_backend.py.
+Web Scrapper/RDS/llm_backend.py is the source; this script exits with status 1
+and prints a diff when another copy differs. --sync overwrites the copies.
+
+    python check_llm_backend_copies.py [--sync]
+"""
+import argparse
+import difflib
+import shutil
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent
+SOURCE = ROOT / "Web Scrapper" / "RDS" / "llm_backend.py"
+COPIES = [
+    ROOT / "Query Generator " / "llm_backend.py",
+    ROOT / "Other LLM's" / "ChatGPT" / "Perplexity with Crawl4Ai" / "llm_backend.py",
+]
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sync', action='store_true', help='Overwrite the copies with the web scraper version')
+    args = parser.parse_args()
+
+    source = SOURCE.read_text(encoding='utf-8')
+    diverged = []
+    for copy in COPIES:
+        current = copy.read_text(encoding='utf-8') if copy.exists() else ""
+        if current == source:
+            continue
+        if args.sync:
+            shutil.copyfile(SOURCE, copy)
+            print(f"🔄 Synced {copy.relative_to(ROOT)}")
+            continue
+        diverged.append(copy)
+        sys.stdout.writelines(difflib.unified_diff(
+            source.splitlines(keepends=True), current.splitlines(keepends=True),
+            fromfile=str(SOURCE.relative_to(ROOT)), tofile=str(copy.relative_to(ROOT))
+        ))
+    if diverged:
+        print(f"❌ {len(diverged)} copy(ies) of llm_backend.py differ from {SOURCE.relative_to(ROOT)}; run with --sync")
+        return 1
+    print(f"✅ {len(COPIES)} copies of llm_backend.py match {SOURCE.relative_to(ROOT)}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())